@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""Recursively adds lyrics to the user's downloaded songs that have none"""
+
+from argparse import ArgumentParser
+from os import path, walk
+from mutagen import File, MutagenError
+from engine import lyrics, storage, use_library
+from engine.titles import AUDIO_EXTENSIONS
+
+
+def read_song(file_path: str) -> tuple:
+    """Reads the artist and title of a song without lyrics
+
+    Args:
+        file_path (str): the path of the audio file
+
+    Returns:
+        tuple: the artist and title, or None if the song has lyrics or no title
+    """
+    try:
+        audio = File(file_path)
+        easy = File(file_path, easy=True)
+    except MutagenError:
+        return None
+    if not audio or not easy or not audio.tags:
+        return None
+
+    # USLT frames, mp4 atoms, or vorbis comments
+    if any(key.startswith('USLT') or key in ('\xa9lyr', 'lyrics')
+           for key in audio.tags.keys()):
+        return None
+
+    title = easy.get('title', [''])[0]
+    if not title:
+        return None
+
+    return (easy.get('artist', [''])[0], title)
+
+
+def process_directory(directory: str) -> list:
+    """Queues every song without lyrics in a directory and its subdirectories
+
+    Args:
+        directory (str): the folder with the songs
+
+    Returns:
+        list: the futures of the queued songs
+    """
+    queued = []
+    for root, folders, filenames in walk(directory):
+        # spots keeps its track store and covers in hidden folders
+        folders[:] = [folder for folder in folders if not folder.startswith('.')]
+        for filename in filenames:
+            if not filename.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            file_path = path.join(root, filename)
+            song = read_song(file_path)
+            if song:
+                queued.append(lyrics.submit(file_path, *song))
+
+    return queued
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Add lyrics to songs that have none")
+    parser.add_argument('folder', help='The folder with the songs.')
+    parser.add_argument(
+        '--library', type=str, default='Music',
+        help='The spots library the lyrics are cached in. Defaults to Music.'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=8,
+        help='Number of songs searched for at once.'
+    )
+    args = parser.parse_args()
+
+    if not path.exists(args.folder):
+        print('Folder not found.')
+        exit(1)
+
+    folder = path.abspath(args.folder)
+    lyrics.workers = args.workers
+
+    # lyrics are cached with the spots metadata
+    use_library(args.library)
+    storage.reload()
+
+    print('Adding lyrics...')
+    queued = process_directory(folder)
+    lyrics.wait()
+    storage.save()
+
+    added = sum(1 for future in queued if future.result())
+    print(f'Lyrics added to {added} of {len(queued)} songs!')
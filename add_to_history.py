@@ -1,51 +1,167 @@
 #!/usr/bin/python3
-"""Recursively adds user's downloaded songs to spots history file"""
+"""Recursively adds user's downloaded songs to spots history file
 
-from os import listdir, path, chdir, getcwd
-from sys import argv
-from mutagen.id3 import ID3
-from mutagen.mp3 import MP3, HeaderNotFoundError
+Tags are read on a pool of worker processes, and every song scanned is
+added to the library index with its size and modification time, so a
+later scan only reads the songs that are new or changed.
+"""
 
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count, path, scandir
+from mutagen import File, MutagenError
+from mutagen.easyid3 import EasyID3
+from engine import history, library_index, use_library
+from engine.library_index import LibraryIndex
+from engine.titles import AUDIO_EXTENSIONS
 
-def update_history(file_path):
-    """Update history file with song information"""
+
+def scan(directory: str):
+    """Yields every song in a directory and its subdirectories
+
+    Args:
+        directory (str): the folder with the songs
+
+    Yields:
+        tuple: the path, size and modification time of a song
+    """
+    folders = [directory]
+    while folders:
+        try:
+            entries = scandir(folders.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        # spots keeps its track store and covers in hidden folders
+                        if not entry.name.startswith('.'):
+                            folders.append(entry.path)
+                    elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime_ns
+                except OSError:
+                    continue
+
+
+def read_tags(file_path: str) -> dict:
+    """Reads the artist, title and album of a song
+
+    Args:
+        file_path (str): the path of the audio file
+
+    Returns:
+        dict: the tags of the song, empty if it has none
+    """
     try:
-        song = MP3(file_path, ID3)
-        artist = song.get('TPE1', '')
-        artist = f'{artist} - ' if artist else ''
-        title = song.get('TIT2', '')
-        song_name = f"{artist}{title}"
-        if title:
-            with open(history_file, "a", newline="") as history:
-                history.write(f'{song_name}\n')
-    except (HeaderNotFoundError, KeyError):
-        pass
-
-
-def process_directory(directory):
-    """Process all MP3 files in a directory"""
-    for item in listdir(directory):
-        item_path = path.join(directory, item)
-        if path.isdir(item_path):
-            process_directory(item_path)  # Recursively process subdirectories
-        elif item_path.lower().endswith('.mp3'):
-            update_history(item_path)
+        # only the id3 tags of mp3 files are read, not their audio frames
+        tags = EasyID3(file_path) if file_path.lower().endswith('.mp3') \
+            else File(file_path, easy=True)
+    except MutagenError:
+        return {}
+    if not tags:
+        return {}
+
+    return {
+        key: tags.get(key, [''])[0] for key in ('artist', 'title', 'album')
+    }
+
+
+def history_title(song: dict) -> str:
+    """Returns the title a song is kept in the history as
+
+    Args:
+        song (dict): the artist and title of the song
+
+    Returns:
+        str: "Artist - Title", or '' if the song has no title
+    """
+    title = song.get('title') or ''
+    if not title:
+        return ''
+
+    artist = song.get('artist') or ''
+    song_name = f'{artist} - {title}' if artist else title
+    # the title spots downloads a song as, where '/' would be a folder
+    return song_name.replace('/', '|')
+
+
+def process_directory(directory: str, index: LibraryIndex, workers: int = 0,
+                      rescan: bool = False) -> tuple:
+    """Adds the songs in a directory that are new or changed to the library index
+
+    Args:
+        directory (str): the folder with the songs
+        index (LibraryIndex): the library index, updated with the songs of the folder
+        workers (int, optional): number of processes reading tags. Defaults to the number of CPUs.
+        rescan (bool, optional): read every song, not only new or changed ones. Defaults to False.
+
+    Returns:
+        tuple: the history titles of every song in the folder, and the number of songs read
+    """
+    songs = {file_path: (size, mtime) for file_path, size, mtime in scan(path.abspath(directory))}
+    known = {row['path']: row for row in index.under(directory)}
+
+    # songs removed from the folder are dropped from the index
+    index.remove(*[file_path for file_path in known if file_path not in songs])
+
+    changed = [
+        file_path for file_path, (size, mtime) in songs.items()
+        if rescan or file_path not in known
+        or (known[file_path]['size'], known[file_path]['mtime']) != (size, mtime)
+    ]
+
+    if changed:
+        workers = workers or cpu_count() or 1
+        with ProcessPoolExecutor(workers) as pool:
+            tags = list(pool.map(
+                read_tags, changed, chunksize=max(1, len(changed) // (workers * 8))))
+
+        rows = []
+        for file_path, song in zip(changed, tags):
+            # songs spots downloaded keep their links
+            old = known.get(file_path, {})
+            row = index.row(file_path, {**old, **song}, size=songs[file_path][0],
+                            mtime=songs[file_path][1])
+            rows.append({**row, 'youtube_id': row['youtube_id'] or old.get('youtube_id')})
+        index.add_files(rows)
+        known.update((row['path'], row) for row in rows)
+
+    titles = [history_title(known[file_path]) for file_path in songs]
+    return [title for title in titles if title], len(changed)
 
 
 if __name__ == '__main__':
-    if len(argv) < 2:
-        print("Usage: python script.py folder_path")
+    parser = ArgumentParser(description="Add downloaded songs to the spots history")
+    parser.add_argument('folder', help='The folder with the songs.')
+    parser.add_argument(
+        '--library', type=str, default='Music',
+        help='The spots library with the history file. Defaults to Music.'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=0,
+        help='Number of processes reading tags. Defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        '--rescan', action='store_true',
+        help='Read every song again, not only the new or changed ones.'
+    )
+    args = parser.parse_args()
+
+    if not path.exists(args.folder):
+        print('Folder not found.')
         exit(1)
 
-    folder = argv[1]
+    print('Updating Spots downloads history...')
+    use_library(args.library)
 
-    if path.exists(folder):
-        print('Updating Spots downloads history...')
-        spots_path = getcwd()
-        history_file = f"{spots_path}/Music/.spots_download_history.txt"
+    titles, read = process_directory(args.folder, library_index, args.workers, args.rescan)
 
-        process_directory(folder)
+    # the new titles are written to the history file at once
+    history.batch_size = len(titles) + 1
+    for title in titles:
+        history.add(title)
+    history.flush()
 
-        print('Spots downloads history updated!')
-    else:
-        print('Folder not found.')
+    print(f'{read} songs read, {len(titles)} in history. Spots downloads history updated!')
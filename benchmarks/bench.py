@@ -0,0 +1,410 @@
+#!/usr/bin/python3
+"""Benchmarks spots against local stand-ins for the services it calls
+
+Each scenario runs in a fresh process, on a library in a temporary
+folder, with its api clients pointed at FakeServices. The report has the
+tracks per minute, the p50 and p95 latency of each stage and the peak
+memory of each scenario, and is compared with the last saved baseline.
+
+    python3 -m benchmarks.bench --tracks 40 --latency 30 youtube=120 --error-rate 0.02
+"""
+
+import json
+import logging
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from inspect import getattr_static
+from math import ceil
+from multiprocessing import get_context
+from os import devnull, environ, path
+from sys import platform, stdout
+from tempfile import TemporaryDirectory
+from threading import Lock
+from time import perf_counter
+from benchmarks.fake_services import (FakeServices, PLAYLIST_ID, SERVICES, install,
+                                      spotify_track, video_id)
+
+# the methods timed as the stages of each scenario, as (module, class, method)
+STAGES = {
+    'spotify': ('models.get_spotify_track', 'GetSpotifyTrack', 'resolve_tracks'),
+    'spotify_track': ('models.get_spotify_track', 'GetSpotifyTrack', 'get_track'),
+    'youtube_search': ('models.spotify_to_youtube', 'ProcessSpotifyLink', 'get_youtube_video'),
+    'stream_lookup': ('models.spotify_to_youtube', 'ProcessSpotifyLink', 'download_audio'),
+    'encode': ('models.spotify_to_youtube', 'ProcessSpotifyLink', 'encode_audio'),
+    'deezer': ('models.youtube_to_spotify', 'ProcessYoutubeLink', 'get_metadata'),
+    'cover': ('engine.cover_cache', 'CoverCache', 'get'),
+    'lyrics': ('engine.lyrics', 'LyricsStage', 'lookup'),
+    'storage_new': ('engine.file_storage', 'FileStorage', 'new'),
+    'storage_save': ('engine.file_storage', 'FileStorage', 'save'),
+    'storage_reload': ('engine.file_storage', 'FileStorage', 'reload'),
+    'storage_get': ('engine.file_storage', 'FileStorage', 'get_by_id'),
+    'history_add': ('engine.download_history', 'DownloadHistory', 'add'),
+    'history_flush': ('engine.download_history', 'DownloadHistory', 'flush'),
+    'history_reload': ('engine.download_history', 'DownloadHistory', 'reload'),
+    'history_contains': ('engine.download_history', 'DownloadHistory', '__contains__'),
+}
+
+
+class StageTimer:
+    """records how long each call of the stage methods takes, from any thread
+
+    Attributes:
+        durations (dict): the seconds of each call, by stage
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.__lock = Lock()
+
+    def wrap(self, owner, name: str, stage: str):
+        """replaces a method of a class with one that times its calls"""
+        method = getattr_static(owner, name)
+        kind = type(method) if isinstance(method, (staticmethod, classmethod)) else None
+        function = method.__func__ if kind else method
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(stage, perf_counter() - start)
+
+        setattr(owner, name, kind(timed) if kind else timed)
+
+    def record(self, stage: str, seconds: float):
+        with self.__lock:
+            self.durations.setdefault(stage, []).append(seconds)
+
+    def summary(self) -> dict:
+        """the number of calls and the p50 and p95 latency of each stage, in milliseconds"""
+        return {
+            stage: {
+                'count': len(durations),
+                'p50_ms': round(percentile(durations, 50) * 1000, 2),
+                'p95_ms': round(percentile(durations, 95) * 1000, 2),
+            }
+            for stage, durations in sorted(self.durations.items())
+        }
+
+
+def percentile(values: list, percent: float) -> float:
+    """the nearest-rank percentile of a list of numbers, 0 if it is empty"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[max(0, ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def run_convert_url(options: dict, library: str) -> int:
+    """downloads the playlist of the catalog, with its covers and lyrics"""
+    from download_urls import convert_url
+    from engine import library_index, lyrics
+
+    convert_url(f'https://open.spotify.com/playlist/{PLAYLIST_ID}', options['jobs'],
+                directory_path=library)
+    lyrics.wait()
+
+    return len(library_index.under(library))
+
+
+def run_process_url(options: dict, library: str) -> int:
+    """resolves the metadata of every track of the playlist of the catalog"""
+    from models.get_spotify_track import GetSpotifyTrack
+
+    tracks, _ = GetSpotifyTrack(f'https://open.spotify.com/playlist/{PLAYLIST_ID}').process_url()
+
+    return len(list(tracks))
+
+
+def run_youtube_url(options: dict, library: str) -> int:
+    """downloads youtube videos of the catalog, with their deezer metadata"""
+    from engine import library_index, lyrics
+    from models.youtube_to_spotify import ProcessYoutubeLink
+
+    for index in range(options['videos']):
+        youtube = ProcessYoutubeLink(f'https://www.youtube.com/watch?v={video_id(index)}')
+        youtube.process_youtube_url(library)
+    lyrics.wait()
+
+    return len(library_index.under(library))
+
+
+def run_storage(options: dict, library: str) -> int:
+    """saves, reloads and looks up the metadata and history of many tracks"""
+    from engine import history, storage
+    from models.get_spotify_track import GetSpotifyTrack
+    from models.spotify_to_youtube import ProcessSpotifyLink
+
+    spotify = GetSpotifyTrack('')
+    tracks = [spotify.build_metadata(spotify_track(index)) for index in range(options['objects'])]
+
+    for number, metadata in enumerate(tracks, 1):
+        storage.new(metadata)
+        # saved as often as a playlist saves each page
+        if number % 100 == 0:
+            storage.save()
+    storage.save()
+    storage.reload()
+    for metadata in tracks:
+        storage.get_by_id(metadata['link'].split('/')[-1])
+
+    titles = [ProcessSpotifyLink.track_title(metadata) for metadata in tracks]
+    for title in titles:
+        history.add(title)
+    history.flush()
+    history.reload()
+    found = sum(title in history for title in titles)
+
+    return found
+
+
+SCENARIOS = {
+    'convert_url': run_convert_url,
+    'process_url': run_process_url,
+    'youtube_url': run_youtube_url,
+    'storage': run_storage,
+}
+
+
+def peak_rss() -> tuple:
+    """the peak resident memory of this process and of its children, in MB"""
+    from resource import getrusage, RUSAGE_CHILDREN, RUSAGE_SELF
+
+    # bytes on macOS, kilobytes elsewhere
+    unit = 1 if platform == 'darwin' else 1024
+    return tuple(
+        round(getrusage(who).ru_maxrss * unit / 1024 / 1024, 1)
+        for who in (RUSAGE_SELF, RUSAGE_CHILDREN)
+    )
+
+
+def run_scenario(name: str, urls: dict, options: dict) -> dict:
+    """runs a scenario in the current process, against the fake services
+
+    Args:
+        name (str): the name of the scenario
+        urls (dict): the base url of each fake service
+        options (dict): the options of the benchmark
+
+    Returns:
+        dict: the result of the scenario
+    """
+    from importlib import import_module
+    from engine import history, library_index, metrics, transcode_pool, use_library
+
+    environ.setdefault('lyricsgenius_key', 'benchmark')
+    if not options['verbose']:
+        logging.disable(logging.CRITICAL)
+
+    timer = StageTimer()
+    for stage, (module, owner, method) in STAGES.items():
+        timer.wrap(getattr(import_module(module), owner), method, stage)
+
+    with TemporaryDirectory() as library:
+        library = use_library(library)
+        install(urls)
+        if options.get('metrics'):
+            metrics.start(path.abspath(path.join(options['metrics'], name)), name)
+
+        with open(devnull, 'w') as quiet, redirect_stdout(stdout if options['verbose'] else quiet):
+            start = perf_counter()
+            tracks = SCENARIOS[name](options, library)
+            seconds = perf_counter() - start
+
+        # the encoding processes are waited for, so their memory is counted,
+        # and the library is written before its folder is removed
+        transcode_pool.shutdown()
+        history.flush()
+        library_index.close()
+        metrics.stop()
+
+    rss, children_rss = peak_rss()
+    return {
+        'scenario': name,
+        'options': options_key(name, options),
+        'tracks': tracks,
+        'seconds': round(seconds, 3),
+        'tracks_per_min': round(tracks / seconds * 60, 1) if seconds else 0,
+        'stages': timer.summary(),
+        'peak_rss_mb': rss,
+        'children_peak_rss_mb': children_rss,
+    }
+
+
+def options_key(name: str, options: dict) -> dict:
+    """the options a result of a scenario depends on, so only like runs are compared"""
+    keys = ['latency', 'error_rate', 'throttle_rate']
+    keys += {
+        'convert_url': ['tracks', 'jobs', 'duration'],
+        'process_url': ['tracks'],
+        'youtube_url': ['videos', 'duration'],
+        'storage': ['objects'],
+    }[name]
+    return {key: options[key] for key in keys}
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """flags the metrics of a result that are worse than its baseline by more than tolerance
+
+    Args:
+        result (dict): the result of a scenario
+        baseline (dict): the saved result of the same scenario
+        tolerance (float): the share a metric may get worse by
+
+    Returns:
+        list: a message for each regression
+    """
+    regressions = []
+
+    def check(metric: str, now: float, before: float, higher_is_better: bool = False):
+        if not before:
+            return
+        change = (before - now if higher_is_better else now - before) / before
+        if change > tolerance:
+            regressions.append(
+                f'{result["scenario"]}: {metric} {before} -> {now} ({change:+.0%} worse)')
+
+    check('tracks/min', result['tracks_per_min'], baseline['tracks_per_min'], True)
+    check('peak RSS MB', result['peak_rss_mb'], baseline['peak_rss_mb'])
+    for stage, stats in result['stages'].items():
+        if stage in baseline['stages']:
+            check(f'{stage} p95 ms', stats['p95_ms'], baseline['stages'][stage]['p95_ms'])
+
+    return regressions
+
+
+def print_result(result: dict):
+    print(f'{result["scenario"]}: {result["tracks"]} tracks in {result["seconds"]}s, '
+          f'{result["tracks_per_min"]} tracks/min, peak RSS {result["peak_rss_mb"]} MB '
+          f'(children {result["children_peak_rss_mb"]} MB)')
+    print(f'  {"stage":<18}{"calls":>8}{"p50 ms":>12}{"p95 ms":>12}')
+    for stage, stats in result['stages'].items():
+        print(f'  {stage:<18}{stats["count"]:>8}{stats["p50_ms"]:>12}{stats["p95_ms"]:>12}')
+
+
+def parse_latency(values: list) -> dict:
+    """the latency of each service from MS and SERVICE=MS arguments"""
+    latency = {}
+    for value in values:
+        service, _, milliseconds = value.rpartition('=')
+        for name in ([service] if service else SERVICES):
+            latency[name] = float(milliseconds)
+    return latency
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmark spots against local stand-ins for its apis")
+    parser.add_argument(
+        '--scenario', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS),
+        help='The scenarios to run. Defaults to all of them.'
+    )
+    parser.add_argument(
+        '--tracks', type=int, default=20,
+        help='Number of tracks in the playlist. Defaults to 20.'
+    )
+    parser.add_argument(
+        '--videos', type=int, default=10,
+        help='Number of youtube videos downloaded. Defaults to 10.'
+    )
+    parser.add_argument(
+        '--objects', type=int, default=5000,
+        help='Number of tracks saved by the storage scenario. Defaults to 5000.'
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=4,
+        help='Number of playlist tracks downloaded concurrently. Defaults to 4.'
+    )
+    parser.add_argument(
+        '--latency', nargs='+', default=['0'], metavar='[SERVICE=]MS',
+        help='Milliseconds each service, or every service, takes to answer. Defaults to 0.'
+    )
+    parser.add_argument(
+        '--error-rate', type=float, default=0,
+        help='Share of requests answered with a server error. Defaults to 0.'
+    )
+    parser.add_argument(
+        '--throttle-rate', type=float, default=0,
+        help='Share of requests answered with 429 Too Many Requests. Defaults to 0.'
+    )
+    parser.add_argument(
+        '--duration', type=float, default=30,
+        help='Seconds of synthetic audio in each track. Defaults to 30.'
+    )
+    parser.add_argument(
+        '--baseline', type=str, default=path.join(path.dirname(__file__), 'baseline.json'),
+        help='The file baselines are saved to and compared with.'
+    )
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='Save the results as the new baseline.'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help='Share a metric may get worse than its baseline before it is flagged. Defaults to 0.25.'
+    )
+    parser.add_argument(
+        '--output', type=str, default='',
+        help='Write the results to a json file.'
+    )
+    parser.add_argument(
+        '--metrics', type=str, default='',
+        help='Write the trace and Prometheus textfile of each scenario to a folder of its own.',
+        metavar='FOLDER'
+    )
+    parser.add_argument(
+        '--verbose', action='store_true',
+        help='Show the output and errors of spots.'
+    )
+    args = parser.parse_args()
+
+    options = {
+        'tracks': args.tracks,
+        'videos': args.videos,
+        'objects': args.objects,
+        'jobs': args.jobs,
+        'latency': parse_latency(args.latency),
+        'error_rate': args.error_rate,
+        'throttle_rate': args.throttle_rate,
+        'duration': args.duration,
+        'verbose': args.verbose,
+        'metrics': args.metrics,
+    }
+
+    baselines = {}
+    if path.isfile(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    results, regressions = [], []
+    with FakeServices(args.tracks, options['latency'], args.error_rate,
+                      args.throttle_rate, args.duration) as fake:
+        for name in args.scenario:
+            # a fresh process, so every scenario starts cold and has its own peak memory
+            with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as executor:
+                result = executor.submit(run_scenario, name, fake.urls, options).result()
+            results.append(result)
+            print_result(result)
+
+            baseline = baselines.get(name)
+            if baseline and baseline['options'] == result['options']:
+                regressions += compare(result, baseline, args.tolerance)
+            elif baseline:
+                print(f'  the baseline of {name} was run with other options, not compared')
+
+        print(f'requests: {fake.requests}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baselines.update((result['scenario'], result) for result in results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f'Baseline saved to {args.baseline}')
+
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions:
+        exit(1)
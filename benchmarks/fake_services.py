@@ -0,0 +1,444 @@
+#!/usr/bin/python3
+"""Local http servers standing in for Spotify, Deezer, Genius, YouTube and the cover server
+
+The servers answer from a synthetic catalog: track `n` is "Artist n % 50 -
+Song n", on album n // 10, with a YouTube video and Genius lyrics of its
+own, so every request of a download can be answered without the real
+services. Each response is delayed by the latency of its service, and a
+share of them fail or are throttled.
+"""
+
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from re import search
+from subprocess import DEVNULL, run
+from threading import Lock, Thread
+from time import sleep
+from types import SimpleNamespace
+from urllib.parse import parse_qs, quote, urlparse
+from requests import HTTPError, Session
+from engine.library_index import LibraryIndex
+from engine.transcoder import ffmpeg_binary
+
+# the id of the playlist of the catalog
+PLAYLIST_ID = 'benchplaylist000000000'
+
+# tracks on each album of the catalog
+ALBUM_SIZE = 10
+
+SERVICES = ('spotify', 'deezer', 'genius', 'youtube', 'covers')
+
+
+def track_id(index: int) -> str:
+    """the spotify id of a track of the catalog"""
+    return f'bt{index:020d}'
+
+
+def album_id(index: int) -> str:
+    """the spotify id of an album of the catalog"""
+    return f'ba{index:020d}'
+
+
+def video_id(index: int) -> str:
+    """the youtube video id of a track of the catalog"""
+    return f'v{index:010d}'
+
+
+def song_index(text: str) -> int:
+    """the track a search query or id is for, or -1 if it is not in the catalog"""
+    match = search(r'Song (\d+)', text) or search(r'^(?:bt|ba|v|song-)?0*(\d+)', text)
+    return int(match.group(1)) if match else -1
+
+
+def spotify_album(index: int, covers_url: str = '') -> dict:
+    """a simplified spotify album object"""
+    return {
+        'id': album_id(index),
+        'name': f'Album {index}',
+        'images': [{'url': f'{covers_url}/image/{index}'}] if covers_url else [],
+        'release_date': '2020-01-01',
+        'total_tracks': ALBUM_SIZE,
+    }
+
+
+def spotify_track(index: int, covers_url: str = '') -> dict:
+    """a full spotify track object"""
+    return {
+        'id': track_id(index),
+        'name': f'Song {index}',
+        'artists': [{'name': f'Artist {index % 50}'}],
+        'track_number': index % ALBUM_SIZE + 1,
+        'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id(index)}'},
+        'album': spotify_album(index // ALBUM_SIZE, covers_url),
+    }
+
+
+class FakeServices:
+    """starts a local http server for each service, answering from the catalog
+
+    Attributes:
+        tracks (int): the number of tracks in the playlist of the catalog
+        latency (dict): the milliseconds each service takes to answer, by service
+        error_rate (float): the share of requests answered with a server error
+        throttle_rate (float): the share of requests answered with 429 Too Many Requests
+        duration (float): the seconds of synthetic audio of each track
+        urls (dict): the base url of each service, once started
+        requests (dict): the number of requests answered by each service
+    """
+
+    def __init__(self, tracks: int = 20, latency: dict = None, error_rate: float = 0,
+                 throttle_rate: float = 0, duration: float = 30, seed: int = 0):
+        self.tracks = tracks
+        self.latency = latency or {}
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.duration = duration
+        self.urls = {}
+        self.requests = dict.fromkeys(SERVICES, 0)
+        self.__servers = []
+        self.__random = Random(seed)
+        self.__lock = Lock()
+        self.__audio = None
+        self.__cover = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """starts the servers, on free ports of the loopback interface"""
+        for service in SERVICES:
+            server = ThreadingHTTPServer(('127.0.0.1', 0), FakeRequestHandler)
+            server.daemon_threads = True
+            server.fake, server.service = self, service
+            self.urls[service] = f'http://127.0.0.1:{server.server_port}'
+            Thread(target=server.serve_forever, args=(0.05,), daemon=True,
+                   name=f'fake-{service}').start()
+            self.__servers.append(server)
+
+        return self
+
+    def stop(self):
+        """stops the servers"""
+        for server in self.__servers:
+            server.shutdown()
+            server.server_close()
+        self.__servers = []
+
+    @property
+    def audio(self) -> bytes:
+        """the synthetic audio of every track, a sine wave in webm, made on first use"""
+        with self.__lock:
+            if self.__audio is None:
+                self.__audio = run(
+                    [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-f', 'lavfi',
+                     '-i', f'sine=frequency=440:duration={self.duration}',
+                     '-c:a', 'libopus', '-b:a', '128k', '-f', 'webm', 'pipe:1'],
+                    stdin=DEVNULL, capture_output=True, check=True).stdout
+        return self.__audio
+
+    @property
+    def cover(self) -> bytes:
+        """the jpeg cover of every album, made on first use"""
+        with self.__lock:
+            if self.__cover is None:
+                self.__cover = run(
+                    [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-f', 'lavfi',
+                     '-i', 'color=c=gray:s=64x64', '-frames:v', '1', '-f', 'mjpeg', 'pipe:1'],
+                    stdin=DEVNULL, capture_output=True, check=True).stdout
+        return self.__cover
+
+    def outcome(self, service: str) -> int:
+        """counts a request, and picks the status it fails with, or 0"""
+        with self.__lock:
+            self.requests[service] += 1
+            draw = self.__random.random()
+            delay = self.latency.get(service, 0) / 1000 * self.__random.uniform(0.5, 1.5)
+
+        # the delay is spent outside the lock, so requests overlap
+        sleep(delay)
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 503
+        return 0
+
+    def respond(self, service: str, path: str, query: dict) -> tuple:
+        """answers a request from the catalog
+
+        Returns:
+            tuple: the status, content type and body of the response
+        """
+        return getattr(self, f'_{service}')(path, query)
+
+    def _spotify(self, path: str, query: dict) -> tuple:
+        covers = self.urls['covers']
+        parts = path.strip('/').split('/')[1:]
+        ids = query.get('ids', [''])[0].split(',')
+
+        if parts == ['tracks']:
+            return self.__json({'tracks': [self.__spotify_track(i) for i in ids]})
+        if parts == ['albums']:
+            return self.__json({'albums': [self.__spotify_album(i) for i in ids]})
+        if len(parts) == 2 and parts[0] == 'tracks':
+            track = self.__spotify_track(parts[1])
+            return self.__json(track) if track else self.__json({'error': {}}, 404)
+        if len(parts) == 2 and parts[0] == 'albums':
+            album = self.__spotify_album(parts[1])
+            if not album:
+                return self.__json({'error': {}}, 404)
+            first = song_index(parts[1]) * ALBUM_SIZE
+            items = [{key: value for key, value in spotify_track(i, covers).items() if key != 'album'}
+                     for i in range(first, first + ALBUM_SIZE)]
+            return self.__json({**album, 'tracks': {'items': items, 'next': None}})
+        if parts and parts[0] == 'playlists' and parts[1:2] == [PLAYLIST_ID]:
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['100'])[0])
+            page = self.__playlist_page(offset, limit)
+            if len(parts) == 3:
+                return self.__json(page)
+            return self.__json({'name': 'Benchmark Playlist', 'snapshot_id': 'benchmark',
+                                'tracks': page})
+        if parts == ['search']:
+            index = song_index(query.get('q', [''])[0])
+            items = [spotify_track(index, covers)] if index >= 0 else []
+            return self.__json({'tracks': {'items': items}})
+
+        return self.__json({'error': {'status': 404}}, 404)
+
+    def _deezer(self, path: str, query: dict) -> tuple:
+        index = song_index(query.get('q', [''])[0]) if path == '/search' else -1
+        if index < 0:
+            return self.__json({'data': [], 'total': 0})
+
+        album = index // ALBUM_SIZE
+        return self.__json({'data': [{
+            'id': index + 1, 'type': 'track', 'title': f'Song {index}',
+            'track_position': index % ALBUM_SIZE + 1,
+            'artist': {'id': index % 50 + 1, 'type': 'artist', 'name': f'Artist {index % 50}'},
+            'album': {
+                'id': album + 1, 'type': 'album', 'title': f'Album {album}',
+                'cover': f'{self.urls["covers"]}/image/{album}', 'nb_tracks': ALBUM_SIZE,
+                'release_date': '2020-01-01',
+                'genres': {'data': [{'id': 1, 'type': 'genre', 'name': 'Pop'}]}
+            }
+        }], 'total': 1})
+
+    def _genius(self, path: str, query: dict) -> tuple:
+        index = song_index(query['q'][0] if 'q' in query else path.split('/')[-1])
+        song = {
+            'id': index, 'title': f'Song {index}', 'lyrics_state': 'complete',
+            'primary_artist': {'name': f'Artist {index % 50}'},
+            'url': f'https://genius.com/song-{index}-lyrics', 'path': f'/song-{index}-lyrics'
+        }
+        if index < 0:
+            return self.__json({'response': {'sections': [{'type': 'song', 'hits': []}],
+                                             'hits': []}})
+
+        if path.endswith('-lyrics'):
+            html = (f'<html><body><div data-lyrics-container="true">[Verse 1]<br/>'
+                    f'Song {index} goes la la la<br/>and on</div></body></html>')
+            return 200, 'text/html', html.encode()
+        if path.startswith('/songs/'):
+            return self.__json({'response': {'song': song}})
+
+        hit = {'index': 'song', 'type': 'song', 'result': song}
+        return self.__json({'response': {
+            'sections': [{'type': 'song', 'hits': [hit]}], 'hits': [hit]}})
+
+    def _youtube(self, path: str, query: dict) -> tuple:
+        if path == '/results':
+            index = song_index(query.get('q', [''])[0])
+            result = [{'link': f'https://www.youtube.com/watch?v={video_id(index)}'}] \
+                if 0 <= index else []
+            return self.__json({'result': result})
+
+        if path == '/watch':
+            index = song_index(query.get('v', [''])[0])
+            if index < 0:
+                return self.__json({'available': False}, 404)
+            return self.__json({
+                'title': f'Artist {index % 50} - Song {index}', 'author': f'Artist {index % 50}',
+                'filesize': len(self.audio), 'available': True
+            })
+
+        if path.startswith('/audio/'):
+            start, _, end = query.get('range', ['0-'])[0].partition('-')
+            audio = self.audio
+            return 200, 'audio/webm', audio[int(start):int(end) + 1 if end else len(audio)]
+
+        return self.__json({}, 404)
+
+    def _covers(self, path: str, query: dict) -> tuple:
+        return 200, 'image/jpeg', self.cover
+
+    def __spotify_track(self, spotify_id: str) -> dict:
+        index = song_index(spotify_id) if spotify_id.startswith('bt') else -1
+        return spotify_track(index, self.urls['covers']) if 0 <= index < self.tracks else None
+
+    def __spotify_album(self, spotify_id: str) -> dict:
+        index = song_index(spotify_id) if spotify_id.startswith('ba') else -1
+        return spotify_album(index, self.urls['covers']) if index >= 0 else None
+
+    def __playlist_page(self, offset: int, limit: int) -> dict:
+        end = min(offset + limit, self.tracks)
+        items = [{'added_at': '2024-01-01T00:00:00Z',
+                  'track': spotify_track(i, self.urls['covers'])} for i in range(offset, end)]
+        next_page = f'{self.urls["spotify"]}/v1/playlists/{PLAYLIST_ID}/tracks' \
+                    f'?offset={end}&limit={limit}' if end < self.tracks else None
+        return {'items': items, 'next': next_page, 'offset': offset, 'total': self.tracks}
+
+    @staticmethod
+    def __json(obj, status: int = 200) -> tuple:
+        return status, 'application/json', json.dumps(obj).encode()
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    """answers the requests of one service from its FakeServices"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        fake, service = self.server.fake, self.server.service
+        url = urlparse(self.path)
+
+        failure = fake.outcome(service)
+        if failure:
+            status, content_type, body = failure, 'application/json', b'{"error": {}}'
+        else:
+            status, content_type, body = fake.respond(service, url.path, parse_qs(url.query))
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """requests are counted, not logged"""
+
+
+class FakeYouTube:
+    """stands in for pytube's YouTube, asking the fake youtube server about its video
+
+    Attributes:
+        video_id (str): the id of the video of the url
+    """
+
+    # string - the base url of the fake youtube server
+    base_url = ''
+    # Session - shared by every stand-in
+    session = Session()
+
+    def __init__(self, url: str, use_oauth: bool = False, **kwargs):
+        self.video_id = LibraryIndex.youtube_id(url)
+        self.__info = None
+
+    @property
+    def streams(self):
+        """the streams of the video, which only have an audio stream"""
+        return self
+
+    @property
+    def title(self) -> str:
+        return self.info()['title']
+
+    @property
+    def author(self) -> str:
+        return self.info()['author']
+
+    def info(self) -> dict:
+        """fetches the title, author and audio size of the video once"""
+        if self.__info is None:
+            response = self.session.get(f'{self.base_url}/watch?v={self.video_id}', timeout=30)
+            response.raise_for_status()
+            self.__info = response.json()
+        return self.__info
+
+    def check_availability(self):
+        """raises VideoUnavailable if the video can't be fetched, or HTTPError if throttled"""
+        from pytube.exceptions import VideoUnavailable
+
+        try:
+            self.info()
+        except HTTPError as e:
+            if e.response.status_code == 429:
+                raise
+            raise VideoUnavailable(self.video_id)
+
+    def get_audio_only(self):
+        """the audio stream of the video"""
+        return SimpleNamespace(
+            url=f'{self.base_url}/audio/{self.video_id}?itag=251',
+            filesize=self.info()['filesize'],
+            mime_type='audio/webm'
+        )
+
+
+class FakeVideosSearch:
+    """stands in for youtubesearchpython's VideosSearch, searching the fake youtube server"""
+
+    def __init__(self, query: str, limit: int = 1):
+        response = FakeYouTube.session.get(
+            f'{FakeYouTube.base_url}/results?q={quote(query)}', timeout=30)
+        response.raise_for_status()
+        self.__result = {'result': response.json()['result'][:limit]}
+
+    def result(self) -> dict:
+        return self.__result
+
+
+def install(urls: dict):
+    """points the api clients of spots at the fake services, in the current process
+
+    Spotify, Deezer and Genius are the real clients with their base urls
+    changed, and their requests are paced as the services they stand for.
+    pytube and youtubesearchpython reach youtube through urls of their own,
+    so they are replaced by FakeYouTube and FakeVideosSearch.
+
+    Args:
+        urls (dict): the base url of each service
+    """
+    import youtubesearchpython
+    import download_urls
+    from engine import http_pool, lyrics
+    from engine.rate_limiter import HOSTS
+    from engine.shared_client import SharedClient
+    from models import spotify_to_youtube, youtube_to_spotify
+    from models.get_spotify_track import GetSpotifyTrack
+    from models.youtube_to_spotify import ProcessYoutubeLink
+
+    # requests to the fake services are paced as the real ones
+    HOSTS.update({urlparse(url).netloc: service for service, url in urls.items()})
+
+    def spotify():
+        from spotipy import Spotify
+
+        client = Spotify(auth='benchmark', requests_session=http_pool.session())
+        client.prefix = f'{urls["spotify"]}/v1/'
+        return client
+
+    def deezer():
+        from deezer import Client
+
+        client = Client()
+        client.base_url = urls['deezer']
+        return client
+
+    GetSpotifyTrack.spotify = SharedClient(spotify)
+    ProcessYoutubeLink.deezer_client = SharedClient(deezer)
+
+    genius = lyrics.genius
+    genius.API_ROOT = f'{urls["genius"]}/'
+    genius.PUBLIC_API_ROOT = f'{urls["genius"]}/api/'
+    genius.WEB_ROOT = f'{urls["genius"]}/'
+
+    FakeYouTube.base_url = urls['youtube']
+    for module in (spotify_to_youtube, youtube_to_spotify, download_urls):
+        module.YouTube = FakeYouTube
+    youtubesearchpython.VideosSearch = FakeVideosSearch
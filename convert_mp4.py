@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+"""Converts all MP4 files in a folder to MP3 on all cpus"""
+
+from argparse import ArgumentParser
+from os import listdir, path, remove
+from engine import transcode_pool, transcoder
+from models.errors import TranscodeError
+
+
+def convert_directory(input_dir: str, keep_source: bool = False) -> int:
+    """Converts every mp4 file in a folder to mp3, next to the original
+
+    Args:
+        input_dir (str): the folder with the files to convert
+        keep_source (bool, optional): keep the mp4 files. Defaults to False.
+
+    Returns:
+        int: the number of files that failed to convert
+    """
+    sources = sorted(
+        path.join(input_dir, filename) for filename in listdir(input_dir)
+        if filename.lower().endswith('.mp4')
+    )
+
+    # submitting waits for free encoders, so results are collected as they finish
+    conversions = [
+        (source, transcode_pool.submit(source, f'{path.splitext(source)[0]}.mp3'))
+        for source in sources
+    ]
+
+    failed = 0
+    for source, conversion in conversions:
+        try:
+            output = conversion.result()
+        except TranscodeError as e:
+            failed += 1
+            print(f'Failed: {path.basename(source)}: {e}')
+            continue
+
+        if not keep_source:
+            remove(source)
+        print(f'Converted: {path.basename(source)} to {output}')
+
+    return failed
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Convert all MP4 files in a folder to MP3")
+    parser.add_argument('input_dir', help='The folder with the files to convert.')
+    parser.add_argument(
+        '--quality', choices=['high', 'standard', 'low'], default='standard',
+        help='MP3 encoding quality preset.'
+    )
+    parser.add_argument(
+        '--encoders', type=int, default=0,
+        help='Number of processes converting audio. Defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        '--keep-source', action='store_true',
+        help='Keep the MP4 files after converting them.'
+    )
+    args = parser.parse_args()
+
+    if not path.isdir(args.input_dir):
+        print('Error: Input directory does not exist.')
+        exit(1)
+
+    transcoder.quality = args.quality
+    if args.encoders:
+        transcode_pool.workers = args.encoders
+
+    try:
+        failed = convert_directory(args.input_dir, args.keep_source)
+    except KeyboardInterrupt:
+        # cancel queued conversions and remove partial files
+        print('Cancelling...')
+        transcode_pool.shutdown(cancel=True)
+        exit(1)
+
+    transcode_pool.shutdown()
+    print('Conversion complete!')
+    exit(1 if failed else 0)
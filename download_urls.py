@@ -2,22 +2,34 @@
 """Contains functions that processes a Spotify or YouTube url"""
 
 from logging import basicConfig, ERROR, error
-from os import mkdir, chdir, getcwd, getenv
+from os import getenv, path
+from random import uniform
+from time import sleep
 from pytube import Playlist, YouTube
+from models.download_pipeline import DownloadPipeline
 from models.get_spotify_track import GetSpotifyTrack
 from models.errors import InvalidURL
 from models.spotify_to_youtube import ProcessSpotifyLink
 from models.youtube_to_spotify import ProcessYoutubeLink
 from dotenv import load_dotenv
+from engine import history, job_queue, lyrics, rate_limiter
 
 load_dotenv()
 
 
-def convert_url(url: str):
+def convert_url(url: str, jobs: int = 1, sync: bool = False, directory_path: str = ''):
     """Converts a youtube or spotify url to mp3, or a youtube video to mp3
 
+    The state of the url is recorded in the job queue, and the tracks of a
+    playlist or album are listed in it once, so a resumed run only
+    downloads the tracks that are not done.
+
     Args:
         url (str): url to be converted
+        jobs (int, optional): number of tracks of a playlist to download concurrently. Defaults to 1.
+        sync (bool, optional): only download the tracks added to a playlist since the last sync. Defaults to False.
+        directory_path (str, optional): the directory to download to, with a folder for each
+            playlist or album. Defaults to ''.
 
     Raises:
         InvalidURL: if provided url not available
@@ -25,22 +37,38 @@ def convert_url(url: str):
     try:
         # download spotify link
         if 'spotify' in url:
-            spotify = GetSpotifyTrack(url)
+            spotify = GetSpotifyTrack(url, sync)
             # single
             if 'track' in url:
                 metadata = spotify.process_url()
-                youtube = ProcessSpotifyLink(metadata)
-                youtube.download_youtube_video()
+                # skip the youtube search for downloaded tracks
+                if ProcessSpotifyLink.link_from_library(metadata, directory_path) \
+                        or ProcessSpotifyLink.track_title(metadata) in history:
+                    print(f'{metadata["title"]} already in list')
+                else:
+                    youtube = ProcessSpotifyLink(metadata)
+                    if not youtube.download_youtube_video(directory_path):
+                        # left unfinished, so a resumed run downloads it again
+                        job_queue.fail(url, RuntimeError(f'{metadata["title"]} not converted'))
+                        return
             # playlist
             else:
-                spotify_playlist, playlist_name = spotify.process_url()
-                download_spotify_playlist(spotify_playlist, playlist_name)
+                spotify_playlist, playlist_name = queue_playlist(url, spotify)
+                results = download_spotify_playlist(
+                    spotify_playlist, playlist_name, jobs, directory_path)
+
+                failed = [result for result in results if result['status'] == 'failed']
+                if failed:
+                    # the snapshot is not recorded, so the next sync retries the delta
+                    job_queue.fail(url, RuntimeError(f'{len(failed)} tracks failed'))
+                    return
+                spotify.commit_sync()
 
         elif 'youtu' in url:
             # check url availability
             try:
                 youtube = YouTube(url, use_oauth=bool(getenv('use_oauth')))
-                youtube.check_availability()
+                rate_limiter.call('youtube', youtube.check_availability)
             except:
                 basicConfig(level=ERROR)
                 error(f'{url} is not available')
@@ -48,53 +76,167 @@ def convert_url(url: str):
 
             # download a youtube playlist
             if 'playlist' in url:
-                download_youtube_playlist(url)
+                failed = download_youtube_playlist(url, directory_path)
+                if failed:
+                    job_queue.fail(url, RuntimeError(f'{failed} tracks failed'))
+                    return
             else:
                 yt_to_spotify = ProcessYoutubeLink(youtube_url=url)
-                yt_to_spotify.process_youtube_url()
+                if not yt_to_spotify.process_youtube_url(directory_path):
+                    job_queue.fail(url, RuntimeError(f'{url} not converted'))
+                    return
 
-    except InvalidURL:
+    except InvalidURL as e:
+        job_queue.fail(url, e)
         return
 
-def download_spotify_playlist(spotify_playlist: [{}], album_folder: str):
-    """downloads a spotify playlist
+    job_queue.update(url, 'tagged')
+
+
+def queue_playlist(url: str, spotify: GetSpotifyTrack) -> tuple:
+    """Lists the tracks of a spotify playlist or album in the job queue, as they are fetched
+
+    A playlist listed in full before is not fetched again. Tracks converted
+    before an interruption only have their lyrics added, and tracks that are
+    done are left out.
+
+    Args:
+        url (str): the url of the playlist or album
+        spotify (GetSpotifyTrack): the client of the url
+
+    Returns:
+        tuple: a generator of the metadata objects of the tracks to download, and the playlist name
+    """
+    job = job_queue.get(url) or {}
+    if 'tracks' in job:
+        return unfinished_tracks(job_queue.tracks(url)), job['name']
+
+    spotify_playlist, playlist_name = spotify.process_url()
+    return list_playlist(url, spotify_playlist, playlist_name), playlist_name
+
+
+def list_playlist(url: str, spotify_playlist, playlist_name: str):
+    """Yields the tracks of a playlist to download, queueing a job for each as it is fetched
+
+    Once every track is listed, the playlist job is resolved with them.
+
+    Args:
+        url (str): the url of the playlist or album
+        spotify_playlist (iterable): the metadata objects of the tracks
+        playlist_name (str): the name of the playlist or album
+
+    Yields:
+        dict: the metadata object of each track to download
+    """
+    links = []
+    for metadata in spotify_playlist:
+        track = job_queue.add(metadata['link'], 'track', metadata=metadata)
+        links.append(metadata['link'])
+        yield from unfinished_tracks([track])
+
+    job_queue.update(url, 'resolved', name=playlist_name, tracks=links)
+
+
+def unfinished_tracks(tracks):
+    """Yields the metadata of the track jobs that are not done, adding the lyrics of converted ones
 
     Args:
-        spotify_playlist (list): list of metadata objects
+        tracks (iterable): the track jobs
+
+    Yields:
+        dict: the metadata object of each track to download
+    """
+    for track in tracks:
+        if track['state'] == 'encoded':
+            queue_lyrics(track)
+        elif track['state'] != 'tagged':
+            yield track['metadata']
+
+
+def queue_lyrics(track: dict):
+    """Searches for the lyrics of a track job converted before an interruption
+
+    Args:
+        track (dict): the job of the track
+    """
+    metadata = track['metadata']
+    search = lyrics.submit(
+        track['path'], metadata.get('artist', ''), metadata.get('title', ''))
+    if search:
+        search.add_done_callback(lambda _: job_queue.update(track['key'], 'tagged'))
+    else:
+        job_queue.update(track['key'], 'tagged')
+
+
+def download_spotify_playlist(spotify_playlist, album_folder: str, jobs: int = 1,
+                              directory_path: str = '') -> list:
+    """downloads a spotify playlist, retrying the tracks that fail up to job_queue.retries times
+
+    Tracks are downloaded as they are taken from spotify_playlist, so a
+    generator of a large playlist is never listed in full upfront.
+
+    Args:
+        spotify_playlist (iterable): the metadata objects of the tracks
         album_folder (str): The folder to download an album or playlist to.
+        jobs (int, optional): number of tracks to download concurrently. Defaults to 1.
+        directory_path (str, optional): the directory the album folder is created in. Defaults to ''.
+
+    Returns:
+        list: the result of each track download
     """
     print(f'Downloading {album_folder}...')
-    for track in spotify_playlist:
-        spotify = ProcessSpotifyLink(track)
-        spotify.download_youtube_video(album_folder)
-
-def download_youtube_playlist(url: str):
+    pipeline = DownloadPipeline(jobs, queue=job_queue)
+
+    # set aside downloaded tracks, linking those in the library into the
+    # folder, before searching for the others
+    folder = path.join(directory_path, album_folder)
+    skipped = []
+    results = pipeline.run(pipeline.set_aside(spotify_playlist, skipped, folder, job_queue), folder)
+    to_download = pipeline.tracks
+
+    # retry only the failed tracks, backing off between attempts
+    for attempt in range(1, job_queue.retries):
+        failed = [index for index, result in enumerate(results)
+                  if result['status'] == 'failed']
+        if not failed:
+            break
+        print(f'{album_folder}: retrying {len(failed)} failed tracks...')
+        sleep(uniform(0, min(30, 2 ** attempt)))
+        retried = pipeline.run([to_download[index] for index in failed], folder)
+        for index, result in zip(failed, retried):
+            results[index] = result
+
+    results = skipped + results
+    history.flush()
+
+    statuses = [result['status'] for result in results]
+    print(f'{album_folder}: {statuses.count("downloaded")} downloaded, '
+          f'{statuses.count("skipped")} skipped, {statuses.count("failed")} failed')
+
+    return results
+
+def download_youtube_playlist(url: str, directory_path: str = '') -> int:
     """downloads all songs in a youtube playlist
 
     Args:
         url (str): the url of the playlist
+        directory_path (str, optional): the directory the playlist folder is created in. Defaults to ''.
+
+    Returns:
+        int: the number of songs that were not converted
     """
     playlist = Playlist(url)
-    playlist_urls = playlist.video_urls
-
-    # Get the current working directory
-    current_dir = getcwd()
-
-    # Create a new directory
-    new_dir = playlist.title
-    try:
-        mkdir(new_dir)
-    except FileExistsError:
-        pass
-
-    # Change to the new directory
-    chdir(new_dir)
+    # the pages of the playlist are fetched as they are read
+    playlist_urls = rate_limiter.call('youtube', lambda: list(playlist.video_urls))
+    title = rate_limiter.call('youtube', lambda: playlist.title)
 
     # download each song in playlist directory
-    print(f'Downloading {new_dir}...')
+    folder = path.join(directory_path, title)
+    print(f'Downloading {title}...')
+    failed = 0
     for video_url in playlist_urls:
         youtube = ProcessYoutubeLink(video_url)
-        youtube.process_youtube_url()
+        if not youtube.process_youtube_url(folder):
+            failed += 1
 
-    # Change back to the original directory
-    chdir(current_dir)
+    return failed
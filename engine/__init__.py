@@ -1,3 +1,81 @@
+from atexit import register
+from os import makedirs, path
+from engine.cover_cache import CoverCache
+from engine.download_history import DownloadHistory
 from engine.file_storage import FileStorage
+from engine.http_pool import HttpPool
+from engine.job_queue import JobQueue
+from engine.library_index import LibraryIndex
+from engine.lyrics import LyricsStage
+from engine.metrics import Metrics
+from engine.rate_limiter import RateLimiter
+from engine.track_store import TrackStore
+from engine.transcoder import Transcoder, TranscodePool
+
+# the timings and counters of a run, disabled until started
+metrics = Metrics()
+# registered first, so the textfile is written after the other stages finish
+register(metrics.stop)
 
 storage = FileStorage()
+
+history = DownloadHistory()
+# write titles still buffered when the process exits
+register(history.flush)
+
+# the files in the library, by path, link and title
+library_index = LibraryIndex()
+register(library_index.close)
+
+# each downloaded track once, linked into its folders
+track_store = TrackStore()
+
+# the state of each item of a run, to resume it
+job_queue = JobQueue()
+
+# the request rate of each api, shared by every thread
+rate_limiter = RateLimiter(metrics=metrics)
+
+# keep-alive connections shared by the api clients
+http_pool = HttpPool(rate_limiter, metrics=metrics)
+
+cover_cache = CoverCache(storage, session=http_pool.session())
+
+transcoder = Transcoder()
+transcode_pool = TranscodePool(transcoder)
+# wait for conversions still running when the process exits
+register(transcode_pool.shutdown)
+
+lyrics = LyricsStage(storage, http_pool=http_pool, metrics=metrics)
+# add the lyrics of songs still queued when the process exits
+register(lyrics.wait)
+
+
+def use_library(root: str) -> str:
+    """Keeps the metadata, download history, jobs, covers, index and tracks in a library folder
+
+    Called before they are used, so every path is absolute and no part of
+    spots depends on the current directory.
+
+    Args:
+        root (str): the folder music is downloaded to, created if missing
+
+    Returns:
+        str: the absolute path of the library
+    """
+    root = path.abspath(root)
+    makedirs(root, exist_ok=True)
+
+    storage.file_path = path.join(root, '.metadata.json')
+    history.file_path = path.join(root, '.spots_download_history.txt')
+    # titles are read from the new file on next use
+    history.reload()
+    job_queue.file_path = path.join(root, '.spots_jobs.json')
+    cover_cache.directory = path.join(root, '.covers')
+    # the index is opened at the new path on next use
+    library_index.close()
+    library_index.file_path = path.join(root, '.spots_library.db')
+    # on the same file system as the folders, so tracks are hard linked
+    track_store.directory = path.join(root, '.spots_store')
+
+    return root
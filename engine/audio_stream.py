@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+"""
+Contains the AudioStream class
+"""
+
+from os import path, remove
+from pytube.request import default_range_size
+from requests import RequestException, Session
+
+
+class AudioStream:
+    """the bytes of a youtube audio stream, fetched in ranges as they are read
+
+    Iterating the stream yields its chunks, so they can be piped to the
+    encoder without writing the source file. Streams larger than resume_size
+    are also appended to a partial file, which is replayed before the
+    remaining ranges are fetched when an interrupted download is retried.
+
+    Attributes:
+        url (str): the url of the audio stream
+        filesize (int): the size of the audio stream in bytes
+        file_path (str): the file the stream would be downloaded to
+        chunk_size (int): bytes read at a time
+        retries (int): attempts to fetch a range before giving up
+    """
+
+    # int - streams larger than this are resumable, in bytes
+    resume_size = 32 * 1024 * 1024
+
+    def __init__(self, url: str, filesize: int, file_path: str,
+                 chunk_size: int = 64 * 1024, retries: int = 3):
+        self.url = url
+        self.filesize = filesize
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.retries = retries
+
+    @property
+    def partial_path(self) -> str:
+        """the file the bytes of a resumable stream are kept in"""
+        return f'{self.file_path}.part'
+
+    @property
+    def resumable(self) -> bool:
+        """checks if the stream is large enough to be kept in a partial file"""
+        return self.filesize > self.resume_size
+
+    def __iter__(self):
+        """yields the chunks of the stream, resuming from the partial file"""
+        offset = 0
+        partial = None
+
+        if self.resumable:
+            if path.isfile(self.partial_path):
+                # replay the bytes of an interrupted download
+                with open(self.partial_path, 'rb') as f:
+                    while True:
+                        chunk = f.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        offset += len(chunk)
+                        yield chunk
+            partial = open(self.partial_path, 'ab')
+
+        try:
+            with Session() as session:
+                attempt = 0
+                while offset < self.filesize:
+                    start = offset
+                    try:
+                        for chunk in self.__fetch(session, offset):
+                            if partial:
+                                partial.write(chunk)
+                            offset += len(chunk)
+                            yield chunk
+                        if offset == start:
+                            raise RequestException(f'empty range at {offset}')
+                        attempt = 0
+                    except RequestException:
+                        # fetch the rest of the range again
+                        attempt += 1
+                        if attempt >= self.retries:
+                            raise
+        finally:
+            if partial:
+                partial.close()
+
+    def __fetch(self, session: Session, offset: int):
+        """yields the chunks of the range starting at offset"""
+        end = min(offset + default_range_size, self.filesize) - 1
+        # youtube throttles streams that are not fetched in ranges
+        with session.get(f'{self.url}&range={offset}-{end}',
+                         stream=True, timeout=30) as response:
+            response.raise_for_status()
+            yield from response.iter_content(self.chunk_size)
+
+    def remove(self):
+        """removes the partial file of the stream, once it is no longer needed"""
+        if path.isfile(self.partial_path):
+            remove(self.partial_path)
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+"""
+Contains the CoverCache class
+"""
+
+from collections import OrderedDict
+from hashlib import sha256
+from logging import basicConfig, error, ERROR
+from os import makedirs, path, remove, replace, scandir, utime
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from threading import Lock
+
+
+class CoverCache:
+    """fetches cover images once & keeps them on disk by content hash
+
+    Urls are mapped to the hash of their image in the storage cache, so covers
+    shared by several urls are only kept once. The least recently used covers
+    are evicted once the folder outgrows max_size, and the covers of the
+    current run are also kept in memory.
+
+    Attributes:
+        directory (str): the folder to keep cover images in
+        max_size (int): bytes of cover images to keep on disk
+        memory_size (int): number of cover images to keep in memory
+    """
+
+    def __init__(self, storage, directory: str = '.covers',
+                 max_size: int = 256 * 1024 * 1024, memory_size: int = 64,
+                 session: Session = None):
+        self.storage = storage
+        self.directory = directory
+        self.max_size = max_size
+        self.memory_size = memory_size
+        # ordered dictionary - cover images by url, least recently used first
+        self.__memory = OrderedDict()
+        # dictionary - a lock for each url, so a cover is only fetched once
+        self.__fetching = {}
+        self.__lock = Lock()
+        # lock - covers of different urls are evicted one thread at a time
+        self.__evicting = Lock()
+        self.__session = session
+
+    @property
+    def session(self) -> Session:
+        """a pooled http session, created on first use if none was given"""
+        if self.__session is None:
+            self.__session = Session()
+            self.__session.mount('https://', HTTPAdapter(pool_maxsize=16))
+        return self.__session
+
+    def get(self, url: str) -> bytes:
+        """Returns the cover image of an url, fetching it if it is not cached
+
+        Args:
+            url (str): the url of the cover image
+
+        Returns:
+            bytes: the cover image, empty if it could not be fetched
+        """
+        with self.__lock:
+            if url in self.__memory:
+                self.__memory.move_to_end(url)
+                return self.__memory[url]
+            url_lock = self.__fetching.setdefault(url, Lock())
+
+        # tracks of the same album wait for the first one to fetch the cover
+        with url_lock:
+            with self.__lock:
+                if url in self.__memory:
+                    return self.__memory[url]
+
+            cover = self.__read(url) or self.__fetch(url)
+
+            with self.__lock:
+                if cover:
+                    self.__memory[url] = cover
+                    if len(self.__memory) > self.memory_size:
+                        self.__memory.popitem(last=False)
+                self.__fetching.pop(url, None)
+
+        return cover
+
+    def __file_path(self, digest: str) -> str:
+        """the path of a cover image on disk"""
+        return path.join(self.directory, f'{digest}.jpg')
+
+    def __read(self, url: str) -> bytes:
+        """reads a cover image from disk, marking it as recently used"""
+        digest = self.storage.cache_get('covers', url)
+        if not digest:
+            return b''
+
+        file_path = self.__file_path(digest)
+        try:
+            with open(file_path, 'rb') as f:
+                cover = f.read()
+            utime(file_path)
+        except FileNotFoundError:
+            # evicted
+            return b''
+
+        return cover
+
+    def __fetch(self, url: str) -> bytes:
+        """downloads a cover image and writes it to disk"""
+        try:
+            response = self.session.get(url, timeout=30)
+            response.raise_for_status()
+        except RequestException:
+            basicConfig(level=ERROR)
+            error(f"Couldn't download cover {url}")
+            return b''
+
+        cover = response.content
+        digest = sha256(cover).hexdigest()
+        file_path = self.__file_path(digest)
+
+        # covers shared by several urls are written once
+        if not path.isfile(file_path):
+            makedirs(self.directory, exist_ok=True)
+            with open(f'{file_path}.tmp', 'wb') as f:
+                f.write(cover)
+            replace(f'{file_path}.tmp', file_path)
+            self.__evict()
+
+        self.storage.cache_set('covers', url, digest)
+
+        return cover
+
+    def __evict(self):
+        """removes the least recently used covers until the folder fits max_size"""
+        with self.__evicting:
+            covers = []
+            for entry in scandir(self.directory):
+                if not entry.is_file() or not entry.name.endswith('.jpg'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # removed by another run sharing the folder
+                    continue
+                covers.append((stat.st_mtime, stat.st_size, entry.path))
+
+            size = sum(cover_size for _, cover_size, _ in covers)
+            for _, cover_size, file_path in sorted(covers):
+                if size <= self.max_size:
+                    break
+                size -= cover_size
+                try:
+                    remove(file_path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+"""
+Contains the DownloadHistory class
+"""
+
+from os import fsync, path
+from threading import RLock
+from engine.titles import title_key
+
+
+class DownloadHistory:
+    """keeps the titles of downloaded songs in a set & journals new titles to the history file
+
+    The history file is read once, on first use. New titles are buffered and
+    appended to the file in batches, each batch synced to disk. Titles being
+    downloaded are reserved, so two threads never download the same song.
+
+    Attributes:
+        file_path (str): path to the history file
+        batch_size (int): number of new titles buffered before they are written
+    """
+
+    # string - default path to the history file
+    __file_path = ".spots_download_history.txt"
+
+    def __init__(self, file_path: str = '', batch_size: int = 20):
+        self.file_path = file_path or self.__file_path
+        self.batch_size = batch_size
+        # set - keys of downloaded titles, loaded on first use
+        self.__titles = None
+        # set - keys of titles being downloaded
+        self.__reserved = set()
+        # list - titles not yet written to the file
+        self.__journal = []
+        # string - the file the titles were loaded from, absolute
+        self.__loaded_path = ''
+        self.__lock = RLock()
+
+    def __contains__(self, title: str) -> bool:
+        """checks if a title is in the history"""
+        with self.__lock:
+            return title_key(title) in self.__load()
+
+    def reserve(self, title: str) -> bool:
+        """reserves a title to be downloaded
+
+        Args:
+            title (str): the title to be reserved
+
+        Returns:
+            bool: False if the title is in the history or already reserved
+        """
+        key = title_key(title)
+        with self.__lock:
+            if key in self.__load() or key in self.__reserved:
+                return False
+            self.__reserved.add(key)
+            return True
+
+    def release(self, title: str):
+        """releases the reservation of a title that was not downloaded"""
+        with self.__lock:
+            self.__reserved.discard(title_key(title))
+
+    def add(self, title: str):
+        """adds a title to the history, writing the buffered titles once a batch is full"""
+        key = title_key(title)
+        with self.__lock:
+            self.__reserved.discard(key)
+            if key in self.__load():
+                return
+            self.__titles.add(key)
+            self.__journal.append(title)
+
+            if len(self.__journal) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """appends the buffered titles to the file and syncs it to disk"""
+        with self.__lock:
+            if not self.__journal:
+                return
+            with open(self.__loaded_path, "a", newline="") as file:
+                file.write(''.join(f'{title}\n' for title in self.__journal))
+                file.flush()
+                fsync(file.fileno())
+            self.__journal.clear()
+
+    def reload(self):
+        """writes buffered titles, then reads the history file again on next use"""
+        with self.__lock:
+            self.flush()
+            self.__titles = None
+            self.__reserved.clear()
+
+    def __load(self) -> set:
+        """reads the history file into a set of keys, once"""
+        if self.__titles is None:
+            # relative paths are resolved once, against the current directory
+            self.__loaded_path = path.abspath(self.file_path)
+            try:
+                with open(self.__loaded_path, "r") as file:
+                    self.__titles = {
+                        title_key(title) for title in file.read().splitlines() if title
+                    }
+            except FileNotFoundError:
+                self.__titles = set()
+
+        return self.__titles
@@ -4,43 +4,197 @@ Contains the FileStorage class
 """
 
 import json
+from os import path, replace
+from threading import RLock
+from time import time
+from engine.titles import title_key
 
 
 class FileStorage:
-    """serializes instances to a JSON file & deserializes back to instances"""
+    """serializes instances to an append-only JSON lines file & deserializes back to instances
 
-    # string - path to the JSON file
+    Each save appends only the objects that are new or changed since the last
+    save, one JSON object per line, and reload replays the lines so the last
+    record of a link wins. Once the stale records outnumber the live ones, the
+    file is compacted to one record per link.
+
+    Besides track metadata, the file holds cache entries: values stored by
+    namespace and key, with the time they were cached.
+
+    Attributes:
+        file_path (str): path to the JSON lines file
+    """
+
+    # string - default path to the JSON lines file
     __file_path = ".metadata.json"
-    # dictionary - empty but will store all objects by Artist
+    # dictionary - empty but will store all objects by link
     __objects = {}
+    # set - links of objects not yet written to the file
+    __dirty = set()
+    # dictionary - cache entries by (namespace, key)
+    __cache = {}
+    # set - (namespace, key) of cache entries not yet written to the file
+    __dirty_cache = set()
+    # dictionary - secondary indexes of links by spotify id and by "artist - title"
+    __indexes = {'id': {}, 'title': {}}
+    # integer - number of records in the file
+    __records = 0
+    # objects are added from several download threads
+    __lock = RLock()
+
+    # minimum number of stale records before the file is compacted
+    compact_after = 1000
+
+    def __init__(self, file_path: str = ''):
+        self.file_path = file_path or self.__file_path
 
     def all(self):
         """returns the dictionary __objects"""
         return self.__objects
 
     def new(self, obj):
-        """sets in __objects the obj with key <obj artist name>.<obj title name>"""
+        """sets in __objects the obj with key <obj link>, to be written on the next save"""
         if obj is not None:
             key = obj['link']
-            self.__objects[key] = obj
+            with self.__lock:
+                if self.__objects.get(key) != obj:
+                    self.__objects[key] = dict(obj)
+                    self.__dirty.add(key)
+                    self.__index(self.__objects[key])
 
     def save(self):
-        """serializes __objects to the JSON file (path: __file_path)"""
-        with open(self.__file_path, 'w') as f:
-            json.dump(self.__objects, f)
+        """appends new and changed objects in __objects to the file (path: file_path)"""
+        with self.__lock:
+            # a missing file would lose the objects saved before
+            if not path.isfile(self.file_path):
+                self.compact()
+                return
+
+            if self.__dirty or self.__dirty_cache:
+                with open(self.file_path, 'a') as f:
+                    for key in self.__dirty:
+                        f.write(json.dumps(self.__objects[key]) + '\n')
+                    for key in self.__dirty_cache:
+                        f.write(json.dumps(self.__cache[key]) + '\n')
+                self.__records += len(self.__dirty) + len(self.__dirty_cache)
+                self.__dirty.clear()
+                self.__dirty_cache.clear()
+
+            live = len(self.__objects) + len(self.__cache)
+            if self.__records - live > max(live, self.compact_after):
+                self.compact()
+
+    def compact(self):
+        """rewrites the file with a single record for each object in __objects"""
+        with self.__lock:
+            temp_path = f'{self.file_path}.tmp'
+            # drop deleted cache entries
+            for key in [key for key, entry in self.__cache.items()
+                        if entry['value'] is None]:
+                del self.__cache[key]
+
+            with open(temp_path, 'w') as f:
+                for obj in self.__objects.values():
+                    f.write(json.dumps(obj) + '\n')
+                for entry in self.__cache.values():
+                    f.write(json.dumps(entry) + '\n')
+            replace(temp_path, self.file_path)
+
+            self.__records = len(self.__objects) + len(self.__cache)
+            self.__dirty.clear()
+            self.__dirty_cache.clear()
 
     def reload(self):
-        """deserializes the JSON file to __objects"""
-        try:
-            with open(self.__file_path, 'r') as f:
-                jo = json.load(f)
-            for key in jo:
-                self.__objects[key] = jo[key]
-        except:
-            pass
+        """deserializes the file to __objects
+
+        Files saved before the log format are rewritten one record per line,
+        so the next save appends to a valid log.
+        """
+        if not path.isfile(self.file_path):
+            return
+
+        legacy = False
+        with self.__lock, open(self.file_path, 'r') as f:
+            self.__records = 0
+            line = ''
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # skip a record cut short by an interrupted save
+                    continue
+                if not isinstance(record, dict):
+                    continue
+
+                self.__records += 1
+                if 'cache' in record:
+                    self.__cache[(record['cache'], record['key'])] = record
+                    continue
+
+                # files saved before the log format hold all objects in one record
+                if 'link' in record:
+                    objects = [record]
+                else:
+                    objects = record.values()
+                    legacy = True
+                for obj in objects:
+                    self.__objects[obj['link']] = obj
+                    self.__index(obj)
+
+            # a last line without a newline would join the next appended record
+            if legacy or (line and not line.endswith('\n')):
+                self.compact()
 
     def get(self, url):
         """
         Returns the object based on the url, or None if not found
         """
         return self.__objects.get(url, None)
+
+    def get_by_id(self, track_id):
+        """
+        Returns the object of a spotify track id, or None if not found
+        """
+        return self.get(self.__indexes['id'].get(track_id))
+
+    def get_by_title(self, title):
+        """
+        Returns the object matching an "Artist - Title" string, or None if not found
+        """
+        return self.get(self.__indexes['title'].get(title_key(title)))
+
+    def cache_get(self, namespace, key, ttl=None):
+        """
+        Returns the value cached under a namespace and key, or None if not
+        found or older than ttl seconds
+        """
+        entry = self.__cache.get((namespace, key))
+        if not entry:
+            return None
+        if ttl is not None and time() - entry['time'] > ttl:
+            return None
+        return entry['value']
+
+    def cache_set(self, namespace, key, value):
+        """caches a JSON serializable value under a namespace and key"""
+        with self.__lock:
+            self.__cache[(namespace, key)] = {
+                'cache': namespace, 'key': key, 'value': value, 'time': time()
+            }
+            self.__dirty_cache.add((namespace, key))
+
+    def cache_delete(self, namespace, key):
+        """removes the value cached under a namespace and key"""
+        if (namespace, key) in self.__cache:
+            self.cache_set(namespace, key, None)
+
+    def __index(self, obj):
+        """adds an object to the secondary indexes"""
+        link = obj['link']
+        if 'open.spotify.com/track/' in link:
+            track_id = link.split('/')[-1].split('?')[0]
+            self.__indexes['id'][track_id] = link
+
+        if obj.get('title'):
+            title = f'{obj.get("artist", "")} - {obj["title"]}'
+            self.__indexes['title'][title_key(title)] = link
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+"""
+Contains the HttpPool class
+"""
+
+from threading import BoundedSemaphore, Lock
+from urllib.parse import urlparse
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HttpPool(HTTPAdapter):
+    """a pool of keep-alive connections shared by the http sessions of the api clients
+
+    Mounting the pool on a session sends its requests over the shared
+    connections, while the session keeps its own headers and auth. The
+    requests in flight to each host are limited to per_host, so concurrent
+    downloads share each api fairly. With a rate limiter, requests are sent
+    at the rate of their service, and throttled requests pause the service
+    and are sent again.
+
+    Attributes:
+        limiter (RateLimiter): the rate limiter requests go through, if any
+        per_host (int): the number of requests in flight to a host at once
+        metrics (Metrics): counts the requests and bytes of each service, if given
+    """
+
+    def __init__(self, limiter=None, per_host: int = 8, pool_maxsize: int = 32, metrics=None):
+        # the retries spotipy configures on its own sessions, except for
+        # throttled requests, which the rate limiter retries
+        super().__init__(
+            pool_connections=16,
+            pool_maxsize=pool_maxsize,
+            max_retries=Retry(
+                total=3,
+                connect=None,
+                read=False,
+                allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                status=3,
+                backoff_factor=0.3,
+                status_forcelist=(500, 502, 503, 504)
+            )
+        )
+        self.limiter = limiter
+        self.per_host = per_host
+        self.metrics = metrics
+        # dictionary - a semaphore limiting the requests in flight, by host
+        self.__limits = {}
+        self.__lock = Lock()
+
+    def send(self, request, **kwargs):
+        """sends a request once fewer than per_host requests to its host are in flight"""
+        host = urlparse(request.url).netloc
+        with self.__lock:
+            limit = self.__limits.setdefault(host, BoundedSemaphore(self.per_host))
+
+        if not self.limiter:
+            with limit:
+                response = super().send(request, **kwargs)
+            self.measure(host, response)
+            return response
+
+        service = self.limiter.service(host)
+        for attempt in range(self.limiter.retries + 1):
+            self.limiter.acquire(service)
+            with limit:
+                response = super().send(request, **kwargs)
+
+            if response.status_code != 429 or attempt == self.limiter.retries:
+                break
+            response.close()
+            self.limiter.throttle(
+                service, self.limiter.parse_retry_after(response.headers.get('Retry-After')))
+
+        if response.status_code < 400:
+            self.limiter.succeed(service)
+        self.measure(host, response)
+        return response
+
+    def measure(self, host: str, response):
+        """counts a response and the bytes it declares, by service"""
+        if not self.metrics or not self.metrics.enabled:
+            return
+
+        service = self.limiter.service(host) if self.limiter else host
+        self.metrics.count('requests', service=service, status=response.status_code)
+        try:
+            size = int(response.headers.get('Content-Length') or 0)
+        except ValueError:
+            size = 0
+        self.metrics.count('bytes_downloaded', size, service=service)
+
+    def session(self, session: Session = None) -> Session:
+        """Mounts the pool on a session
+
+        Args:
+            session (Session, optional): the session of an api client. Defaults to a new session.
+
+        Returns:
+            Session: the session, sending its requests through the pool
+        """
+        session = session or Session()
+        session.mount('https://', self)
+        session.mount('http://', self)
+        return session
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+"""
+Contains the JobQueue class
+"""
+
+import json
+from os import path, remove
+from threading import RLock
+from time import time
+
+
+class JobQueue:
+    """keeps the state of every item of a run in a JSON lines file, so an interrupted run can be resumed
+
+    Each search title and url of a run is a job, and so is each track of a
+    playlist or album. A job moves through the STATES as its stages finish,
+    and every change is appended to the file as it happens. reload replays
+    the file, the last record of a job winning, so a resumed run only
+    repeats the stages that did not finish.
+
+    States:
+        pending: queued, nothing done yet
+        resolved: the metadata of the item, or the tracks of a playlist, are known
+        downloaded: the audio stream of the track was found on youtube
+        encoded: the track was converted and tagged with its metadata
+        tagged: done, lyrics included
+        failed: the last attempt failed, to be retried on resume
+
+    Attributes:
+        file_path (str): path to the jobs file
+        retries (int): the number of attempts at a job before it is left failed
+    """
+
+    STATES = ('pending', 'resolved', 'downloaded', 'encoded', 'tagged', 'failed')
+
+    # string - default path to the jobs file
+    __file_path = ".spots_jobs.json"
+
+    def __init__(self, file_path: str = '', retries: int = 3):
+        self.file_path = file_path or self.__file_path
+        self.retries = retries
+        # dictionary - the jobs by key, in the order they were added
+        self.__jobs = {}
+        # string - the file the jobs are written to, absolute
+        self.__loaded_path = ''
+        self.__lock = RLock()
+
+    def get(self, key: str) -> dict:
+        """returns the job of a key, or None if not found"""
+        return self.__jobs.get(key)
+
+    def add(self, key: str, kind: str, **fields) -> dict:
+        """adds a pending job, unless the key is already queued
+
+        Args:
+            key (str): the search title, url or track link
+            kind (str): 'search', 'url' or 'track'
+            fields: other values kept with the job
+
+        Returns:
+            dict: the job of the key
+        """
+        with self.__lock:
+            if key not in self.__jobs:
+                self.__write({
+                    **fields, 'key': key, 'kind': kind, 'state': 'pending',
+                    'attempts': 0, 'error': ''
+                })
+            return self.__jobs[key]
+
+    def update(self, key: str, state: str, **fields):
+        """records the state a job reached
+
+        Args:
+            key (str): the key of the job
+            state (str): one of STATES
+            fields: other values kept with the job
+        """
+        if state not in self.STATES:
+            raise ValueError(f'unknown state: {state}')
+
+        with self.__lock:
+            job = self.__jobs.get(key) or {
+                'key': key, 'kind': 'url', 'attempts': 0, 'error': ''}
+            self.__write({**job, **fields, 'state': state})
+
+    def fail(self, key: str, exception: Exception):
+        """records a failed attempt at a job"""
+        with self.__lock:
+            job = self.__jobs.get(key) or {'key': key, 'kind': 'url', 'attempts': 0}
+            self.__write({
+                **job, 'state': 'failed',
+                'attempts': job['attempts'] + 1, 'error': repr(exception)
+            })
+
+    def unfinished(self) -> list:
+        """returns the search title and url jobs that are not done, in the order they were added"""
+        with self.__lock:
+            return [job for job in self.__jobs.values()
+                    if job['kind'] != 'track' and job['state'] != 'tagged']
+
+    def tracks(self, key: str) -> list:
+        """returns the track jobs of a resolved playlist or album job"""
+        with self.__lock:
+            job = self.__jobs.get(key) or {}
+            return [self.__jobs[link] for link in job.get('tracks', [])
+                    if link in self.__jobs]
+
+    def reload(self):
+        """reads the jobs of the last run from the file"""
+        with self.__lock:
+            self.__jobs.clear()
+            self.__loaded_path = path.abspath(self.file_path)
+            if not path.isfile(self.__loaded_path):
+                return
+
+            with open(self.__loaded_path, 'r') as f:
+                for line in f:
+                    try:
+                        job = json.loads(line)
+                    except ValueError:
+                        # skip a record cut short by an interruption
+                        continue
+                    if isinstance(job, dict) and 'key' in job:
+                        # keep the order jobs were first added in
+                        self.__jobs[job['key']] = job
+
+    def clear(self):
+        """forgets the jobs of the last run, to start a new one"""
+        with self.__lock:
+            self.__jobs.clear()
+            # relative paths are resolved once, against the current directory
+            self.__loaded_path = path.abspath(self.file_path)
+            if path.isfile(self.__loaded_path):
+                remove(self.__loaded_path)
+
+    def __write(self, job: dict):
+        """sets a job and appends it to the file"""
+        job['time'] = time()
+        self.__jobs[job['key']] = job
+        if not self.__loaded_path:
+            self.__loaded_path = path.abspath(self.file_path)
+        with open(self.__loaded_path, 'a') as f:
+            f.write(json.dumps(job) + '\n')
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""
+Contains the LibraryIndex class
+"""
+
+import sqlite3
+from os import path, sep, stat
+from re import search
+from threading import RLock
+from time import time
+from engine.titles import title_key
+
+# the columns of a track in the index
+COLUMNS = ('path', 'link', 'youtube_id', 'title_key', 'artist', 'title', 'album',
+           'size', 'mtime', 'duration', 'added')
+
+
+class LibraryIndex:
+    """keeps every file in the library in an SQLite database, with its links and tags
+
+    Each downloaded or imported file is a row, indexed by path, by spotify
+    or youtube link, by youtube video id and by "artist - title", so
+    finding a track on disk is a lookup instead of a walk of the library.
+    The database is opened on first use.
+
+    Attributes:
+        file_path (str): path to the database
+    """
+
+    # string - default path to the database
+    __file_path = ".spots_library.db"
+
+    def __init__(self, file_path: str = ''):
+        self.file_path = file_path or self.__file_path
+        self.__connection = None
+        self.__lock = RLock()
+
+    @staticmethod
+    def youtube_id(url: str) -> str:
+        """returns the video id of a youtube url, or '' if it has none"""
+        match = search(r'(?:v=|youtu\.be/|/shorts/|/embed/)([\w-]{11})', url or '')
+        return match.group(1) if match else ''
+
+    def add(self, file_path: str, metadata: dict = None, youtube_url: str = '',
+            size: int = None, mtime: int = None, duration: float = None):
+        """adds a file to the index, or updates it
+
+        Args:
+            file_path (str): the path of the audio file
+            metadata (dict, optional): the metadata object of the track. Defaults to None.
+            youtube_url (str, optional): the youtube video it was downloaded from. Defaults to ''.
+            size (int, optional): the size of the file. Defaults to reading it from disk.
+            mtime (int, optional): the modification time of the file, in nanoseconds.
+                Defaults to reading it from disk.
+            duration (float, optional): the length of the song, in seconds. Defaults to None.
+        """
+        self.add_files([self.row(file_path, metadata, youtube_url, size, mtime, duration)])
+
+    def add_files(self, rows: list):
+        """adds the rows of many files in one transaction
+
+        Args:
+            rows (list): the rows of the files, built by row
+        """
+        now = time()
+        values = []
+        for row in rows:
+            row = {**row, 'added': row.get('added') or now}
+            values.append(tuple(row.get(column) for column in COLUMNS))
+
+        with self.__lock:
+            connection = self.__connect()
+            with connection:
+                connection.executemany(
+                    f'INSERT OR REPLACE INTO tracks ({", ".join(COLUMNS)}) '
+                    f'VALUES ({", ".join("?" * len(COLUMNS))})', values)
+
+    def remove(self, *file_paths: str):
+        """removes files from the index"""
+        with self.__lock:
+            connection = self.__connect()
+            with connection:
+                connection.executemany(
+                    'DELETE FROM tracks WHERE path = ?', [(path.abspath(p),) for p in file_paths])
+
+    def get(self, file_path: str) -> dict:
+        """returns the row of a file, or None if not found"""
+        rows = self.__select('path = ?', path.abspath(file_path))
+        return rows[0] if rows else None
+
+    def by_link(self, link: str) -> list:
+        """returns the files downloaded from a spotify or youtube link"""
+        return self.__select('link = ?', link)
+
+    def by_youtube_id(self, video_id: str) -> list:
+        """returns the files downloaded from a youtube video id"""
+        return self.__select('youtube_id = ?', video_id)
+
+    def by_title(self, title: str) -> list:
+        """returns the files of an "artist - title", ignoring case and spacing"""
+        return self.__select('title_key = ?', title_key(title))
+
+    def under(self, directory: str) -> list:
+        """returns the files in a folder and its subfolders"""
+        prefix = path.abspath(directory).rstrip(sep) + sep
+        # the paths starting with the prefix sort between it and the next prefix
+        end = prefix[:-1] + chr(ord(sep) + 1)
+        return self.__select('path >= ? AND path < ?', prefix, end)
+
+    def close(self):
+        """closes the database, to be opened again on next use"""
+        with self.__lock:
+            if self.__connection:
+                self.__connection.close()
+                self.__connection = None
+
+    def row(self, file_path: str, metadata: dict = None, youtube_url: str = '',
+            size: int = None, mtime: int = None, duration: float = None) -> dict:
+        """builds the row of a file, with the arguments of add"""
+        metadata = metadata or {}
+        file_path = path.abspath(file_path)
+        if size is None or mtime is None:
+            stats = stat(file_path)
+            size, mtime = stats.st_size, stats.st_mtime_ns
+
+        link = metadata.get('link', '')
+        artist, title = metadata.get('artist', ''), metadata.get('title', '')
+        return {
+            'path': file_path,
+            'link': link,
+            'youtube_id': self.youtube_id(youtube_url or link),
+            'title_key': title_key(f'{artist} - {title}') if title else '',
+            'artist': artist,
+            'title': title,
+            'album': metadata.get('album', ''),
+            'size': size,
+            'mtime': mtime,
+            'duration': duration
+        }
+
+    def __select(self, where: str, *values) -> list:
+        """returns the rows matching a condition, as dictionaries"""
+        with self.__lock:
+            cursor = self.__connect().execute(
+                f'SELECT {", ".join(COLUMNS)} FROM tracks WHERE {where}', values)
+            return [dict(zip(COLUMNS, row)) for row in cursor.fetchall()]
+
+    def __connect(self) -> sqlite3.Connection:
+        """opens the database once, creating its table and indexes"""
+        if self.__connection is None:
+            # shared by the download threads, behind the lock
+            connection = sqlite3.connect(path.abspath(self.file_path), check_same_thread=False)
+            with connection:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS tracks ('
+                    'path TEXT PRIMARY KEY, link TEXT, youtube_id TEXT, title_key TEXT, '
+                    'artist TEXT, title TEXT, album TEXT, size INTEGER, mtime INTEGER, '
+                    'duration REAL, added REAL)')
+                for column in ('link', 'youtube_id', 'title_key'):
+                    connection.execute(
+                        f'CREATE INDEX IF NOT EXISTS tracks_{column} ON tracks ({column})')
+            self.__connection = connection
+
+        return self.__connection
@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+"""
+Contains the LyricsStage class
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from logging import basicConfig, error, ERROR
+from os import getenv, path
+from threading import Lock
+from mutagen import File
+from engine.titles import title_key
+from engine.transcoder import Transcoder
+
+
+class LyricsStage:
+    """searches for lyrics on genius on a pool of threads & adds them to finished files
+
+    Lyrics are fetched after a song is converted, so a slow genius response
+    never holds up a download. Lyrics found, and songs without lyrics, are
+    cached in the storage cache; songs without lyrics are searched for again
+    after not_found_ttl.
+
+    Attributes:
+        storage (FileStorage): the storage to cache lyrics in
+        workers (int): the number of threads searching for lyrics
+        enabled (bool): if False, no lyrics are searched for
+        http_pool (HttpPool): the connection pool genius requests are sent through
+        metrics (Metrics): times the genius searches and counts cache hits, if given
+    """
+
+    # int - seconds before a song without lyrics is searched for again
+    not_found_ttl = 30 * 24 * 60 * 60
+
+    def __init__(self, storage, workers: int = 4, enabled: bool = True, http_pool=None,
+                 metrics=None):
+        self.storage = storage
+        self.workers = workers
+        self.enabled = enabled
+        self.http_pool = http_pool
+        self.metrics = metrics
+        self.__executor = None
+        self.__genius = None
+        self.__lock = Lock()
+
+    @property
+    def genius(self):
+        """the genius api client, created on first use"""
+        if self.__genius is None:
+            # lyricsgenius is only imported once lyrics are searched for
+            from lyricsgenius import Genius
+
+            genius = Genius(getenv('lyricsgenius_key'))
+            if self.http_pool:
+                self.http_pool.session(genius._session)
+            self.__genius = genius
+        return self.__genius
+
+    def timer(self, stage: str, **fields):
+        """times a stage with the metrics, if given"""
+        return self.metrics.timer(stage, **fields) if self.metrics else nullcontext()
+
+    def lookup(self, artist: str, title: str) -> str:
+        """Returns the lyrics of a song, searching genius if they are not cached
+
+        Args:
+            artist (str): the artist of the song
+            title (str): the title of the song
+
+        Returns:
+            str: the lyrics, empty if the song has none
+        """
+        key = title_key(f'{artist} - {title}')
+        lyrics = self.storage.cache_get('lyrics', key)
+        # songs without lyrics are cached as empty lyrics, for not_found_ttl
+        cached = lyrics or (lyrics == '' and self.storage.cache_get(
+            'lyrics', key, self.not_found_ttl) is not None)
+        if self.metrics:
+            self.metrics.count('cache', cache='lyrics', result='hit' if cached else 'miss')
+        if cached:
+            return lyrics
+
+        try:
+            with self.timer('genius_search', track=f'{artist} - {title}'):
+                song = self.genius.search_song(title, artist)
+        except Exception as e:
+            # not cached, so the song is searched for on the next run
+            basicConfig(level=ERROR)
+            error(f"Couldn't search lyrics for {artist} - {title}: {e!r}")
+            return ''
+
+        not_found = not song or 'Verse' not in song.lyrics or title not in song.title
+        lyrics = '' if not_found else song.lyrics
+        self.storage.cache_set('lyrics', key, lyrics)
+
+        return lyrics
+
+    def add(self, audio_path: str, artist: str, title: str) -> bool:
+        """Adds the lyrics of a song to its audio file
+
+        Args:
+            audio_path (str): the path of the audio file
+            artist (str): the artist of the song
+            title (str): the title of the song
+
+        Returns:
+            bool: True if lyrics were added
+        """
+        lyrics = self.lookup(artist, title)
+        if not lyrics:
+            return False
+
+        try:
+            with self.timer('tagging', track=f'{artist} - {title}'):
+                self.write_lyrics(audio_path, lyrics)
+        except Exception as e:
+            basicConfig(level=ERROR)
+            error(f"Couldn't add lyrics to {audio_path}: {e!r}")
+            return False
+
+        return True
+
+    @staticmethod
+    def write_lyrics(audio_path: str, lyrics: str):
+        """writes lyrics to the tags of an mp3, m4a or opus file
+
+        Args:
+            audio_path (str): the path of the audio file
+            lyrics (str): the lyrics to write
+        """
+        if audio_path.lower().endswith('.mp3'):
+            Transcoder.add_lyrics(audio_path, lyrics)
+            return
+
+        audio = File(audio_path)
+        # mp4 atoms, or vorbis comments
+        audio['\xa9lyr' if audio_path.lower().endswith('.m4a') else 'lyrics'] = lyrics
+        audio.save()
+
+    def submit(self, audio_path: str, artist: str, title: str) -> Future:
+        """queues a finished audio file to have its lyrics added
+
+        Args:
+            audio_path (str): the path of the audio file
+            artist (str): the artist of the song
+            title (str): the title of the song
+
+        Returns:
+            Future: resolves to True if lyrics were added, or None if disabled
+        """
+        if not self.enabled:
+            return None
+
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix='lyrics')
+            # relative paths would change with the working directory
+            return self.__executor.submit(
+                self.add, path.abspath(audio_path), artist, title)
+
+    def wait(self):
+        """waits for the queued songs to have their lyrics added"""
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
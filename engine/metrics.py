@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+"""
+Contains the Metrics class
+"""
+
+from functools import wraps
+from json import dumps
+from os import makedirs, path, replace
+from threading import Lock, current_thread
+from time import perf_counter, strftime, time
+
+
+class Timer:
+    """times a stage of a run, as a context manager"""
+
+    def __init__(self, metrics, stage: str, fields: dict):
+        self.metrics = metrics
+        self.stage = stage
+        self.fields = fields
+        self.start = 0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.stage, perf_counter() - self.start, exc_type is None, self.fields)
+        return False
+
+
+class NullTimer:
+    """stands in for a timer while metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+# the timer of every stage while metrics are disabled
+NULL_TIMER = NullTimer()
+
+
+class Metrics:
+    """times the stages of a run & counts its cache hits, bytes and retries
+
+    Each stage timed and event counted is appended to a JSONL trace of the
+    run, and the totals are written to a Prometheus textfile, with the
+    latency of each stage as a summary and each event as a counter. Until
+    started, timers and counters return at once, so the instrumentation
+    costs a flag check.
+
+    Attributes:
+        enabled (bool): if False, nothing is timed or counted
+        trace_path (str): the JSONL trace of the run
+        textfile_path (str): the Prometheus textfile
+        prefix (str): the prefix of the Prometheus metric names
+    """
+
+    # tuple - the quantiles of each stage written to the textfile
+    quantiles = (0.5, 0.95, 0.99)
+
+    # dictionary - the help text of each counter in the textfile
+    descriptions = {
+        'cache': 'Cache lookups, by cache and hit or miss.',
+        'bytes_downloaded': 'Bytes downloaded, by service.',
+        'requests': 'Api requests sent, by service and status.',
+        'throttled': 'Calls throttled by a service, then retried.',
+        'retries': 'Stages retried after an error.',
+        'tracks': 'Tracks of the run, by outcome.',
+    }
+
+    def __init__(self, prefix: str = 'spots'):
+        self.enabled = False
+        self.trace_path = ''
+        self.textfile_path = ''
+        self.prefix = prefix
+        # dictionary - the seconds of each timing, by stage
+        self.__durations = {}
+        # dictionary - the number of timings that raised, by stage
+        self.__failures = {}
+        # dictionary - the total of each counter, by name and labels
+        self.__counters = {}
+        self.__trace = None
+        self.__lock = Lock()
+
+    def start(self, directory: str, run_id: str = '') -> str:
+        """Starts timing and counting, with a new trace in a folder
+
+        Args:
+            directory (str): the folder of the trace and textfile, created if missing
+            run_id (str, optional): names the trace. Defaults to the time of the run.
+
+        Returns:
+            str: the path of the trace
+        """
+        self.stop()
+        run_id = run_id or strftime('%Y%m%d-%H%M%S')
+        makedirs(directory, exist_ok=True)
+
+        with self.__lock:
+            self.trace_path = path.join(directory, f'spots-{run_id}.jsonl')
+            self.textfile_path = path.join(directory, f'{self.prefix}.prom')
+            self.__durations = {}
+            self.__failures = {}
+            self.__counters = {}
+            # line buffered, so the trace is complete up to a crash
+            self.__trace = open(self.trace_path, 'a', buffering=1)
+            self.enabled = True
+
+        self.event('run_start', run=run_id)
+        return self.trace_path
+
+    def stop(self):
+        """writes the textfile and closes the trace"""
+        if not self.enabled:
+            return
+
+        self.event('run_end')
+        self.write_textfile()
+        with self.__lock:
+            self.enabled = False
+            trace, self.__trace = self.__trace, None
+        if trace:
+            trace.close()
+
+    def timer(self, stage: str, **fields):
+        """Times a stage, as a context manager
+
+        Args:
+            stage (str): the stage timed
+            fields: added to the trace event, such as the track
+
+        Returns:
+            Timer: records the stage when the block exits
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, stage, fields)
+
+    def timed(self, stage: str):
+        """Times each call of a function as a stage, as a decorator
+
+        Args:
+            stage (str): the stage timed
+
+        Returns:
+            callable: the decorator
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Timer(self, stage, {}):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def retried(self, stage: str):
+        """Counts the retries of a stage, as a tenacity before_sleep callback
+
+        Args:
+            stage (str): the stage retried
+
+        Returns:
+            callable: the callback
+        """
+        return lambda retry_state: self.count('retries', stage=stage)
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Adds to a counter
+
+        Args:
+            name (str): the counter, such as cache or bytes_downloaded
+            value (float, optional): the amount to add. Defaults to 1.
+            labels: the labels of the counter, such as the cache and hit or miss
+        """
+        if not self.enabled or not value:
+            return
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+        self.event('count', name=name, value=value, **labels)
+
+    def record(self, stage: str, seconds: float, ok: bool = True, fields: dict = None):
+        """Records the time a stage took
+
+        Args:
+            stage (str): the stage timed
+            seconds (float): the time it took
+            ok (bool, optional): False if the stage raised. Defaults to True.
+            fields (dict, optional): added to the trace event
+        """
+        if not self.enabled:
+            return
+
+        with self.__lock:
+            self.__durations.setdefault(stage, []).append(seconds)
+            if not ok:
+                self.__failures[stage] = self.__failures.get(stage, 0) + 1
+        self.event('span', stage=stage, seconds=round(seconds, 6), ok=ok, **(fields or {}))
+
+    def event(self, event_type: str, /, **fields):
+        """appends an event to the trace"""
+        line = dumps({
+            'ts': round(time(), 6), 'type': event_type,
+            'thread': current_thread().name, **fields
+        }, default=str)
+        with self.__lock:
+            if self.__trace:
+                self.__trace.write(f'{line}\n')
+
+    def summary(self) -> dict:
+        """Summarises the timings of each stage
+
+        Returns:
+            dict: the count, failures, total seconds and quantiles of each stage
+        """
+        with self.__lock:
+            durations = {stage: sorted(seconds) for stage, seconds in self.__durations.items()}
+            failures = dict(self.__failures)
+
+        return {
+            stage: {
+                'count': len(seconds),
+                'failures': failures.get(stage, 0),
+                'sum': sum(seconds),
+                **{q: self.quantile(seconds, q) for q in self.quantiles},
+            }
+            for stage, seconds in durations.items()
+        }
+
+    def counters(self) -> dict:
+        """the total of each counter, by name and sorted labels"""
+        with self.__lock:
+            return dict(self.__counters)
+
+    @staticmethod
+    def quantile(values: list, q: float) -> float:
+        """the nearest-rank quantile of sorted values"""
+        if not values:
+            return 0
+        rank = max(1, -(-len(values) * q // 1))
+        return values[int(rank) - 1]
+
+    @staticmethod
+    def labels(**labels) -> str:
+        """formats Prometheus labels, escaping their values"""
+        pairs = []
+        for name, value in labels.items():
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{name}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+
+    def textfile(self) -> str:
+        """Formats the totals in the Prometheus text exposition format
+
+        Returns:
+            str: the latency of each stage as a summary and each counter as a counter
+        """
+        stages = f'{self.prefix}_stage_seconds'
+        lines = [
+            f'# HELP {stages} Time spent in each stage of a run.',
+            f'# TYPE {stages} summary',
+        ]
+        summary = self.summary()
+        for stage in sorted(summary):
+            timings = summary[stage]
+            for q in self.quantiles:
+                lines.append(f'{stages}{self.labels(stage=stage, quantile=q)} {timings[q]:.6f}')
+            lines.append(f'{stages}_sum{self.labels(stage=stage)} {timings["sum"]:.6f}')
+            lines.append(f'{stages}_count{self.labels(stage=stage)} {timings["count"]}')
+
+        failures = f'{self.prefix}_stage_failures_total'
+        lines += [
+            f'# HELP {failures} Timings of each stage that raised.',
+            f'# TYPE {failures} counter',
+        ]
+        for stage in sorted(summary):
+            lines.append(f'{failures}{self.labels(stage=stage)} {summary[stage]["failures"]}')
+
+        counters = {}
+        for (name, labels), value in self.counters().items():
+            counters.setdefault(name, []).append((labels, value))
+        for name in sorted(counters):
+            metric = f'{self.prefix}_{name}_total'
+            description = self.descriptions.get(name, f'Total {name.replace("_", " ")} of the run.')
+            lines += [f'# HELP {metric} {description}',
+                      f'# TYPE {metric} counter']
+            for labels, value in sorted(counters[name]):
+                value = int(value) if float(value).is_integer() else value
+                lines.append(f'{metric}{self.labels(**dict(labels))} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self) -> str:
+        """Writes the totals to the Prometheus textfile, replacing it at once
+
+        Returns:
+            str: the path of the textfile, or '' if metrics were never started
+        """
+        if not self.textfile_path:
+            return ''
+
+        # the textfile collector never reads a partly written file
+        partial = f'{self.textfile_path}.{current_thread().ident}.tmp'
+        with open(partial, 'w') as f:
+            f.write(self.textfile())
+        replace(partial, self.textfile_path)
+
+        return self.textfile_path
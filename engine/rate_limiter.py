@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+"""
+Contains the RateLimiter class
+"""
+
+from email.utils import parsedate_to_datetime
+from random import uniform
+from threading import Lock
+from time import monotonic, sleep, time
+
+# the service of each api host, by domain
+HOSTS = {
+    'spotify.com': 'spotify',
+    'genius.com': 'genius',
+    'deezer.com': 'deezer',
+    'youtube.com': 'youtube',
+    'scdn.co': 'covers',
+}
+
+# the requests per second allowed to each service
+RATES = {
+    'spotify': 10,
+    'genius': 5,
+    'deezer': 8,
+    'youtube': 5,
+    'covers': 20,
+}
+
+
+class RateLimiter:
+    """a token bucket for each api, shared by every thread calling it
+
+    Calls to a service wait for a token, so the service is called at most
+    its rate per second, with bursts of up to burst calls. A throttled call
+    pauses the whole service, for the time its Retry-After header asks or
+    else for a jittered, exponentially growing backoff, and is then retried.
+
+    Attributes:
+        rates (dict): the requests per second allowed to each service
+        default_rate (float): the requests per second allowed to other hosts
+        burst (int): the number of calls allowed at once after a quiet period
+        retries (int): the number of times a throttled call is retried
+        max_backoff (float): the longest pause without a Retry-After header, in seconds
+        metrics (Metrics): counts the throttled calls of each service, if given
+    """
+
+    def __init__(self, rates: dict = None, default_rate: float = 10,
+                 burst: int = 5, retries: int = 5, max_backoff: float = 60, metrics=None):
+        self.rates = dict(RATES, **(rates or {}))
+        self.default_rate = default_rate
+        self.burst = burst
+        self.retries = retries
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+        # dictionary - the bucket of each service
+        self.__buckets = {}
+        self.__lock = Lock()
+
+    @staticmethod
+    def service(host: str) -> str:
+        """the service of an api host, or the host itself if it is not known"""
+        for domain, service in HOSTS.items():
+            if host == domain or host.endswith(f'.{domain}'):
+                return service
+        return host
+
+    def __bucket(self, service: str) -> dict:
+        """the tokens, pause and failures of a service"""
+        return self.__buckets.setdefault(service, {
+            'tokens': self.burst, 'updated': monotonic(),
+            'paused_until': 0, 'failures': 0
+        })
+
+    def acquire(self, service: str):
+        """waits until the service can be called
+
+        Args:
+            service (str): the service to be called
+        """
+        while True:
+            with self.__lock:
+                bucket = self.__bucket(service)
+                now = monotonic()
+                wait = bucket['paused_until'] - now
+                if wait <= 0:
+                    rate = self.rates.get(service, self.default_rate)
+                    bucket['tokens'] = min(
+                        self.burst, bucket['tokens'] + (now - bucket['updated']) * rate)
+                    bucket['updated'] = now
+                    if bucket['tokens'] >= 1:
+                        bucket['tokens'] -= 1
+                        return
+                    wait = (1 - bucket['tokens']) / rate
+            sleep(wait)
+
+    def throttle(self, service: str, retry_after: float = 0) -> float:
+        """pauses a service that throttled a call
+
+        Args:
+            service (str): the service that throttled the call
+            retry_after (float, optional): the seconds the service asked to wait. Defaults to
+                a jittered exponential backoff.
+
+        Returns:
+            float: the seconds the service is paused for
+        """
+        with self.__lock:
+            bucket = self.__bucket(service)
+            bucket['failures'] += 1
+            if not retry_after:
+                backoff = min(self.max_backoff, 2 ** bucket['failures'])
+                retry_after = uniform(backoff / 2, backoff)
+            bucket['paused_until'] = max(bucket['paused_until'], monotonic() + retry_after)
+            bucket['tokens'] = 0
+
+        if self.metrics:
+            self.metrics.count('throttled', service=service)
+        return retry_after
+
+    def succeed(self, service: str):
+        """resets the backoff of a service after a call went through"""
+        with self.__lock:
+            self.__bucket(service)['failures'] = 0
+
+    def call(self, service: str, function, *args, **kwargs):
+        """Calls an api client function at the rate of its service, retrying throttled calls
+
+        Args:
+            service (str): the service the function calls
+            function (callable): the api client function
+            args: the arguments of the function
+            kwargs: the keyword arguments of the function
+
+        Returns:
+            the result of the function
+        """
+        for attempt in range(self.retries + 1):
+            self.acquire(service)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                retry_after = self.retry_after(e)
+                if retry_after is None or attempt == self.retries:
+                    raise
+                self.throttle(service, retry_after)
+                continue
+
+            self.succeed(service)
+            return result
+
+    @classmethod
+    def retry_after(cls, exception: Exception):
+        """Checks if an api client error means the call was throttled
+
+        Args:
+            exception (Exception): an error of spotipy, requests, httpx, urllib or deezer
+
+        Returns:
+            float: the seconds to wait from the Retry-After header, 0 if it has none,
+            or None if the call was not throttled
+        """
+        for error in (exception, exception.__cause__):
+            if error is None:
+                continue
+
+            # deezer reports its quota in the response body
+            json_data = getattr(error, 'json_data', None)
+            if isinstance(json_data, dict) and \
+                    isinstance(json_data.get('error'), dict) and json_data['error'].get('code') == 4:
+                return 0
+
+            response = getattr(error, 'response', None)
+            status = getattr(error, 'http_status', None) or getattr(error, 'code', None) \
+                or getattr(response, 'status_code', None)
+            if status == 429:
+                headers = getattr(error, 'headers', None) or getattr(response, 'headers', None) or {}
+                return cls.parse_retry_after(headers.get('Retry-After'))
+
+        return None
+
+    @staticmethod
+    def parse_retry_after(value) -> float:
+        """the seconds a Retry-After header asks to wait, 0 if it is missing or invalid"""
+        if not value:
+            return 0
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+        except (TypeError, ValueError):
+            return 0
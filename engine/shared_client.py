@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+"""
+Contains the SharedClient class
+"""
+
+from threading import Lock
+
+
+class SharedClient:
+    """an api client shared by every instance of a class, created on first use
+
+    Declared as a class attribute, the client is only created, and the
+    modules it needs only imported, when it is first used, so importing the
+    class and starting the cli stay fast.
+
+    Attributes:
+        factory (callable): creates the client
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.__client = None
+        self.__lock = Lock()
+
+    def __get__(self, instance, owner):
+        """returns the client, creating it once"""
+        if self.__client is None:
+            with self.__lock:
+                if self.__client is None:
+                    self.__client = self.factory()
+        return self.__client
@@ -0,0 +1,21 @@
+#!/usr/bin/python3
+"""
+Contains the title key shared by the caches and indexes, and the audio
+extensions spots downloads
+"""
+
+# extensions of the audio files spots downloads
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.opus')
+
+
+def title_key(title: str) -> str:
+    """normalises a title or search, so differences in case and spacing still match
+
+    Args:
+        title (str): the title, such as an "artist - title"
+
+    Returns:
+        str: the key the title is cached and indexed under
+    """
+    # '/' is saved as '|' in the names of downloaded files
+    return ' '.join(title.replace('/', '|').split()).casefold()
@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+"""
+Contains the TrackStore class
+"""
+
+from hashlib import sha256
+from os import link, makedirs, path, remove, replace, symlink
+from shutil import copy2, move
+from mutagen import MutagenError
+from mutagen.id3 import ID3
+
+
+class TrackStore:
+    """keeps each downloaded track once on disk, by content hash
+
+    An encoded file is moved into the store under the hash of its content,
+    then linked back to its playlist or album folder, so a track in several
+    folders is downloaded, encoded and kept once. Links are hard links, or
+    symbolic links or copies where the file system has no hard links.
+
+    Lyrics are written to a track after it is stored, through its links, so
+    an mp3 is named by its audio and its tags other than lyrics, and keeps
+    its name once they are written. Tracks with the same audio but other
+    titles, albums or covers are kept apart. Other formats are named by their
+    content when they are stored.
+
+    Attributes:
+        directory (str): the folder to keep the tracks in
+    """
+
+    # int - bytes read at a time when hashing a file
+    chunk_size = 1024 * 1024
+
+    def __init__(self, directory: str = '.spots_store'):
+        self.directory = directory
+
+    def put(self, file_path: str) -> str:
+        """moves a file into the store, leaving a link to it in its place
+
+        A file with the same content already in the store is kept instead.
+
+        Args:
+            file_path (str): the file to store
+
+        Returns:
+            str: the path of the file in the store
+        """
+        stored = self.object_path(self.digest(file_path), path.splitext(file_path)[1])
+
+        if path.isfile(stored):
+            remove(file_path)
+        else:
+            makedirs(path.dirname(stored), exist_ok=True)
+            try:
+                replace(file_path, stored)
+            except OSError:
+                # the store is on another file system
+                move(file_path, stored)
+
+        return self.link(stored, file_path)
+
+    def link(self, source: str, destination: str) -> str:
+        """links a file into a folder, created if missing
+
+        Args:
+            source (str): the file to link to
+            destination (str): the path of the link
+
+        Returns:
+            str: the file the link points to
+        """
+        source = path.realpath(source)
+        if path.exists(destination) and path.samefile(source, destination):
+            return source
+
+        directory = path.dirname(destination)
+        if directory:
+            makedirs(directory, exist_ok=True)
+
+        # linked beside the destination first, so it is replaced at once
+        partial = f'{destination}.link'
+        if path.lexists(partial):
+            remove(partial)
+        try:
+            link(source, partial)
+        except OSError:
+            try:
+                symlink(source, partial)
+            except OSError:
+                copy2(source, partial)
+        replace(partial, destination)
+
+        return source
+
+    def object_path(self, digest: str, ext: str) -> str:
+        """the path of a file in the store"""
+        return path.join(self.directory, digest[:2], f'{digest}{ext}')
+
+    def digest(self, file_path: str) -> str:
+        """hashes the content of a file, the audio and tags but not the lyrics of an mp3"""
+        content_hash = sha256()
+        is_mp3 = file_path.lower().endswith('.mp3')
+        if is_mp3:
+            for frame in self.tags(file_path):
+                content_hash.update(f'{frame}\n'.encode())
+
+        with open(file_path, 'rb') as f:
+            if is_mp3:
+                start, end = self.audio_range(f)
+            else:
+                start, end = 0, f.seek(0, 2)
+
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                content_hash.update(chunk)
+                remaining -= len(chunk)
+
+        return content_hash.hexdigest()
+
+    @staticmethod
+    def tags(file_path: str) -> list:
+        """the id3 frames of an mp3 other than its lyrics, as sorted text
+
+        The text encoding of a frame is left out, as saving the tags again,
+        such as with the lyrics, can change it.
+        """
+        try:
+            tags = ID3(file_path)
+        except MutagenError:
+            return []
+
+        frames = []
+        for key, frame in tags.items():
+            if key.startswith('USLT'):
+                continue
+            values = {name: value for name, value in vars(frame).items() if name != 'encoding'}
+            frames.append(f'{key}={sorted(values.items())!r}')
+
+        return sorted(frames)
+
+    @staticmethod
+    def audio_range(f) -> tuple:
+        """the offsets of the audio of an mp3, between its id3v2 and id3v1 tags"""
+        header = f.read(10)
+        start = 0
+        if len(header) == 10 and header.startswith(b'ID3'):
+            # the tag size is a syncsafe integer, 7 bits a byte, without the header
+            size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+            # and a footer follows the tag when its flag is set
+            start = 10 + size + (10 if header[5] & 0x10 else 0)
+
+        end = f.seek(0, 2)
+        if end - start >= 128:
+            f.seek(end - 128)
+            if f.read(3) == b'TAG':
+                end -= 128
+
+        return start, max(start, end)
@@ -0,0 +1,343 @@
+#!/usr/bin/python3
+"""
+Contains the Transcoder class
+"""
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from os import cpu_count, getenv, path, remove, replace
+from shutil import which
+from signal import SIGINT, SIGTERM, SIG_IGN, signal
+from subprocess import DEVNULL, PIPE, Popen
+from tempfile import NamedTemporaryFile, TemporaryFile
+from threading import BoundedSemaphore, Lock
+from mutagen.id3 import ID3, USLT
+from models.errors import TranscodeError
+
+# libmp3lame arguments of each quality preset
+PRESETS = {
+    'high': ['-q:a', '0'],
+    'standard': ['-q:a', '2'],
+    'low': ['-q:a', '5'],
+}
+
+# containers audio streams are kept in without transcoding, by source extension
+NATIVE_FORMATS = {
+    'mp4': ('m4a', 'ipod'),
+    'm4a': ('m4a', 'ipod'),
+    'webm': ('opus', 'ogg'),
+}
+
+# ffmpeg metadata keys of the metadata object keys
+METADATA_KEYS = {
+    'title': 'title',
+    'artist': 'artist',
+    'album': 'album',
+    'tracknumber': 'track',
+    'release_date': 'date',
+    'genre': 'genre',
+}
+
+# list - the ffmpeg processes running in this process
+RUNNING = []
+
+# bool - set once the pool of this worker process is cancelled
+CANCELLED = False
+
+
+def ffmpeg_binary() -> str:
+    """finds the ffmpeg executable
+
+    Returns:
+        str: $FFMPEG_BINARY, ffmpeg on the PATH, or the binary bundled with imageio-ffmpeg
+    """
+    binary = getenv('FFMPEG_BINARY') or which('ffmpeg')
+    if binary:
+        return binary
+
+    try:
+        from imageio_ffmpeg import get_ffmpeg_exe
+        return get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        raise TranscodeError('ffmpeg not found, install it or set FFMPEG_BINARY')
+
+
+def transcode_file(settings: dict, *args) -> str:
+    """converts a file in a worker process
+
+    Args:
+        settings (dict): the attributes of the Transcoder to convert with
+        args: the arguments of Transcoder.transcode
+
+    Returns:
+        str: the path of the converted file
+    """
+    if CANCELLED:
+        raise TranscodeError('conversion cancelled')
+    return Transcoder(**settings).transcode(*args)
+
+
+def ignore_interrupt():
+    """lets the main process handle Ctrl-C for the pool workers, which
+    kill their conversion instead when the pool is cancelled"""
+    signal(SIGINT, SIG_IGN)
+    signal(SIGTERM, cancel_conversions)
+
+
+def cancel_conversions(*_):
+    """kills the ffmpeg processes of a worker, failing its conversions"""
+    global CANCELLED
+    CANCELLED = True
+    for process in list(RUNNING):
+        process.kill()
+
+
+class Transcoder:
+    """converts audio files with ffmpeg, tagging them in the same pass
+
+    Attributes:
+        quality (str): the libmp3lame preset to encode with: high, standard or low
+        bitrate (str): a constant bitrate to encode with instead, e.g. 192k
+        keep_native (bool): keep m4a and opus streams in their own codec, without transcoding
+    """
+
+    def __init__(self, quality: str = 'standard', bitrate: str = '', keep_native: bool = False):
+        self.quality = quality
+        self.bitrate = bitrate
+        self.keep_native = keep_native
+
+    def output_path(self, source_ext: str, output: str) -> str:
+        """the path a file with a given source extension is converted to
+
+        Args:
+            source_ext (str): the extension of the source audio, e.g. mp4
+            output (str): the mp3 path requested
+
+        Returns:
+            str: the mp3 path, or a path with the native extension when keeping native audio
+        """
+        if self.keep_native and source_ext in NATIVE_FORMATS:
+            ext, _ = NATIVE_FORMATS[source_ext]
+            return f'{path.splitext(output)[0]}.{ext}'
+        return output
+
+    def transcode(self, source, output: str, metadata: dict = None,
+                  cover: bytes = b'', source_ext: str = 'mp4') -> str:
+        """converts an audio file or stream and tags the result
+
+        Args:
+            source (str | iterable): the path of the source file, or chunks of its bytes
+            output (str): the mp3 path to convert to
+            metadata (dict, optional): the metadata to tag the result with
+            cover (bytes, optional): a jpeg cover image to embed
+            source_ext (str, optional): the extension of the source audio. Defaults to mp4.
+
+        Returns:
+            str: the path of the converted file
+
+        Raises:
+            TranscodeError: if ffmpeg fails
+        """
+        metadata = metadata or {}
+        native = self.keep_native and source_ext in NATIVE_FORMATS
+        output = self.output_path(source_ext, output)
+        container = NATIVE_FORMATS[source_ext][1] if native else 'mp3'
+        # ogg can't hold a cover image
+        cover = cover if container != 'ogg' else b''
+
+        command = [ffmpeg_binary(), '-hide_banner', '-loglevel', 'error', '-y']
+        command += ['-i', source if isinstance(source, str) else 'pipe:0']
+
+        cover_file = None
+        if cover:
+            cover_file = NamedTemporaryFile(suffix='.jpg', delete=False)
+            cover_file.write(cover)
+            cover_file.close()
+            command += ['-i', cover_file.name, '-map', '0:a', '-map', '1:0',
+                        '-c:v', 'copy', '-disposition:v', 'attached_pic',
+                        '-metadata:s:v', 'comment=Cover (front)']
+        else:
+            command += ['-map', '0:a', '-vn']
+
+        # drop the tags of the youtube container
+        command += ['-map_metadata', '-1']
+
+        if native:
+            command += ['-c:a', 'copy']
+        elif self.bitrate:
+            command += ['-c:a', 'libmp3lame', '-b:a', self.bitrate]
+        else:
+            command += ['-c:a', 'libmp3lame'] + PRESETS.get(self.quality, PRESETS['standard'])
+
+        for key, ffmpeg_key in METADATA_KEYS.items():
+            if metadata.get(key):
+                command += ['-metadata', f'{ffmpeg_key}={metadata[key]}']
+        # mp3 lyrics need a USLT frame, which ffmpeg does not write
+        if metadata.get('lyrics') and container != 'mp3':
+            command += ['-metadata', f'lyrics={metadata["lyrics"]}']
+        if container == 'mp3':
+            command += ['-id3v2_version', '3']
+
+        partial = f'{output}.part'
+        command += ['-f', container, partial]
+
+        try:
+            self.__run(command, source)
+            replace(partial, output)
+        except BaseException:
+            if path.exists(partial):
+                remove(partial)
+            raise
+        finally:
+            if cover_file:
+                remove(cover_file.name)
+
+        if container == 'mp3' and metadata.get('lyrics'):
+            self.add_lyrics(output, metadata['lyrics'])
+
+        return output
+
+    @staticmethod
+    def add_lyrics(audio_path: str, lyrics: str):
+        """adds lyrics to an mp3 file as a USLT frame
+
+        Args:
+            audio_path (str): the path of the mp3 file
+            lyrics (str): the lyrics to add
+        """
+        tags = ID3(audio_path)
+        tags.setall('USLT', [USLT(encoding=3, lang='eng', desc='', text=lyrics)])
+        tags.save(audio_path, v2_version=3)
+
+    @staticmethod
+    def __run(command: list, source):
+        """runs ffmpeg, piping the source chunks to it if they are not a file"""
+        piped = not isinstance(source, str)
+        # a file, so ffmpeg never blocks on a full stderr pipe while reading stdin
+        with TemporaryFile() as stderr:
+            process = Popen(command, stdin=PIPE if piped else DEVNULL, stderr=stderr)
+            RUNNING.append(process)
+            try:
+                if piped:
+                    try:
+                        for chunk in source:
+                            process.stdin.write(chunk)
+                    except BrokenPipeError:
+                        # ffmpeg exited, its error is read below
+                        pass
+                    finally:
+                        try:
+                            process.stdin.close()
+                        except BrokenPipeError:
+                            pass
+                process.wait()
+            except BaseException:
+                process.kill()
+                process.wait()
+                raise
+            finally:
+                RUNNING.remove(process)
+
+            if process.returncode != 0:
+                stderr.seek(0)
+                raise TranscodeError(stderr.read().decode(errors='replace').strip())
+
+
+class TranscodePool:
+    """converts files on a pool of worker processes, one ffmpeg process each
+
+    Submitting waits while twice as many files as there are workers are
+    queued or converting, so downloads can't run far ahead of the encoders.
+
+    Attributes:
+        transcoder (Transcoder): the settings to convert with
+        workers (int): the number of worker processes
+    """
+
+    def __init__(self, transcoder: Transcoder, workers: int = 0):
+        self.transcoder = transcoder
+        self.workers = workers or cpu_count() or 1
+        self.__executor = None
+        self.__slots = None
+        # set - outputs of the conversions in flight
+        self.__outputs = set()
+        self.__lock = Lock()
+
+    def submit(self, source, output: str, metadata: dict = None,
+               cover: bytes = b'', source_ext: str = 'mp4') -> Future:
+        """queues a file to be converted, waiting for a free slot
+
+        Args:
+            source (str | AudioStream): the path of the source file, or a
+                stream the worker reads while converting it
+            output (str): the mp3 path to convert to
+            metadata (dict, optional): the metadata to tag the result with
+            cover (bytes, optional): a jpeg cover image to embed
+            source_ext (str, optional): the extension of the source audio. Defaults to mp4.
+
+        Returns:
+            Future: resolves to the path of the converted file
+        """
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ProcessPoolExecutor(
+                    self.workers, initializer=ignore_interrupt)
+                self.__slots = BoundedSemaphore(self.workers * 2)
+            executor, slots = self.__executor, self.__slots
+
+        slots.acquire()
+        output = self.transcoder.output_path(source_ext, output)
+        try:
+            future = executor.submit(
+                transcode_file, vars(self.transcoder),
+                source, output, metadata, cover, source_ext)
+        except BaseException:
+            slots.release()
+            raise
+
+        with self.__lock:
+            self.__outputs.add(output)
+
+        def done(_):
+            slots.release()
+            with self.__lock:
+                self.__outputs.discard(output)
+
+        future.add_done_callback(done)
+        return future
+
+    def transcode(self, *args) -> str:
+        """converts a file on the pool and waits for it
+
+        Args:
+            args: the arguments of submit
+
+        Returns:
+            str: the path of the converted file
+        """
+        return self.submit(*args).result()
+
+    def shutdown(self, cancel: bool = False):
+        """waits for the conversions in flight, or cancels them
+
+        Args:
+            cancel (bool, optional): cancel queued conversions, kill those in flight
+                and remove partial files. Defaults to False.
+        """
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor is None:
+            return
+
+        if cancel:
+            # kill the ffmpeg processes of the workers, rather than waiting for them
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                if process.is_alive():
+                    process.terminate()
+        executor.shutdown(wait=True, cancel_futures=cancel)
+
+        if cancel:
+            with self.__lock:
+                outputs, self.__outputs = self.__outputs, set()
+            for output in outputs:
+                if path.exists(f'{output}.part'):
+                    remove(f'{output}.part')
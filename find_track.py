@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+"""Finds where downloaded songs are in the library"""
+
+from argparse import ArgumentParser
+from engine import library_index, use_library
+
+
+def find(query: str) -> list:
+    """Finds the files of a song in the library index
+
+    Args:
+        query (str): a spotify or youtube url, a file path, or "Artist - Title"
+
+    Returns:
+        list: the rows of the files found
+    """
+    if query.startswith('http'):
+        video_id = library_index.youtube_id(query)
+        rows = library_index.by_youtube_id(video_id) if video_id else []
+        # spotify links, and youtube links without a video id
+        return rows or library_index.by_link(query.split('?')[0])
+
+    row = library_index.get(query)
+    return [row] if row else library_index.by_title(query)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Find where downloaded songs are")
+    parser.add_argument(
+        'query', nargs='+',
+        help='Spotify or YouTube urls, file paths, or "Artist - Title" names.'
+    )
+    parser.add_argument(
+        '--library', type=str, default='Music',
+        help='The spots library to search. Defaults to Music.'
+    )
+    args = parser.parse_args()
+
+    use_library(args.library)
+
+    for query in args.query:
+        rows = find(query)
+        if not rows:
+            print(f'{query}: not found')
+        for row in rows:
+            print(f'{query}: {row["path"]}')
@@ -3,11 +3,11 @@
 
 from argparse import ArgumentParser
 from logging import basicConfig, error, ERROR, info, INFO
-from os import mkdir, chdir, getcwd
-from tenacity import retry, stop_after_delay
-from engine import storage
-from download_urls import convert_url
-from models.youtube_to_spotify import ProcessYoutubeLink
+from os import path
+from tenacity import retry, stop_after_attempt, wait_random_exponential
+from engine import (history, job_queue, lyrics, metrics, rate_limiter, storage, transcode_pool,
+                    transcoder, use_library)
+from engine.rate_limiter import RATES
 
 # set cli arguments
 parser = ArgumentParser(
@@ -22,57 +22,171 @@ parser.add_argument(
     help='Search for one or more tracks by title and name.',
     metavar='"Artist - Title"'
 )
+parser.add_argument(
+    '--jobs', type=int, default=4,
+    help='Number of playlist tracks to download concurrently.'
+)
+parser.add_argument(
+    '--encoders', type=int, default=0,
+    help='Number of processes converting audio. Defaults to the number of CPUs.'
+)
+parser.add_argument(
+    '--quality', choices=['high', 'standard', 'low'], default='standard',
+    help='MP3 encoding quality preset.'
+)
+parser.add_argument(
+    '--bitrate', type=str, default='',
+    help='Encode MP3s at a constant bitrate instead of a quality preset.',
+    metavar='192k'
+)
+parser.add_argument(
+    '--keep-native', action='store_true',
+    help='Keep m4a and opus audio as downloaded, without converting to MP3.'
+)
+parser.add_argument(
+    '--sync', action='store_true',
+    help='Only download the tracks added to a playlist since it was last synced.'
+)
+parser.add_argument(
+    '--no-lyrics', action='store_true',
+    help='Do not search for lyrics. They can be added later with add_lyrics.py.'
+)
+parser.add_argument(
+    '--library', type=str, default='Music',
+    help='The folder music is downloaded to, with the files spots keeps about it. Defaults to Music.'
+)
+parser.add_argument(
+    '--resume', action='store_true',
+    help='Resume the last run, skipping the stages it finished and retrying what failed.'
+)
+parser.add_argument(
+    '--rate', type=str, nargs='+', default=[],
+    help='Requests per second allowed to an api: spotify, genius, deezer, youtube or covers.',
+    metavar='SERVICE=N'
+)
+parser.add_argument(
+    '--metrics', type=str, nargs='?', const='', default=None,
+    help='Time each stage and count cache hits, bytes and retries, writing a JSONL trace of the run '
+         'and a Prometheus textfile to a folder. Defaults to .spots_metrics in the library.',
+    metavar='FOLDER'
+)
 args = parser.parse_args()
 
 # retrieve list of links and search titles
 links = args.url
 search_titles = args.search
+jobs = args.jobs
+sync = args.sync
+library = path.abspath(args.library)
+
+# configure the audio conversion
+transcoder.quality = args.quality
+transcoder.bitrate = args.bitrate
+transcoder.keep_native = args.keep_native
+if args.encoders:
+    transcode_pool.workers = args.encoders
+lyrics.enabled = not args.no_lyrics
+
+# configure the api rate limits
+for rate in args.rate:
+    service, _, limit = rate.partition('=')
+    service = service.strip()
+    if service not in RATES:
+        parser.error(f'invalid rate: {rate}, the service must be one of {", ".join(RATES)}')
+    try:
+        limit = float(limit)
+    except ValueError:
+        parser.error(f'invalid rate: {rate}')
+    # also rejects nan
+    if not limit > 0:
+        parser.error(f'invalid rate: {rate}, the requests per second must be above 0')
+    rate_limiter.rates[service] = limit
 
 
 def main():
-    # Get the current working directory
-    current_dir = getcwd()
+    # every path is resolved against the library, never the current directory
+    use_library(library)
 
-    # Create a new directory
-    new_dir = 'Music'
-    try:
-        mkdir(new_dir)
-    except FileExistsError:
-        pass
-
-    # Change to the new directory
-    chdir(new_dir)
+    if args.metrics is not None:
+        trace = metrics.start(args.metrics or path.join(library, '.spots_metrics'))
+        basicConfig(level=INFO)
+        info(f'tracing the run to {trace}')
 
     storage.reload()
+    queue_jobs()
 
-    download()
+    try:
+        download()
+    except KeyboardInterrupt:
+        # cancel queued conversions and remove partial files
+        print('Cancelling...')
+        transcode_pool.shutdown(cancel=True)
+        raise
+
+    # wait for the lyrics still being searched for, and cache them
+    lyrics.wait()
+    storage.save()
+    # write the textfile once every stage has finished
+    metrics.stop()
+
+
+def queue_jobs():
+    """Queues a job for each search title and url, after the unfinished jobs of the last run if resuming"""
+    if args.resume:
+        job_queue.reload()
+    else:
+        job_queue.clear()
 
-    # Change back to the original directory
-    chdir(current_dir)
+    for title in search_titles:
+        job_queue.add(title, 'search')
+
+    for link in links:
+        is_valid_url = 'spotify' in link or 'youtu' in link
+        if not is_valid_url:
+            basicConfig(level=ERROR)
+            error(f'{link} not valid YouTube or Spotify url')
+            continue
+        job_queue.add(link, 'url')
 
 
-@retry(stop=stop_after_delay(60))
 def download():
-    # search for titles provided
-    for title in search_titles:
-        basicConfig(level=INFO)
-        info(f'searching for {title}...')
-        youtube = ProcessYoutubeLink(search_title=title)
-        youtube.process_youtube_url()
+    """Processes each unfinished job, so a failing item never restarts the others"""
+    for job in job_queue.unfinished():
+        try:
+            with metrics.timer('job', kind=job['kind'], key=job['key']):
+                process_job(job)
+        except Exception as e:
+            basicConfig(level=ERROR)
+            error(f'Failed to process {job["key"]}: {e!r}')
+            job_queue.fail(job['key'], e)
 
         storage.save()
+        history.flush()
 
-    # download all links
-    if links:
-        for link in links:
-            is_valid_url = 'spotify' in link or 'youtu' in link
-            if not is_valid_url:
-                basicConfig(level=ERROR)
-                error(f'{link} not valid YouTube or Spotify url')
-                continue
-            convert_url(link)
-
-            storage.save()
+
+@retry(stop=stop_after_attempt(job_queue.retries), wait=wait_random_exponential(max=30), reraise=True,
+       before_sleep=metrics.retried('job'))
+def process_job(job: dict):
+    """Downloads the tracks of a search title or url job, retrying it with backoff if it raises
+
+    Args:
+        job (dict): the job to process
+    """
+    # the api clients are only imported once there is something to download
+    from download_urls import convert_url
+    from models.youtube_to_spotify import ProcessYoutubeLink
+
+    if job['kind'] == 'search':
+        basicConfig(level=INFO)
+        info(f'searching for {job["key"]}...')
+        youtube = ProcessYoutubeLink(search_title=job['key'])
+        if youtube.process_youtube_url(library):
+            job_queue.update(job['key'], 'tagged')
+        else:
+            # left unfinished, so a resumed run searches for it again
+            job_queue.fail(job['key'], RuntimeError(f'{job["key"]} not converted'))
+    else:
+        convert_url(job['key'], jobs, sync, library)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+"""A pipeline that downloads the tracks of a playlist or album concurrently"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import basicConfig, error, ERROR
+from threading import BoundedSemaphore
+from engine import history, metrics, transcode_pool
+from models.spotify_to_youtube import ProcessSpotifyLink
+
+
+class DownloadPipeline:
+    """Downloads tracks through separate worker pools for network and cpu stages
+
+    The network stages (youtube search, stream lookup and cover fetch) of a
+    track run on one pool and its download and mp3 encoding on another, so
+    tracks are encoded while the next ones are still being searched for.
+    Each encoding worker waits on a worker process of the transcoding pool,
+    which reads the audio stream while it encodes it.
+
+    With a job queue, the stage each track reaches is recorded under its
+    link, so an interrupted run can be resumed.
+
+    Attributes:
+        jobs (int): the number of workers for the network stages
+        encoders (int): the number of workers for the encoding stage
+        queue (JobQueue): the job queue the tracks are recorded in, if any
+        tracks (list): the tracks of the last run, in the order they were given
+        results (list): the outcome of each track of the last run
+    """
+
+    def __init__(self, jobs: int = 4, encoders: int = 0, queue=None):
+        """initializes the pool sizes
+
+        Args:
+            jobs (int, optional): workers for the network stages. Defaults to 4.
+            encoders (int, optional): workers for the encoding stage. Defaults to
+                the number of transcoding processes.
+            queue (JobQueue, optional): records the stage each track reaches. Defaults to None.
+        """
+        self.jobs = max(1, jobs)
+        self.encoders = encoders or transcode_pool.workers
+        self.queue = queue
+        self.tracks = []
+        self.results = []
+
+    def run(self, tracks, directory_path: str = '') -> list:
+        """Downloads each track through the pipeline
+
+        Tracks are taken from `tracks` as slots free up, so the first tracks
+        of a playlist download while its later pages are still being fetched.
+
+        Args:
+            tracks (iterable): the metadata objects of the tracks to download
+            directory_path (str, optional): The directory to save the tracks to. Defaults to ''.
+
+        Returns:
+            list: a result object for each track, in the order of `tracks`
+        """
+        network = ThreadPoolExecutor(self.jobs, thread_name_prefix='network')
+        encoder = ThreadPoolExecutor(self.encoders, thread_name_prefix='encode')
+
+        # bound the tracks in flight, so fetching waits for slow encoders
+        slots = BoundedSemaphore(self.jobs * 2 + self.encoders)
+
+        self.tracks = []
+        pending = []
+        interrupted = False
+        try:
+            for track in tracks:
+                self.tracks.append(track)
+                slots.acquire()
+                pending.append(self.__process(
+                    track, directory_path, network, encoder, slots))
+
+            self.results = [result.result() for result in pending]
+        except KeyboardInterrupt:
+            interrupted = True
+            network.shutdown(wait=False, cancel_futures=True)
+            encoder.shutdown(wait=False, cancel_futures=True)
+            # kill the conversions in flight, so the encoding workers fail at once
+            transcode_pool.shutdown(cancel=True)
+            raise
+        finally:
+            # after an interrupt, the stages in flight are not waited for
+            if not interrupted:
+                network.shutdown()
+                encoder.shutdown()
+
+        return self.results
+
+    @staticmethod
+    def set_aside(tracks, skipped: list, directory_path: str = '', queue=None):
+        """Yields the tracks to download as they are given, setting aside the tracks
+        already in the library, linked into the folder, and those in the download history
+
+        Args:
+            tracks (iterable): the metadata objects of the tracks
+            skipped (list): a result object is appended for each track set aside
+            directory_path (str, optional): The directory to link the tracks to. Defaults to ''.
+            queue (JobQueue, optional): the tracks set aside are recorded as done. Defaults to None.
+
+        Yields:
+            dict: the metadata object of each track to download
+        """
+        for track in tracks:
+            title = ProcessSpotifyLink.track_title(track)
+            if ProcessSpotifyLink.link_from_library(track, directory_path) or title in history:
+                metrics.count('tracks', status='skipped')
+                skipped.append({'title': title, 'status': 'skipped', 'error': ''})
+                if queue and track.get('link'):
+                    queue.update(track['link'], 'tagged')
+            else:
+                yield track
+
+    def __process(self, track: dict, directory_path: str, network, encoder, slots) -> Future:
+        """Submits a track to the network stages, then to the encoding stage
+
+        Returns:
+            Future: resolves to the result object of the track
+        """
+        result = Future()
+        title = ProcessSpotifyLink.track_title(track)
+
+        def record(state: str, **fields):
+            if self.queue and track.get('link'):
+                self.queue.update(track['link'], state, **fields)
+
+        def finish(status: str, exception: Exception = None):
+            if exception:
+                basicConfig(level=ERROR)
+                error(f'Failed to download {title}: {exception!r}')
+            if status == 'failed' and self.queue and track.get('link'):
+                self.queue.fail(track['link'], exception or RuntimeError('not converted'))
+            elif status == 'skipped':
+                record('tagged')
+            metrics.count('tracks', status=status)
+            slots.release()
+            result.set_result({
+                'title': title,
+                'status': status,
+                'error': repr(exception) if exception else ''
+            })
+
+        def encoded(link, future: Future):
+            try:
+                converted = future.result()
+            except Exception as e:
+                finish('failed', e)
+                return
+            if converted:
+                record('encoded', path=link.output_path)
+                # done once the lyrics, if searched for, are written
+                if link.lyrics_search:
+                    link.lyrics_search.add_done_callback(lambda _: record('tagged'))
+                else:
+                    record('tagged')
+            finish('downloaded' if converted else 'failed')
+
+        def fetched(future: Future):
+            try:
+                link, downloaded = future.result()
+            except Exception as e:
+                finish('failed', e)
+                return
+
+            if not downloaded:
+                finish('skipped')
+                return
+
+            record('downloaded')
+            try:
+                encoder.submit(link.encode_audio, *downloaded) \
+                    .add_done_callback(lambda future: encoded(link, future))
+            except RuntimeError as e:
+                # encoder pool shut down by an interrupt
+                finish('failed', e)
+
+        network.submit(self.fetch, track, directory_path) \
+            .add_done_callback(fetched)
+
+        return result
+
+    @staticmethod
+    @metrics.timed('network')
+    def fetch(track: dict, directory_path: str = '') -> tuple:
+        """Runs the network stages of a track
+
+        Args:
+            track (dict): the metadata object of the track
+            directory_path (str, optional): The directory to save the track to. Defaults to ''.
+
+        Returns:
+            tuple: the track's link processor and its audio stream and files, if any
+        """
+        # search youtube for the track
+        link = ProcessSpotifyLink(track)
+
+        # find the audio stream and prefetch the cover for tagging
+        downloaded = link.download_audio(directory_path)
+        if downloaded:
+            try:
+                link.get_cover()
+            except BaseException:
+                # the title was reserved, release it so a retry downloads the track
+                history.release(downloaded[2])
+                raise
+
+        return link, downloaded
@@ -12,3 +12,7 @@ class TitleExistsError(Exception):
 class InvalidURL(Exception):
     """Url not valid"""
     pass
+
+class TranscodeError(Exception):
+    """ffmpeg failed to convert a file"""
+    pass
@@ -3,42 +3,67 @@
 
 from datetime import datetime
 from dotenv import load_dotenv
-from tenacity import retry, stop_after_delay
-from engine import storage
+from tenacity import retry, retry_if_not_exception_type, stop_after_delay, wait_random_exponential
+from concurrent.futures import ThreadPoolExecutor
+from engine import http_pool, metrics, storage
+from engine.shared_client import SharedClient
 from models.errors import InvalidURL
 from os import getenv
 from requests.exceptions import ReadTimeout
-from spotipy.exceptions import SpotifyException
-from spotipy.oauth2 import SpotifyClientCredentials
 import logging
-from lyricsgenius import Genius
-from spotipy import Spotify
 
 load_dotenv()
 
 
+def new_spotify_client():
+    """creates a Spotify API client, on the shared connection pool"""
+    # spotipy is only imported once spotify is used
+    from spotipy import Spotify
+    from spotipy.oauth2 import SpotifyClientCredentials
+
+    return Spotify(
+        auth_manager=SpotifyClientCredentials(
+            client_id=getenv('SPOTIPY_CLIENT_ID'),
+            client_secret=getenv('client_secret'),
+            requests_session=http_pool.session()
+        ),
+        requests_session=http_pool.session()
+    )
+
+
 class GetSpotifyTrack:
     """A class to retrieve metadata for a spotify track, album or playlist
 
     Attributes:
         track_url (str): The spotify url to be processed
+        sync (bool): only process playlist items added since the last sync
     """
 
-    # create a Spotify API client
-    spotify = Spotify(
-        auth_manager=SpotifyClientCredentials(
-            client_id=getenv('SPOTIPY_CLIENT_ID'),
-            client_secret=getenv('client_secret')
-        )
-    )
+    # the Spotify API client, created on first use
+    spotify = SharedClient(new_spotify_client)
 
-    # create genius api for lyrics
-    genius = Genius(getenv('lyricsgenius_key'))
+    # fields required to build the metadata of a track
+    track_fields = ('name', 'artists', 'track_number', 'external_urls')
+    album_fields = ('name', 'images', 'release_date', 'total_tracks')
 
-    def __init__(self, track_url: str):
-        self.track_url = track_url
+    # seconds before a track id that failed to resolve is tried again
+    failed_ttl = 7 * 24 * 60 * 60
+
+    # number of batch requests sent at once
+    concurrency = 8
 
-    @retry(stop=stop_after_delay(120))
+    def __init__(self, track_url: str, sync: bool = False):
+        self.track_url = track_url
+        self.sync = sync
+        # tuple - the playlist id and snapshot of a sync, recorded by commit_sync
+        self.pending_sync = None
+
+    # throttled requests are retried by the rate limiter, so only other
+    # errors are retried here, backing off between attempts
+    @metrics.timed('spotify_track')
+    @retry(stop=stop_after_delay(120), wait=wait_random_exponential(max=30),
+           retry=retry_if_not_exception_type(InvalidURL), reraise=True,
+           before_sleep=metrics.retried('spotify_track'))
     def get_track(self, track_id: str) -> dict:
         """
             Retrieves metadata for a spotify track
@@ -50,74 +75,360 @@ class GetSpotifyTrack:
                 dict: an object with retrieved data
         """
         print('Searching for metadata...')
-        metadata_in_file = storage.get(self.track_url)
+        metadata_in_file = storage.get_by_id(track_id)
+        metrics.count('cache', cache='spotify_metadata', result='hit' if metadata_in_file else 'miss')
         if metadata_in_file:
             return metadata_in_file
 
+        from spotipy.exceptions import SpotifyException
+
         try:
+            # skip spotify for tracks that recently failed
+            if self.has_failed(track_id):
+                raise InvalidURL
+
             # retrieve track from spotify
             track = self.spotify.track(track_id)
 
-            album = track['album']
-
-            # get track number
-            total_track = album['total_tracks']
-            track_position = track['track_number']
-            track_number = f'{track_position}/{total_track}'
-
-            # cover image
-            cover = album['images'][0]['url']
-
-            # get release date
-            try:
-                release_date_str = album['release_date']
-                release_date_obj = datetime.strptime(
-                    release_date_str, "%Y-%m-%d")
-                release_date = release_date_obj.strftime("%Y")
-            except ValueError:
-                release_date = None
-
-            # get track name and artist
-            track_name = track['name']
-
-            # artists
-            artistList = [artist['name'] for artist in track['artists']]
-            # remove featured artists from artists list
-            for artist in artistList:
-                if artist.lower() in track_name.lower():
-                    artistList.remove(artist)
-
-            artist = ', '.join(artistList)
-
-            track_url = track['external_urls']['spotify']
-            album_name = album['name']
-
-            # get track lyrics
-            song = self.genius.search_song(track_name, artist)
-            not_found = not song or 'Verse' not in song.lyrics or track_name not in song.title
-            lyrics = '' if not_found else song.lyrics
-
-            metadata = {
-                'title': track_name,
-                'cover': cover,
-                'artist': artist,
-                'tracknumber': track_number,
-                'album': album_name,
-                'lyrics': lyrics,
-                'release_date': release_date,
-                'link': track_url,
-                'genre': ''
+        except (InvalidURL, SpotifyException) as e:
+            # remember tracks that do not exist
+            if isinstance(e, SpotifyException) and e.http_status in (400, 404):
+                storage.cache_set('failed_tracks', track_id, e.msg)
+            logging.basicConfig(level=logging.ERROR)
+            logging.error(f'{self.track_url} is invalid')
+            raise InvalidURL
+
+        metadata = self.build_metadata(track)
+        storage.new(metadata)
+
+        return metadata
+
+    def has_failed(self, track_id: str) -> bool:
+        """checks if a track id recently failed to resolve"""
+        return storage.cache_get('failed_tracks', track_id, self.failed_ttl) is not None
+
+    def build_metadata(self, track: dict, album: dict = None) -> dict:
+        """
+            Builds the metadata of a spotify track from its track object
+
+            Arguments:
+                track (dict): a full or simplified spotify track object
+                album (dict, optional): the album of the track, if the track object has none
+
+            Returns:
+                dict: an object with retrieved data
+        """
+        album = album or track['album']
+
+        # get track number
+        total_track = album['total_tracks']
+        track_position = track['track_number']
+        track_number = f'{track_position}/{total_track}'
+
+        # cover image
+        cover = album['images'][0]['url'] if album['images'] else ''
+
+        # get release date
+        try:
+            release_date_str = album['release_date']
+            release_date_obj = datetime.strptime(
+                release_date_str, "%Y-%m-%d")
+            release_date = release_date_obj.strftime("%Y")
+        except ValueError:
+            release_date = None
+
+        # get track name and artist
+        track_name = track['name']
+
+        # artists
+        artistList = [artist['name'] for artist in track['artists']]
+        # remove featured artists from artists list
+        for artist in artistList:
+            if artist.lower() in track_name.lower():
+                artistList.remove(artist)
+
+        artist = ', '.join(artistList)
+
+        track_url = track['external_urls']['spotify']
+        album_name = album['name']
+
+        metadata = {
+            'title': track_name,
+            'cover': cover,
+            'artist': artist,
+            'tracknumber': track_number,
+            'album': album_name,
+            # added to the finished file by the lyrics stage
+            'lyrics': '',
+            'release_date': release_date,
+            'link': track_url,
+            'genre': ''
+        }
+
+        return metadata
+
+    def get_tracks(self, tracks: list, album: dict = None) -> list:
+        """
+            Retrieves metadata for a batch of spotify tracks
+
+            Arguments:
+                tracks (list): full or simplified spotify track objects
+                album (dict, optional): the album all the tracks belong to
+
+            Returns:
+                list: an object with retrieved data for each track
+        """
+        print('Searching for metadata...')
+        return list(self.__iter_batch(tracks, album))
+
+    def __iter_batch(self, tracks: list, album: dict = None, albums: dict = None):
+        """
+            Yields metadata for a batch of spotify tracks, in order
+
+            Tracks with metadata in storage are not resolved again, and tracks
+            that recently failed to resolve are skipped.
+        """
+        # skip local files and unavailable tracks
+        tracks = [track for track in tracks if track and track.get('id')]
+
+        cached = {track['id']: storage.get_by_id(track['id']) for track in tracks}
+        unresolved = [
+            track for track in tracks
+            if not cached[track['id']] and not self.has_failed(track['id'])
+        ]
+
+        hits = sum(1 for metadata in cached.values() if metadata)
+        metrics.count('cache', hits, cache='spotify_metadata', result='hit')
+        metrics.count('cache', len(cached) - hits, cache='spotify_metadata', result='miss')
+
+        resolved = {}
+        if unresolved:
+            for track, track_album in self.resolve_tracks(unresolved, album, albums):
+                resolved[track['id']] = (track, track_album)
+
+        for track in tracks:
+            if cached[track['id']]:
+                yield cached[track['id']]
+            elif track['id'] in resolved:
+                metadata = self.build_metadata(*resolved[track['id']])
+                storage.new(metadata)
+                yield metadata
+
+    @metrics.timed('spotify_resolve')
+    @retry(stop=stop_after_delay(120), wait=wait_random_exponential(max=30),
+           retry=retry_if_not_exception_type(InvalidURL), reraise=True,
+           before_sleep=metrics.retried('spotify_resolve'))
+    def resolve_tracks(self, tracks: list, album: dict = None, albums: dict = None) -> list:
+        """
+            Completes a batch of spotify track objects and pairs them with their albums
+
+            Fields missing from the given track objects are fetched with the
+            multi-track and multi-album endpoints, and each album is fetched at
+            most once for all its tracks.
+
+            Arguments:
+                tracks (list): full or simplified spotify track objects
+                album (dict, optional): the album all the tracks belong to
+                albums (dict, optional): complete albums by id, shared between batches
+
+            Returns:
+                list: a (track, album) tuple for each track
+        """
+        from spotipy.exceptions import SpotifyException
+
+        # skip local files and unavailable tracks
+        tracks = [track for track in tracks if track and track.get('id')]
+        albums = {} if albums is None else albums
+
+        try:
+            # fetch full track objects for incomplete tracks
+            incomplete = [
+                track['id'] for track in tracks
+                if not self.__has_fields(track, self.track_fields)
+                or (not album and 'album' not in track)
+            ]
+            full_tracks = {}
+            batches = list(self.__batches(incomplete, 50))
+            responses = self.__fetch_batches(self.spotify.tracks, batches)
+            for batch, response in zip(batches, responses):
+                for track_id, track in zip(batch, response['tracks']):
+                    if track:
+                        full_tracks[track_id] = track
+                    else:
+                        storage.cache_set('failed_tracks', track_id, 'not found')
+
+            # drop the incomplete tracks that were not found
+            tracks = [
+                full_tracks.get(track['id'], track) for track in tracks
+                if track['id'] in full_tracks or track['id'] not in incomplete
+            ]
+
+            if album:
+                return [(track, album) for track in tracks]
+
+            # fetch each incomplete album once, to share it across its tracks
+            for track in tracks:
+                track_album = track.get('album', {})
+                if self.__has_fields(track_album, self.album_fields):
+                    albums.setdefault(track_album.get('id'), track_album)
+
+            missing = {
+                track['album']['id'] for track in tracks
+                if 'album' in track and track['album'].get('id') not in albums
             }
+            batches = list(self.__batches(sorted(missing), 20))
+            for response in self.__fetch_batches(self.spotify.albums, batches):
+                for full_album in response['albums']:
+                    if full_album:
+                        albums[full_album['id']] = full_album
 
-            return metadata
+            return [
+                (track, albums.get(track['album'].get('id'), track['album']))
+                for track in tracks
+            ]
 
         except SpotifyException:
             logging.basicConfig(level=logging.ERROR)
             logging.error(f'{self.track_url} is invalid')
             raise InvalidURL
 
+    def iter_tracks(self, page: dict, album: dict = None, synced: dict = None):
+        """
+            Yields metadata for the tracks of a playlist or album, page by page
+
+            The next page is only requested once the tracks of the current
+            page have been consumed, so downloads can start on the first track
+            while the rest of a large playlist is still being fetched.
+
+            Arguments:
+                page (dict): the first page of playlist items or album tracks
+                album (dict, optional): the album all the tracks belong to
+                synced (dict, optional): the added_at of playlist items synced
+                    before, by track id. Those items are skipped.
+
+            Yields:
+                dict: an object with retrieved data for each track
+
+            Returns:
+                dict: the added_at of every playlist item by track id, or None
+                if the pages could not all be fetched
+        """
+        albums = {}
+        added = {}
+        try:
+            while page:
+                tracks = []
+                for item in page['items']:
+                    # playlist items wrap their track object
+                    track = item['track'] if 'track' in item else item
+                    if track and track.get('id') and 'added_at' in item:
+                        added[track['id']] = item['added_at']
+                        if synced and synced.get(track['id']) == item['added_at']:
+                            continue
+                    tracks.append(track)
+
+                print('Searching for metadata...')
+                yield from self.__iter_batch(tracks, album, albums)
+
+                # tracks that failed to resolve are tried again on the next sync
+                for track in tracks:
+                    if track and track.get('id') in added and self.has_failed(track['id']):
+                        del added[track['id']]
+
+                # keep resolved metadata if the run is interrupted
+                storage.save()
+
+                if page.get('next'):
+                    with metrics.timer('spotify_page'):
+                        page = self.spotify.next(page)
+                else:
+                    page = None
+
+        except ReadTimeout:
+            logging.basicConfig(level=logging.ERROR)
+            logging.error('Network Connection Timed Out!')
+            return None
+
+        return added
+
+    def sync_playlist(self, playlist_id: str) -> tuple:
+        """Processes only the items added to a playlist since its last sync
+
+        The playlist's snapshot id is fetched first, and an unchanged
+        playlist is not processed at all.
+
+        Arguments:
+            playlist_id (str): the id of the playlist
+
+        Returns:
+            tuple: a generator of the metadata of each new track and the name of the playlist
+        """
+        with metrics.timer('spotify_lookup', kind='snapshot'):
+            playlist = self.spotify.playlist(playlist_id, fields='name,snapshot_id')
+        synced = storage.cache_get('playlists', playlist_id) or {}
+
+        if synced.get('snapshot_id') == playlist['snapshot_id']:
+            print(f'{playlist["name"]} is up to date')
+            return iter(()), playlist['name']
+
+        with metrics.timer('spotify_lookup', kind='playlist_items'):
+            page = self.spotify.playlist_items(playlist_id)
+        return self.__iter_sync(
+            playlist_id, playlist['snapshot_id'], page, synced.get('items', {})
+        ), playlist['name']
+
+    def __iter_sync(self, playlist_id: str, snapshot_id: str, page: dict, synced: dict):
+        """yields the new tracks of a playlist, then keeps its snapshot for commit_sync"""
+        added = yield from self.iter_tracks(page, synced=synced)
+
+        if added is not None:
+            self.pending_sync = (playlist_id, {'snapshot_id': snapshot_id, 'items': added})
+
+    def commit_sync(self) -> bool:
+        """Records the snapshot of a synced playlist, once its new tracks are downloaded
+
+        Until then, an interrupted or failed sync processes the same items
+        again on the next sync.
+
+        Returns:
+            bool: True if a snapshot was recorded
+        """
+        if self.pending_sync is None:
+            return False
+
+        playlist_id, snapshot = self.pending_sync
+        storage.cache_set('playlists', playlist_id, snapshot)
+        storage.save()
+        self.pending_sync = None
+
+        return True
+
+    @staticmethod
+    def __has_fields(obj: dict, fields: tuple) -> bool:
+        """checks that a spotify object has all the given fields"""
+        return all(field in obj for field in fields)
+
+    @staticmethod
+    def __batches(ids: list, size: int):
+        """splits a list of ids into batches of at most `size` ids"""
+        for start in range(0, len(ids), size):
+            yield ids[start:start + size]
+
+    def __fetch_batches(self, fetch, batches: list) -> list:
+        """requests several batches at once, returning the responses in order"""
+        if len(batches) < 2:
+            return [fetch(batch) for batch in batches]
+
+        with ThreadPoolExecutor(min(self.concurrency, len(batches))) as executor:
+            return list(executor.map(fetch, batches))
+
     def process_url(self):
-        """processes spotify url according to resource type"""
+        """processes spotify url according to resource type
+
+        Returns:
+            dict: the metadata of a single, or
+            tuple: a generator of the metadata of each track and the name of a playlist or album
+        """
         track_list = []
         playlist_name = ''
         try:
@@ -127,17 +438,17 @@ class GetSpotifyTrack:
             if resource_type == 'playlist':
                 print('Processing Spotify Playlist...')
 
+                if self.sync:
+                    return self.sync_playlist(track_id)
+
                 # get spotify playlist
                 get_playlist = self.spotify.__getattribute__(resource_type)
-                spotify_obj = get_playlist(track_id)
-
-                # get playlist tracks
-                playlist = spotify_obj['tracks']['items']
+                with metrics.timer('spotify_lookup', kind=resource_type):
+                    spotify_obj = get_playlist(track_id)
 
                 playlist_name = spotify_obj['name']
-                # get metadata for each track in playlist
-                for track in playlist:
-                    track_list.append(self.get_track(track["track"]["id"]))
+                # get metadata for the tracks in playlist, page by page
+                track_list = self.iter_tracks(spotify_obj['tracks'])
 
                 return track_list, playlist_name
 
@@ -146,15 +457,12 @@ class GetSpotifyTrack:
 
                 # get spotify album
                 get_album = self.spotify.__getattribute__(resource_type)
-                spotify_obj = get_album(track_id)
-
-                # get album tracks
-                album = spotify_obj['tracks']['items']
+                with metrics.timer('spotify_lookup', kind=resource_type):
+                    spotify_obj = get_album(track_id)
 
                 playlist_name = spotify_obj['name']
-                # get metadata for each track in playlist
-                for track in album:
-                    track_list.append(self.get_track(track["id"]))
+                # get metadata for the tracks in album, sharing the album data
+                track_list = self.iter_tracks(spotify_obj['tracks'], spotify_obj)
 
                 return track_list, playlist_name
 
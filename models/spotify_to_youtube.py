@@ -2,19 +2,20 @@
 """Factor an object to Retrieve and Download a Youtube Video as MP3"""
 
 from __future__ import unicode_literals
+from concurrent.futures import CancelledError
 from dotenv import load_dotenv
 from logging import basicConfig, error, ERROR, info, INFO
 from hashlib import md5
 from models.errors import TitleExistsError
-from moviepy.editor import AudioFileClip
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, TRCK, TALB, USLT, TDRL, TCON
-from mutagen.mp3 import MP3
-from os import path, remove, getenv
+from mutagen import File, MutagenError
+from os import makedirs, path, remove, getenv
 from pytube import YouTube
 from pytube.exceptions import AgeRestrictedError
-from requests import get
-from youtubesearchpython import VideosSearch
-from engine import storage
+from requests import RequestException
+from engine import (cover_cache, history, library_index, lyrics, metrics, rate_limiter,
+                    storage, track_store, transcode_pool)
+from engine.audio_stream import AudioStream
+from engine.titles import title_key
 from models.errors import InvalidURL
 
 load_dotenv()
@@ -23,140 +24,306 @@ load_dotenv()
 class ProcessSpotifyLink:
     """A client that Retrieves and Download a Youtube Video as MP3
 
+    Youtube search results are cached by query in the storage cache for
+    search_ttl, so tracks searched for before are not searched for again.
+    Finished files are kept once in the track store, and a track already
+    in the library is linked into a new folder instead of downloaded again.
+
     Attributes:
         spotify_track (dict): an object with metadata
         youtube_url (str, optional): youtube url to be downloaded. Defaults to ''.
     """
 
+    # int - seconds a youtube search result is reused for
+    search_ttl = 90 * 24 * 60 * 60
+
     def __init__(self, spotify_track: dict, youtube_url=''):
         self.spotify_track = spotify_track
+        self.cover_data = None
+        # string - the search cache key of a youtube url found in the cache
+        self.search_key = ''
+        # string - the finished audio file
+        self.output_path = ''
+        # Future - the lyrics search of the finished file, if one was queued
+        self.lyrics_search = None
         self.youtube_url = youtube_url or self.get_youtube_video()
 
-    def download_youtube_video(self, directory_path=''):
+    def download_youtube_video(self, directory_path='') -> bool:
         """Downloads a youtube video as audio
 
         Args:
-            directory_path (str, optional): The directory to save a playlist to. Defaults to ''.
+            directory_path (str, optional): The directory to save the track to. Defaults to ''.
+
+        Returns:
+            bool: True if the track was converted, linked from the library or
+            downloaded before, False if no video was found or it failed to convert
+        """
+        downloaded = self.download_audio(directory_path)
+        if not downloaded:
+            return bool(self.youtube_url)
+
+        return self.encode_audio(*downloaded)
+
+    def download_audio(self, directory_path='') -> tuple:
+        """Finds the audio stream of a youtube video, to be read while it is encoded
+
+        Args:
+            directory_path (str, optional): The directory to save the track to, created
+                if missing. Defaults to ''.
+
+        Returns:
+            tuple: the audio stream, the mp3 file to convert it to and the track title,
+            or None if nothing will be downloaded
+
+        Raises:
+            InvalidURL: if the youtube url is not available
+            Exception: if the audio stream of the video could not be found
         """
         # no search result found
         if not self.youtube_url:
-            return
+            return None
 
         # check url availability
         try:
-            yt = YouTube(self.youtube_url, use_oauth=bool(getenv('use_oauth')))
-            yt.check_availability()
-        except:
-            basicConfig(level=ERROR)
-            error(f'{self.youtube_url} is not available')
-            raise InvalidURL
+            yt = self.get_available_video()
+        except InvalidURL:
+            if not self.search_key:
+                raise
+            # the cached search result was taken down, search again
+            storage.cache_delete('youtube_search', self.search_key)
+            self.youtube_url = self.get_youtube_video()
+            if not self.youtube_url:
+                return None
+            yt = self.get_available_video()
 
         storage.new(self.spotify_track)
 
         # add title to downloads history
-        track_title = f'{self.spotify_track["artist"]} - {self.spotify_track["title"]}'
-        # '/' will read file name as folder in *nix systems
-        track_title = track_title.replace('/', '|')
+        track_title = self.track_title(self.spotify_track)
 
-        try:
-            self.add_to_download_history(track_title)
-        except TitleExistsError:
+        # downloaded to another folder before
+        with metrics.timer('library_link', track=track_title):
+            linked = self.link_from_library(self.spotify_track, directory_path)
+        metrics.count('cache', cache='library', result='hit' if linked else 'miss')
+        if linked:
+            basicConfig(level=INFO)
+            info(f'{self.spotify_track["title"]} linked from library')
+            return None
+
+        # reserve the title, so no other thread downloads it as well
+        if not history.reserve(track_title):
             basicConfig(level=INFO)
             info(f'{self.spotify_track["title"]} already in list')
-            return
+            return None
 
         # get highest quality audio file
         try:
-            audio = yt.streams.get_audio_only()
-        except:
+            with metrics.timer('stream_lookup', track=track_title):
+                audio = rate_limiter.call('youtube', lambda: yt.streams.get_audio_only())
+        except BaseException:
             basicConfig(level=ERROR)
             error(f"Couldn't download {track_title}")
-            return
-
-        # get audio file name
-        ext = audio.mime_type.split('/')[1]
-        filename = f'{track_title}.{ext}'
+            # the reservation is released, so a retry or resume downloads it
+            history.release(track_title)
+            raise
 
         # file name to download to
-        output = path.join(directory_path, filename)
+        if directory_path:
+            makedirs(directory_path, exist_ok=True)
+        output = self.track_path(directory_path, track_title, audio.mime_type.split('/')[1])
 
-        # Check if the file name length is too long, and truncate if necessary
-        max_filename_length = 255  # Maximum allowed file name length on most systems
-        if len(filename) > max_filename_length:
-            # Generate a unique file name using a hash function (MD5 in this case)
-            file_hash = md5(track_title.encode()).hexdigest()
-            output = path.join(directory_path, f"{file_hash[:25]}.{ext}")
-            filename = f"{file_hash[:25]}.{ext}"
+        # the stream is read in ranges while it is encoded
+        try:
+            stream = AudioStream(audio.url, audio.filesize, output)
+        except BaseException:
+            history.release(track_title)
+            raise
 
-        # download the audio file
-        print(f'Downloading {track_title}...')
-        audio.download(output_path=directory_path, filename=filename)
+        return (
+            stream,
+            f'{path.splitext(output)[0]}.mp3',
+            track_title
+        )
 
-        # convert to mp3 and update metadata
+    @metrics.timed('youtube_availability')
+    def get_available_video(self) -> YouTube:
+        """Checks that the youtube url is available
+
+        Returns:
+            YouTube: the video of the url
+
+        Raises:
+            InvalidURL: if the youtube url is not available
+        """
         try:
-            self.convert_to_mp3(
-                output,
-                path.join(directory_path, filename.replace('.mp4', '.mp3')),
-                track_title
-            )
+            yt = YouTube(self.youtube_url, use_oauth=bool(getenv('use_oauth')))
+            rate_limiter.call('youtube', yt.check_availability)
         except:
-            error(f"Failed to convert {track_title}.{ext}")
-            self.add_to_download_history(track_title, True)
-            return
+            basicConfig(level=ERROR)
+            error(f'{self.youtube_url} is not available')
+            raise InvalidURL
+
+        return yt
 
-    def update_metadata(self, audio_path: str):
-        """Updates the metadata of song to be downloaded
+    def encode_audio(self, source, new_file: str, track_title: str) -> bool:
+        """Converts a downloaded audio file or an audio stream to mp3 and tags it
 
         Args:
-            audio_path (str): the path of the audio file to be updated
+            source (str | AudioStream): the downloaded file or the audio stream
+            new_file (str): the mp3 file to convert to
+            track_title (str): the title to be added to downloads history
+
+        Returns:
+            bool: True if the file was converted
         """
+        # download, convert to mp3 and update metadata
+        print(f'Downloading {track_title}...')
         try:
-            audio = MP3(audio_path, ID3=ID3)
-
-            metadata = self.spotify_track
+            self.convert_to_mp3(source, new_file, track_title)
+        except (CancelledError, KeyboardInterrupt) as e:
+            # interrupted, the track is downloaded again on the next run,
+            # resuming from the partial file of a large stream
+            if isinstance(source, str) and path.isfile(source):
+                remove(source)
+            if isinstance(e, KeyboardInterrupt):
+                raise
+            return False
+        except RequestException:
+            basicConfig(level=ERROR)
+            error(f"Download of {track_title} interrupted")
+            return False
+        except:
+            basicConfig(level=ERROR)
+            error(f"Failed to convert {track_title}")
+            if isinstance(source, AudioStream):
+                source.remove()
+            # the reservation is released, so a retry or resume converts it again
+            return False
+        finally:
+            history.release(track_title)
 
-            # Remove existing ID3 tags
-            audio.tags = None
+        return True
 
-            # Create new ID3 tags
-            audio.tags = ID3()
+    @metrics.timed('cover')
+    def get_cover(self) -> bytes:
+        """Retrieves the cover image of the track, once per instance
 
-            # Set the metadata attributes
-            audio.tags.add(TIT2(encoding=3, text=metadata.get('title', '')))
-            audio.tags.add(TPE1(encoding=3, text=metadata.get('artist', '')))
-            audio.tags.add(
-                TRCK(encoding=3, text=metadata.get('tracknumber', '')))
-            audio.tags.add(TALB(encoding=3, text=metadata.get('album', '')))
+        Returns:
+            bytes: the cover image, empty if the track has no cover
+        """
+        if self.cover_data is None:
+            cover = self.spotify_track.get('cover', '')
+            self.cover_data = cover_cache.get(cover) if cover else b''
 
-            cover = metadata.get('cover', '')
-            if cover:
-                audio.tags.add(APIC(encoding=3, mime='image/jpeg', type=3,
-                                    desc=u'Cover', data=get(metadata['cover']).content))
+        return self.cover_data
 
-            # Add lyrics if provided
-            lyrics = metadata.get('lyrics', '')
-            if lyrics:
-                audio.tags.add(
-                    USLT(encoding=3, lang='eng', desc='', text=lyrics))
+    def add_to_store(self, audio_path: str):
+        """Moves a finished file into the track store, linked back to its folder
 
-            # Set the release date
-            release_date = metadata.get('release_date', '')
-            if release_date:
-                audio.tags.add(
-                    TDRL(encoding=3, text=metadata['release_date']))
+        Args:
+            audio_path (str): the path of the finished file
+        """
+        try:
+            with metrics.timer('track_store', track=audio_path):
+                track_store.put(audio_path)
+        except OSError as e:
+            # the file is kept in its folder only
+            basicConfig(level=ERROR)
+            error(f'Could not add {audio_path} to the track store: {e!r}')
 
-            # Add the new genre tag if provided
-            genre = metadata.get('genre', '')
-            if genre:
-                audio["TCON"] = TCON(encoding=3, text=genre)
+    def add_to_library(self, audio_path: str):
+        """Adds a finished file to the library index, with its links and length
 
-            # Save the changes
-            audio.save(audio_path)
+        Args:
+            audio_path (str): the path of the finished file
+        """
+        try:
+            audio = File(audio_path)
+            duration = audio.info.length if audio else None
+        except MutagenError:
+            duration = None
 
-        except FileNotFoundError:
+        try:
+            with metrics.timer('library_index', track=audio_path):
+                library_index.add(audio_path, self.spotify_track, self.youtube_url,
+                                  duration=duration)
+        except Exception as e:
+            # the file is downloaded, only the index is missing it
             basicConfig(level=ERROR)
-            error(f'{audio_path} not found...')
-            return
+            error(f'Could not add {audio_path} to the library index: {e!r}')
+
+    @staticmethod
+    def link_from_library(metadata: dict, directory_path='') -> str:
+        """Links a track already in the library into a folder
+
+        Args:
+            metadata (dict): the metadata object of the track
+            directory_path (str, optional): The directory to link the track to. Defaults to ''.
+
+        Returns:
+            str: the path of the track in the folder, or '' if it is not in the library
+        """
+        track_title = ProcessSpotifyLink.track_title(metadata)
+        link = metadata.get('link', '')
+        rows = library_index.by_link(link) if link else []
+        for row in rows or library_index.by_title(track_title):
+            if not path.isfile(row['path']):
+                continue
+
+            destination = ProcessSpotifyLink.track_path(
+                directory_path, track_title, path.splitext(row['path'])[1][1:])
+            try:
+                track_store.link(row['path'], destination)
+            except OSError as e:
+                basicConfig(level=ERROR)
+                error(f'Could not link {row["path"]} to {destination}: {e!r}')
+                continue
+
+            youtube_id = row['youtube_id']
+            library_index.add(
+                destination, {**metadata, 'link': link or row['link']},
+                f'https://youtu.be/{youtube_id}' if youtube_id else '',
+                duration=row['duration'])
+            return destination
+
+        return ''
+
+    @staticmethod
+    def track_path(directory_path: str, track_title: str, ext: str) -> str:
+        """Returns the file a track is downloaded to in a folder
+
+        Args:
+            directory_path (str): the folder of the track
+            track_title (str): the title of the track
+            ext (str): the extension of the file
+
+        Returns:
+            str: the path of the file
+        """
+        filename = f'{track_title}.{ext}'
+
+        # Check if the file name length is too long, and truncate if necessary
+        max_filename_length = 255  # Maximum allowed file name length on most systems
+        if len(filename) > max_filename_length:
+            # Generate a unique file name using a hash function (MD5 in this case)
+            file_hash = md5(track_title.encode()).hexdigest()
+            filename = f"{file_hash[:25]}.{ext}"
+
+        return path.join(directory_path, filename)
+
+    @staticmethod
+    def track_title(metadata: dict) -> str:
+        """Returns the title a track is downloaded and kept in history as
+
+        Args:
+            metadata (dict): the metadata object of the track
+
+        Returns:
+            str: the artist and title of the track
+        """
+        track_title = f'{metadata.get("artist", "")} - {metadata.get("title", "")}'
+        # '/' will read file name as folder in *nix systems
+        return track_title.replace('/', '|')
 
     @staticmethod
     def add_to_download_history(title='', add_title=False):
@@ -169,24 +336,12 @@ class ProcessSpotifyLink:
         Raises:
             TitleExistsError: if title already in downloads history
         """
-        history_file = ".spots_download_history.txt"
-
-        # Check if the file exists, otherwise create it
-        if not path.isfile(history_file):
-            with open(history_file, "w", newline=""):
-                pass
+        if title in history:
+            raise TitleExistsError
 
-        # Check if the title already exists in the file
-        with open(history_file, "r") as file:
-            history = file.read().split('\n')
-            for song in history:
-                if title == song:
-                    raise TitleExistsError
-
-        # Add the title to the file
+        # Add the title to the history
         if add_title:
-            with open(history_file, "a", newline="") as file:
-                file.write(f'{title}\n')
+            history.add(title)
 
     def get_youtube_video(self, search_title=''):
         """Searches for a given title on youtube
@@ -198,9 +353,21 @@ class ProcessSpotifyLink:
             str: the watch url
         """
         title = f'{search_title} Audio' if search_title else f"{self.spotify_track['title']} - {self.spotify_track['artist']} Audio"
-        videosSearch = VideosSearch(title, limit=1)
 
-        search_result = videosSearch.result()['result']
+        key = title_key(title)
+        link = storage.cache_get('youtube_search', key, self.search_ttl)
+        metrics.count('cache', cache='youtube_search', result='hit' if link else 'miss')
+        if link:
+            self.search_key = key
+            return link
+
+        # only imported for searches that are not cached
+        from youtubesearchpython import VideosSearch
+
+        # the search is sent when VideosSearch is created
+        with metrics.timer('youtube_search', query=title):
+            search_result = rate_limiter.call(
+                'youtube', lambda: VideosSearch(title, limit=1).result())['result']
 
         if not search_result:
             basicConfig(level=ERROR)
@@ -209,32 +376,57 @@ class ProcessSpotifyLink:
 
         first_result = search_result[0]
 
+        storage.cache_set('youtube_search', key, first_result['link'])
+        self.search_key = ''
+
         return first_result['link']
 
-    def convert_to_mp3(self, old_file: str, new_file: str, song_title: str):
-        """converts an audio file to mp3, updates the metadata and removes the original file
+    def convert_to_mp3(self, old_file, new_file: str, song_title: str):
+        """converts an audio file or stream to mp3 and tags it in one ffmpeg
+        pass on the transcoding pool, then removes the original file
 
         Args:
-            old_file (str): the file to be converted
+            old_file (str | AudioStream): the file or stream to be converted
             new_file (str): the name of the new file
             song_title (str): the title to be added to downloads history
         """
-        try:
-            # Load the audio clip
-            clip = AudioFileClip(old_file)
-            # Convert and save as MP3 format
-            clip.write_audiofile(new_file, codec='mp3')
-
-            # Close the clip
-            clip.close()
-            remove(old_file)
+        streamed = isinstance(old_file, AudioStream)
+        source_path = old_file.file_path if streamed else old_file
 
-            if self.spotify_track:
-                self.update_metadata(new_file)
-
-        except FileNotFoundError:
+        if not streamed and not path.isfile(old_file):
             basicConfig(level=ERROR)
             error(f'{old_file} not found...')
             return
 
+        cover = self.get_cover()
+        # the stream is downloaded while it is encoded, on the transcoding pool
+        with metrics.timer('download_encode', track=song_title):
+            output = transcode_pool.transcode(
+                old_file,
+                new_file,
+                self.spotify_track,
+                cover,
+                path.splitext(source_path)[1][1:]
+            )
+        if metrics.enabled:
+            metrics.count('bytes_downloaded',
+                          old_file.filesize if streamed else path.getsize(old_file),
+                          service='youtube')
+        self.output_path = output
+        if streamed:
+            old_file.remove()
+        else:
+            remove(old_file)
+
         self.add_to_download_history(song_title, True)
+        # stored before its lyrics are written, through the link to the store
+        self.add_to_store(output)
+        self.add_to_library(output)
+
+        # search for lyrics while the next songs download
+        if not self.spotify_track.get('lyrics'):
+            self.lyrics_search = lyrics.submit(
+                output,
+                self.spotify_track.get('artist', ''),
+                self.spotify_track.get('title', '')
+            )
@@ -2,19 +2,36 @@
 """A class that searches for a track from youtube on spotify"""
 
 from __future__ import unicode_literals
-from deezer import Client
 from html import unescape
 from logging import basicConfig, error, ERROR
 from os import getenv
 from pytube import YouTube
+from engine import metrics, rate_limiter, storage
+from engine.shared_client import SharedClient
+from engine.titles import title_key
 from models.errors import MetadataNotFound, InvalidURL
 from models.get_spotify_track import GetSpotifyTrack
 from models.spotify_to_youtube import ProcessSpotifyLink
 
 
+def new_deezer_client():
+    """creates a Deezer API client"""
+    # deezer is only imported once it is searched
+    from deezer import Client
+
+    return Client()
+
+
 class ProcessYoutubeLink(GetSpotifyTrack, ProcessSpotifyLink):
-    """Searches for a track from youtube on deezer or spotify"""
-    deezer_client = Client()
+    """Searches for a track from youtube on deezer or spotify
+
+    Deezer search results are cached by title in the storage cache, so a
+    title is only searched for once every metadata_ttl.
+    """
+    # the Deezer API client, created on first use
+    deezer_client = SharedClient(new_deezer_client)
+    # int - seconds a deezer search result is reused for
+    metadata_ttl = 30 * 24 * 60 * 60
 
     def __init__(self, youtube_url: str = '', search_title: str = ''):
         """initializes the url for title to be searched for
@@ -23,29 +40,41 @@ class ProcessYoutubeLink(GetSpotifyTrack, ProcessSpotifyLink):
             youtube_url (str, optional): the url to be processed. Defaults to ''.
             search_title (str, optional): a title to be searched for. Defaults to ''.
         """
+        self.search_key = ''
         self.youtube_url = youtube_url or self.get_youtube_video(search_title)
+        # dict - the metadata found by search_title
+        self.metadata = None
         self.youtube = YouTube(
             self.youtube_url,
             use_oauth=bool(getenv('use_oauth'))
         ) if self.youtube_url else None
 
-    def process_youtube_url(self):
-        """Processes a youtube url and downloads it"""
+    @metrics.timed('youtube_url')
+    def process_youtube_url(self, directory_path: str = '') -> bool:
+        """Processes a youtube url and downloads it
+
+        Args:
+            directory_path (str, optional): The directory to save the track to. Defaults to ''.
+
+        Returns:
+            bool: True if the track was converted, linked from the library or downloaded before
+        """
         try:
             condition, search_title = self.search_title()
         except InvalidURL:
-            return
+            return False
 
         # download with metadata
         if any(condition):
             print('Downloading with metadata...')
 
-            metadata = self.get_metadata(search_title, self.youtube_url)
+            # found by search_title, from deezer or spotify
+            metadata = self.metadata or self.get_metadata(search_title, self.youtube_url)
 
             ProcessSpotifyLink.__init__(self, metadata, self.youtube_url)
 
             # download video as audio
-            self.download_youtube_video()
+            return self.download_youtube_video(directory_path)
 
         # else download from youtube without editing metadata
         else:
@@ -61,7 +90,7 @@ class ProcessYoutubeLink(GetSpotifyTrack, ProcessSpotifyLink):
 
             ProcessSpotifyLink.__init__(self, metadata)
             print('Downloading from Youtube without editing metadata...')
-            self.download_youtube_video()
+            return self.download_youtube_video(directory_path)
 
     def get_metadata(self, title: str, url: str) -> dict:
         """retrieve metadata using deezer api
@@ -76,9 +105,35 @@ class ProcessYoutubeLink(GetSpotifyTrack, ProcessSpotifyLink):
         Raises:
             MetadataNotFound: if search title not found
         """
+        key = title_key(title)
+        metadata = storage.cache_get('deezer_metadata', key, self.metadata_ttl)
+        metrics.count('cache', cache='deezer_metadata', result='miss' if metadata is None else 'hit')
+
+        if metadata is None:
+            # the whole search is retried when deezer's quota is exceeded
+            with metrics.timer('deezer_search', query=title):
+                metadata = rate_limiter.call('deezer', self.search_metadata, title)
+            # titles not found are cached as well
+            storage.cache_set('deezer_metadata', key, metadata)
+
+        if not metadata:
+            raise MetadataNotFound
+
+        return {**metadata, 'link': url}
+
+    def search_metadata(self, title: str) -> dict:
+        """searches for a title on deezer
+
+        Args:
+            title (str): the title to be searched for
+
+        Returns:
+            dict: the metadata of searched track, without a link, or an
+            empty dict if search title not found
+        """
         res = self.deezer_client.search(title)
         if not res:
-            raise MetadataNotFound
+            return {}
 
         track = res[0]
 
@@ -92,25 +147,21 @@ class ProcessYoutubeLink(GetSpotifyTrack, ProcessSpotifyLink):
         release_date_obj = track.album.release_date
         release_date = release_date_obj.strftime("%Y")
 
-        # get track lyrics
-        song = self.genius.search_song(track_name, artist)
-        not_found = not song or 'Verse' not in song.lyrics
-        lyrics = '' if not_found else song.lyrics
-
         metadata = {
             'title': track_name,
             'cover': cover,
             'artist': artist,
             'tracknumber': track_number,
             'album': album_name,
-            'lyrics': lyrics,
+            # added to the finished file by the lyrics stage
+            'lyrics': '',
             'release_date': release_date,
-            'link': url,
             'genre': genre
         }
 
         return metadata
 
+    @metrics.timed('youtube_title')
     def get_title(self) -> tuple:
         """Retrieve artist and title on YouTube video object
 
@@ -123,13 +174,17 @@ class ProcessYoutubeLink(GetSpotifyTrack, ProcessSpotifyLink):
         # check url availability
         search_response = self.youtube
         try:
-            search_response.check_availability()
+            rate_limiter.call('youtube', search_response.check_availability)
         except:
             basicConfig(level=ERROR)
             error(f'{self.youtube_url} is not available')
+            # the cached search result was taken down, search again next time
+            if self.search_key:
+                storage.cache_delete('youtube_search', self.search_key)
             raise InvalidURL
 
-        result_title = search_response.title
+        # reading the title sends the player request of the video
+        result_title = rate_limiter.call('youtube', lambda: search_response.title)
 
         # Decode the string
         try:
@@ -148,7 +203,8 @@ class ProcessYoutubeLink(GetSpotifyTrack, ProcessSpotifyLink):
         youtube_video_title = youtube_video_title.replace(" (Complete)", '')
 
         # determine if original artist uploaded video
-        artist = '' if '-' in youtube_video_title else search_response.author
+        artist = '' if '-' in youtube_video_title else \
+            rate_limiter.call('youtube', lambda: search_response.author)
         search_title = f'{artist} - {youtube_video_title}' if artist else youtube_video_title
 
         return (search_title, youtube_video_title)
@@ -163,12 +219,13 @@ class ProcessYoutubeLink(GetSpotifyTrack, ProcessSpotifyLink):
 
         # search for title on deezer
         try:
-            metadata = self.get_metadata(search_title, self.youtube_url)
-            first_track_title = metadata['title']
+            self.metadata = self.get_metadata(search_title, self.youtube_url)
+            first_track_title = self.metadata['title']
 
         except MetadataNotFound:
             # search for title on spotify
-            spotify_search = self.spotify.search(search_title)
+            with metrics.timer('spotify_search', query=search_title):
+                spotify_search = self.spotify.search(search_title)
 
             items = spotify_search['tracks']['items']
 
@@ -183,8 +240,8 @@ class ProcessYoutubeLink(GetSpotifyTrack, ProcessSpotifyLink):
 
                 GetSpotifyTrack.__init__(self, spotify_url)
 
-                metadata = self.process_url()
-                first_track_title = metadata['title']
+                self.metadata = self.process_url()
+                first_track_title = self.metadata['title']
 
         condition = [
             first_track_title.lower() in youtube_video_title.lower(),
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+"""Tests the add_to_history module"""
+
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from mutagen.easyid3 import EasyID3
+import add_to_history
+from add_to_history import history_title, process_directory, read_tags, scan
+from engine.library_index import LibraryIndex
+
+
+class TestAddToHistory(unittest.TestCase):
+
+    def setUp(self):
+        """Create a folder of tagged songs"""
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.folder = self.temp_dir.name
+        os.mkdir(os.path.join(self.folder, 'Album'))
+
+        self.songs = {
+            os.path.join(self.folder, 'a.mp3'): ('Artist', 'Title 1'),
+            os.path.join(self.folder, 'Album', 'b.mp3'): ('Artist', 'AC/DC'),
+            os.path.join(self.folder, 'Album', 'c.mp3'): ('', ''),
+        }
+        for file_path, (artist, title) in self.songs.items():
+            self.tag(file_path, artist, title)
+        with open(os.path.join(self.folder, 'cover.jpg'), 'wb') as f:
+            f.write(b'\x00')
+        # the track store is not scanned
+        os.makedirs(os.path.join(self.folder, '.spots_store', 'ab'))
+        self.tag(os.path.join(self.folder, '.spots_store', 'ab', 'abc.mp3'), 'Artist', 'Title 1')
+
+        self.index = LibraryIndex(os.path.join(self.folder, '.spots_library.db'))
+        self.addCleanup(self.index.close)
+
+    @staticmethod
+    def tag(file_path: str, artist: str, title: str):
+        """writes an mp3 with id3 tags only"""
+        with open(file_path, 'wb') as f:
+            f.write(b'\x00' * 128)
+        tags = EasyID3()
+        if artist:
+            tags['artist'] = artist
+        if title:
+            tags['title'] = title
+        tags.save(file_path)
+
+    def test_scan(self):
+        """Every song in the folder and its subfolders should be found"""
+        found = {file_path: size for file_path, size, _ in scan(self.folder)}
+
+        self.assertSetEqual(set(found), set(self.songs))
+        self.assertTrue(all(size > 0 for size in found.values()))
+
+    def test_read_tags(self):
+        """Titles should be read as spots downloads them"""
+        def title(*names):
+            return history_title(read_tags(os.path.join(self.folder, *names)))
+
+        self.assertEqual(title('a.mp3'), 'Artist - Title 1')
+        self.assertEqual(title('Album', 'b.mp3'), 'Artist - AC|DC')
+        self.assertEqual(title('Album', 'c.mp3'), '')
+        self.assertEqual(title('cover.jpg'), '')
+
+    def test_process_directory(self):
+        """Songs should be read once, and again only when they change"""
+        titles, read = process_directory(self.folder, self.index, workers=2)
+        self.assertListEqual(sorted(titles), ['Artist - AC|DC', 'Artist - Title 1'])
+        self.assertEqual(read, 3)
+        self.assertEqual(len(self.index.by_title('Artist - Title 1')), 1)
+
+        # unchanged songs are taken from the index, without a worker pool
+        with patch.object(add_to_history, 'ProcessPoolExecutor') as mock_pool:
+            titles, read = process_directory(self.folder, self.index)
+        mock_pool.assert_not_called()
+        self.assertEqual(read, 0)
+        self.assertEqual(len(titles), 2)
+
+        changed = os.path.join(self.folder, 'Album', 'c.mp3')
+        self.tag(changed, 'Artist', 'Title 3')
+        os.utime(changed, ns=(1, 1))
+        os.remove(os.path.join(self.folder, 'a.mp3'))
+
+        titles, read = process_directory(self.folder, self.index, workers=1)
+        self.assertEqual(read, 1)
+        self.assertListEqual(sorted(titles), ['Artist - AC|DC', 'Artist - Title 3'])
+        self.assertIsNone(self.index.get(os.path.join(self.folder, 'a.mp3')))
+
+    def test_process_directory_keeps_links(self):
+        """Songs spots downloaded should keep their links when read again"""
+        file_path = os.path.join(self.folder, 'a.mp3')
+        link = 'https://open.spotify.com/track/6rqhFgbbKwnb9MLmUQDhG6'
+        self.index.add(file_path, {'title': 'Title 1', 'artist': 'Artist', 'link': link},
+                       'https://youtu.be/4hCogXAzONk')
+
+        process_directory(self.folder, self.index, workers=1, rescan=True)
+
+        row = self.index.get(file_path)
+        self.assertEqual(row['link'], link)
+        self.assertEqual(row['youtube_id'], '4hCogXAzONk')
+
+
+if __name__ == '__main__':
+    unittest.main()
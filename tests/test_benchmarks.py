@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+"""Tests the benchmarks package"""
+
+import unittest
+from time import perf_counter
+from requests import get
+from benchmarks.bench import StageTimer, compare, parse_latency, percentile
+from benchmarks.fake_services import (FakeServices, FakeVideosSearch, FakeYouTube,
+                                      PLAYLIST_ID, track_id)
+from engine.transcoder import ffmpeg_binary
+from models.errors import TranscodeError
+
+try:
+    FFMPEG = ffmpeg_binary()
+except TranscodeError:
+    FFMPEG = ''
+
+
+class TestBench(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        self.result = {
+            'scenario': 'convert_url',
+            'tracks_per_min': 100,
+            'peak_rss_mb': 50,
+            'stages': {'encode': {'count': 10, 'p50_ms': 300, 'p95_ms': 400}},
+        }
+
+    def test_percentile(self):
+        """Percentiles should be the nearest rank"""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertEqual(percentile([], 95), 0)
+
+    def test_compare(self):
+        """Metrics worse than the baseline by more than the tolerance should be flagged"""
+        baseline = {**self.result, 'tracks_per_min': 120, 'peak_rss_mb': 45,
+                    'stages': {'encode': {'count': 10, 'p50_ms': 300, 'p95_ms': 250}}}
+
+        regressions = compare(self.result, baseline, 0.25)
+
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('encode p95 ms', regressions[0])
+        self.assertEqual(len(compare(self.result, baseline, 0.1)), 3)
+        self.assertEqual(compare(self.result, self.result, 0), [])
+
+    def test_stage_timer(self):
+        """Calls of methods and static methods should be timed by stage"""
+        class Client:
+            def fetch(self, value):
+                return value
+
+            @staticmethod
+            def parse(value):
+                return value * 2
+
+        timer = StageTimer()
+        timer.wrap(Client, 'fetch', 'fetch')
+        timer.wrap(Client, 'parse', 'parse')
+
+        self.assertEqual(Client().fetch(1), 1)
+        self.assertEqual(Client.parse(2), 4)
+        self.assertEqual(Client().parse(3), 6)
+
+        summary = timer.summary()
+        self.assertEqual(summary['fetch']['count'], 1)
+        self.assertEqual(summary['parse']['count'], 2)
+
+    def test_parse_latency(self):
+        """A latency should apply to every service, or to the service named"""
+        latency = parse_latency(['10', 'youtube=50'])
+        self.assertEqual(latency['spotify'], 10)
+        self.assertEqual(latency['youtube'], 50)
+
+
+class TestFakeServices(unittest.TestCase):
+
+    def test_spotify(self):
+        """The playlist and tracks of the catalog should be served, after the latency"""
+        with FakeServices(tracks=3, latency={'spotify': 50}) as fake:
+            start = perf_counter()
+            track = get(f'{fake.urls["spotify"]}/v1/tracks/{track_id(2)}').json()
+            self.assertGreaterEqual(perf_counter() - start, 0.025)
+            self.assertEqual(track['name'], 'Song 2')
+
+            playlist = get(f'{fake.urls["spotify"]}/v1/playlists/{PLAYLIST_ID}').json()
+            self.assertEqual(len(playlist['tracks']['items']), 3)
+            self.assertIsNone(playlist['tracks']['next'])
+
+            self.assertEqual(get(f'{fake.urls["spotify"]}/v1/tracks/{track_id(3)}').status_code, 404)
+            self.assertEqual(fake.requests['spotify'], 3)
+
+    def test_errors(self):
+        """A share of requests should fail or be throttled"""
+        with FakeServices(error_rate=1) as fake:
+            self.assertEqual(get(f'{fake.urls["deezer"]}/search?q=Song 1').status_code, 503)
+        with FakeServices(throttle_rate=1) as fake:
+            response = get(f'{fake.urls["deezer"]}/search?q=Song 1')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response.headers['Retry-After'], '1')
+
+    @unittest.skipUnless(FFMPEG, 'ffmpeg not installed')
+    def test_fake_youtube(self):
+        """YouTube stand-ins should search and stream the videos of the catalog"""
+        with FakeServices(duration=1) as fake:
+            FakeYouTube.base_url = fake.urls['youtube']
+
+            link = FakeVideosSearch('Song 4 - Artist 4 Audio', limit=1).result()['result'][0]['link']
+            youtube = FakeYouTube(link)
+            youtube.check_availability()
+            self.assertEqual(youtube.title, 'Artist 4 - Song 4')
+
+            audio = youtube.streams.get_audio_only()
+            self.assertEqual(audio.filesize, len(fake.audio))
+            self.assertEqual(get(f'{audio.url}&range=0-9').content, fake.audio[:10])
+
+
+if __name__ == '__main__':
+    unittest.main()
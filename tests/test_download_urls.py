@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""Tests the download_urls module"""
+
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch, MagicMock
+import download_urls
+from download_urls import convert_url, queue_playlist
+from engine.job_queue import JobQueue
+from models.spotify_to_youtube import ProcessSpotifyLink
+
+
+class TestQueuePlaylist(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.queue = JobQueue(os.path.join(temp_dir.name, '.spots_jobs.json'))
+        for name, value in (('job_queue', self.queue), ('lyrics', MagicMock())):
+            patcher = patch.object(download_urls, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.url = 'https://open.spotify.com/playlist/37i9dQZF1DZ06evO1jdg13'
+        self.listed = []
+        self.spotify = MagicMock()
+        self.spotify.process_url.return_value = (self.playlist(), 'Mock Playlist')
+
+    def playlist(self):
+        """yields the tracks of a playlist, recording how many were listed"""
+        for number in range(3):
+            self.listed.append(number)
+            yield {'title': f'Title {number}', 'artist': 'Artist', 'link': f'link{number}'}
+
+    def test_queue_playlist(self):
+        """Tracks should be queued as they are listed, and the playlist resolved once listed"""
+        tracks, playlist_name = queue_playlist(self.url, self.spotify)
+        self.assertEqual(playlist_name, 'Mock Playlist')
+        self.assertListEqual(self.listed, [])
+
+        self.assertEqual(next(tracks)['link'], 'link0')
+        self.assertListEqual(self.listed, [0])
+        self.assertEqual(self.queue.get('link0')['state'], 'pending')
+        self.assertIsNone(self.queue.get('link1'))
+        self.assertNotIn('tracks', self.queue.get(self.url) or {})
+
+        self.assertListEqual([track['link'] for track in tracks], ['link1', 'link2'])
+        self.assertEqual(self.queue.get(self.url)['state'], 'resolved')
+        self.assertListEqual(self.queue.get(self.url)['tracks'], ['link0', 'link1', 'link2'])
+
+    def test_queue_playlist_resumed(self):
+        """A listed playlist should not be fetched again, and only its unfinished tracks downloaded"""
+        list(queue_playlist(self.url, self.spotify)[0])
+        self.queue.update('link0', 'tagged')
+        self.queue.update('link1', 'encoded', path='b.mp3')
+
+        tracks, playlist_name = queue_playlist(self.url, self.spotify)
+
+        self.assertListEqual([track['link'] for track in tracks], ['link2'])
+        self.assertEqual(playlist_name, 'Mock Playlist')
+        self.spotify.process_url.assert_called_once_with()
+        download_urls.lyrics.submit.assert_called_once_with('b.mp3', 'Artist', 'Title 1')
+
+
+class TestConvertUrl(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.queue = JobQueue(os.path.join(temp_dir.name, '.spots_jobs.json'))
+        patcher = patch.object(download_urls, 'job_queue', self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.url = 'https://open.spotify.com/track/1bYSPMAQwHK2dLuMDtKZ0W'
+        self.queue.add(self.url, 'url')
+
+    @patch.object(ProcessSpotifyLink, 'convert_to_mp3')
+    @patch.object(ProcessSpotifyLink, 'download_audio')
+    @patch.object(ProcessSpotifyLink, 'link_from_library')
+    @patch('models.spotify_to_youtube.storage')
+    @patch('download_urls.GetSpotifyTrack')
+    def test_convert_url_track_not_converted(self, mock_spotify, mock_storage, mock_link_from_library,
+                                             mock_download_audio, mock_convert_to_mp3):
+        """A single track that fails to convert should be left unfinished"""
+        mock_spotify.return_value.process_url.return_value = {
+            'title': 'Mock Track', 'artist': 'Mock Artist', 'link': self.url}
+        mock_storage.cache_get.return_value = 'https://youtu.be/mockId'
+        mock_link_from_library.return_value = None
+        mock_download_audio.return_value = ('a.mp4', 'a.mp3', 'Mock Artist - Mock Track')
+        mock_convert_to_mp3.side_effect = RuntimeError
+
+        convert_url(self.url)
+
+        mock_convert_to_mp3.assert_called_once()
+        self.assertEqual(self.queue.get(self.url)['state'], 'failed')
+        self.assertListEqual([job['key'] for job in self.queue.unfinished()], [self.url])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+"""Tests the audio_stream module"""
+
+import os
+import unittest
+from unittest.mock import patch, MagicMock
+from engine.audio_stream import AudioStream
+from requests import ConnectionError
+
+
+class TestAudioStream(unittest.TestCase):
+
+    def setUp(self):
+        """Serve the stream from a mock session, in ranges of 10 bytes"""
+        self.data = bytes(range(95))
+        self.file_path = '.test_stream.mp4'
+        self.url = 'https://rr1.googlevideo.com/videoplayback?id=1'
+        # ranges requested, and the ranges to fail once
+        self.requested = []
+        self.failing = set()
+
+        patcher = patch('engine.audio_stream.Session')
+        self.mock_session = patcher.start().return_value.__enter__.return_value
+        self.mock_session.get.side_effect = self.get
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('engine.audio_stream.default_range_size', 10)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Remove partial files"""
+        if os.path.exists(f'{self.file_path}.part'):
+            os.remove(f'{self.file_path}.part')
+
+    def get(self, url, **kwargs):
+        """a response with the bytes of the range in the url"""
+        start, end = map(int, url.split('&range=')[1].split('-'))
+        self.requested.append(start)
+
+        def iter_content(chunk_size):
+            for offset in range(start, end + 1, chunk_size):
+                if offset > start and start in self.failing:
+                    self.failing.discard(start)
+                    raise ConnectionError
+                yield self.data[offset:min(offset + chunk_size, end + 1)]
+
+        response = MagicMock()
+        response.__enter__.return_value.iter_content.side_effect = iter_content
+        return response
+
+    def test_iter(self):
+        """Iterating should fetch every range, without a partial file"""
+        stream = AudioStream(self.url, len(self.data), self.file_path, chunk_size=4)
+
+        self.assertEqual(b''.join(stream), self.data)
+        self.assertListEqual(self.requested, list(range(0, 95, 10)))
+        self.assertFalse(os.path.exists(stream.partial_path))
+
+    def test_iter_retries_range(self):
+        """A broken response should be fetched again from the last byte read"""
+        self.failing.add(20)
+        stream = AudioStream(self.url, len(self.data), self.file_path, chunk_size=4)
+
+        self.assertEqual(b''.join(stream), self.data)
+        # 4 bytes of the range starting at 20 were read before it failed
+        self.assertIn(24, self.requested)
+
+    def test_iter_resumes_partial_file(self):
+        """A large stream should be kept in a partial file, and resumed from it"""
+        with patch.object(AudioStream, 'resume_size', 50):
+            stream = AudioStream(self.url, len(self.data), self.file_path)
+            with open(stream.partial_path, 'wb') as f:
+                f.write(self.data[:60])
+
+            self.assertEqual(b''.join(stream), self.data)
+
+        self.assertEqual(self.requested[0], 60)
+        with open(stream.partial_path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+        stream.remove()
+        self.assertFalse(os.path.exists(stream.partial_path))
+
+    def test_iter_gives_up(self):
+        """Ranges failing on every attempt should raise"""
+        self.mock_session.get.side_effect = ConnectionError
+        stream = AudioStream(self.url, len(self.data), self.file_path, retries=2)
+
+        with self.assertRaises(ConnectionError):
+            b''.join(stream)
+        self.assertEqual(self.mock_session.get.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
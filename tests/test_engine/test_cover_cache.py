@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+"""Tests the cover_cache module"""
+
+import os
+import unittest
+from shutil import rmtree
+from threading import Thread
+from unittest.mock import patch, MagicMock
+from engine.cover_cache import CoverCache
+from requests import RequestException
+
+
+class TestCoverCache(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        self.directory = '.test_covers'
+        self.url = 'https://i.scdn.co/image/cover'
+        self.cover = b'cover image'
+
+        # storage cache entries kept in a dictionary
+        self.entries = {}
+        self.storage = MagicMock()
+        self.storage.cache_get.side_effect = \
+            lambda namespace, key: self.entries.get((namespace, key))
+        self.storage.cache_set.side_effect = \
+            lambda namespace, key, value: self.entries.__setitem__((namespace, key), value)
+
+        self.cache = CoverCache(self.storage, self.directory)
+        patcher = patch.object(CoverCache, 'session')
+        self.mock_session = patcher.start()
+        self.mock_session.get.return_value.content = self.cover
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Tear down test methods"""
+        rmtree(self.directory, ignore_errors=True)
+
+    def test_get(self):
+        """Method should fetch a cover once, then serve it from memory"""
+        self.assertEqual(self.cache.get(self.url), self.cover)
+        self.assertEqual(self.cache.get(self.url), self.cover)
+
+        self.mock_session.get.assert_called_once_with(self.url, timeout=30)
+
+    def test_get_from_disk(self):
+        """Covers fetched in a previous run should be read from disk"""
+        self.cache.get(self.url)
+
+        cache = CoverCache(self.storage, self.directory)
+        self.assertEqual(cache.get(self.url), self.cover)
+        self.mock_session.get.assert_called_once()
+
+    def test_get_from_threads(self):
+        """Tracks of one album downloading together should fetch the cover once"""
+        threads = [Thread(target=self.cache.get, args=(self.url,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.mock_session.get.assert_called_once()
+
+    def test_same_content_stored_once(self):
+        """Urls with the same image should share one file"""
+        self.cache.get(self.url)
+        self.cache.get(f'{self.url}2')
+
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_evict(self):
+        """Least recently used covers should be removed beyond max_size"""
+        self.cache.max_size = len(b'cover 0') * 3
+        for number in range(3):
+            self.mock_session.get.return_value.content = f'cover {number}'.encode()
+            self.cache.get(f'{self.url}{number}')
+            digest = self.entries[('covers', f'{self.url}{number}')]
+            os.utime(os.path.join(self.directory, f'{digest}.jpg'), (number, number))
+
+        # the fourth cover evicts the least recently used one
+        self.mock_session.get.return_value.content = b'cover 3'
+        self.cache.get(f'{self.url}3')
+
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        oldest = self.entries[('covers', f'{self.url}0')]
+        self.assertNotIn(f'{oldest}.jpg', os.listdir(self.directory))
+
+    def test_evict_removed_cover(self):
+        """A cover removed while it is being evicted should not fail the fetch"""
+        self.cache.max_size = 0
+        self.cache.get(self.url)
+
+        self.mock_session.get.return_value.content = b'cover 1'
+        with patch('engine.cover_cache.remove', side_effect=FileNotFoundError):
+            self.assertEqual(self.cache.get(f'{self.url}1'), b'cover 1')
+
+    def test_get_failed_fetch(self):
+        """A cover that can't be fetched should be empty, and not cached"""
+        self.mock_session.get.side_effect = RequestException
+
+        self.assertEqual(self.cache.get(self.url), b'')
+        self.storage.cache_set.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
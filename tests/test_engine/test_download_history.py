@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""Tests the download_history module"""
+
+import os
+import unittest
+from threading import Thread
+from engine.download_history import DownloadHistory
+
+
+class TestDownloadHistory(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        self.history_file = ".test_download_history.txt"
+        with open(self.history_file, "w") as f:
+            f.write("Artist - Title 1\nArtist - Title 2\n")
+        self.history = DownloadHistory(self.history_file, batch_size=2)
+
+    def tearDown(self):
+        """Tear down test methods"""
+        try:
+            os.remove(self.history_file)
+        except:
+            pass
+
+    def test_contains(self):
+        """Titles in the file should be found, ignoring case and spacing"""
+        self.assertIn("Artist - Title 1", self.history)
+        self.assertIn("artist -  TITLE 2", self.history)
+        self.assertNotIn("Artist - Title 3", self.history)
+
+    def test_reserve(self):
+        """A title should only be reserved once, and never if downloaded"""
+        self.assertFalse(self.history.reserve("Artist - Title 1"))
+        self.assertTrue(self.history.reserve("Artist - Title 3"))
+        self.assertFalse(self.history.reserve("Artist - Title 3"))
+
+        self.history.release("Artist - Title 3")
+        self.assertTrue(self.history.reserve("Artist - Title 3"))
+
+    def test_reserve_from_threads(self):
+        """Only one of several threads should reserve the same title"""
+        reserved = []
+
+        def reserve():
+            reserved.append(self.history.reserve("Artist - Title 3"))
+
+        threads = [Thread(target=reserve) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(reserved.count(True), 1)
+
+    def test_add(self):
+        """Added titles should be written to the file in batches"""
+        self.history.add("Artist - Title 3")
+        with open(self.history_file) as f:
+            self.assertNotIn("Artist - Title 3", f.read())
+        self.assertIn("Artist - Title 3", self.history)
+
+        # a full batch is written
+        self.history.add("Artist - Title 4")
+        with open(self.history_file) as f:
+            self.assertEqual(
+                f.read().splitlines()[-2:],
+                ["Artist - Title 3", "Artist - Title 4"]
+            )
+
+    def test_flush(self):
+        """Method should write buffered titles, and reload should read them"""
+        self.history.add("Artist - Title 3")
+        self.history.add("Artist - Title 1")
+        self.history.flush()
+
+        history = DownloadHistory(self.history_file)
+        self.assertIn("Artist - Title 3", history)
+        with open(self.history_file) as f:
+            self.assertEqual(f.read().count("Artist - Title 1"), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
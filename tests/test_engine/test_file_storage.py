@@ -1,7 +1,9 @@
 #!/usr/bin/python3
 """Tests the file_storage module"""
 
+import json
 import unittest
+from tempfile import TemporaryDirectory
 from engine.file_storage import FileStorage
 import os
 
@@ -46,6 +48,17 @@ class TestFileStorage(unittest.TestCase):
         self.storage.save()
         self.assertTrue(os.path.exists(".metadata.json"))
 
+    def test_save_to_file_path(self):
+        """Method should write to the file path given, wherever the current directory is"""
+        with TemporaryDirectory() as library:
+            file_path = os.path.join(library, '.metadata.json')
+            storage = FileStorage(file_path)
+            storage.new(self.test_dict)
+            storage.save()
+
+            self.assertTrue(os.path.exists(file_path))
+            self.assertFalse(os.path.exists(".metadata.json"))
+
     def test_reload(self):
         """Method should deserialize objects from file to memory"""
         self.storage.new(self.test_dict)
@@ -60,6 +73,96 @@ class TestFileStorage(unittest.TestCase):
         obj = self.storage.get(self.link)
         self.assertEqual(obj, self.test_dict)
 
+    def test_save_appends_changed_objects(self):
+        """Method should only append objects changed since the last save"""
+        self.storage.new(self.test_dict)
+        self.storage.save()
+        with open(".metadata.json") as f:
+            saved = len(f.readlines())
+
+        # saving unchanged objects writes nothing
+        self.storage.new(dict(self.test_dict))
+        self.storage.save()
+        with open(".metadata.json") as f:
+            self.assertEqual(len(f.readlines()), saved)
+
+        # a changed object is appended, and wins on reload
+        self.storage.new(dict(self.test_dict, genre='Hip-Hop'))
+        self.storage.save()
+        with open(".metadata.json") as f:
+            self.assertEqual(len(f.readlines()), saved + 1)
+
+        self.storage.all().clear()
+        self.storage.reload()
+        self.assertEqual(self.storage.get(self.link)['genre'], 'Hip-Hop')
+
+    def test_compact(self):
+        """Method should rewrite the file with one record per object"""
+        for genre in ['Rap', 'Pop', 'R&B']:
+            self.storage.new(dict(self.test_dict, genre=genre))
+            self.storage.save()
+
+        self.storage.compact()
+
+        with open(".metadata.json") as f:
+            self.assertEqual(len(f.readlines()), len(self.storage.all()))
+        self.assertEqual(self.storage.get(self.link)['genre'], 'R&B')
+
+    def test_reload_legacy_file(self):
+        """Method should load files holding all objects in one JSON object"""
+        with open(".metadata.json", "w") as f:
+            json.dump({self.link: self.test_dict}, f)
+
+        self.storage.all().clear()
+        self.storage.reload()
+
+        self.assertEqual(self.storage.get(self.link), self.test_dict)
+
+        # the first save after an upgrade keeps the objects saved before it
+        other = {**self.test_dict, 'link': 'https://open.spotify.com/track/other'}
+        self.storage.new(other)
+        self.storage.save()
+
+        self.storage.all().clear()
+        FileStorage().reload()
+        self.assertEqual(self.storage.get(self.link), self.test_dict)
+        self.assertEqual(self.storage.get(other['link']), other)
+
+    def test_get_by_secondary_index(self):
+        """Methods should find objects by spotify id and by artist and title"""
+        self.storage.new(self.test_dict)
+
+        self.assertEqual(
+            self.storage.get_by_id('7uZObZTHwL3DbEx05TXSRh'), self.test_dict)
+        self.assertEqual(
+            self.storage.get_by_title("dreamdoll - Funeral (feat. Lil' Kim)"),
+            self.test_dict
+        )
+        # titles are keyed like the download history
+        self.assertEqual(
+            self.storage.get_by_title("DREAMDOLL  -  funeral (feat. lil' kim)"),
+            self.test_dict
+        )
+        self.assertIsNone(self.storage.get_by_id('unknown'))
+
+    def test_cache(self):
+        """Methods should cache values by namespace and key, with a ttl"""
+        self.storage.cache_set('failed_tracks', 'id1', 'not found')
+
+        self.assertEqual(
+            self.storage.cache_get('failed_tracks', 'id1'), 'not found')
+        self.assertIsNone(self.storage.cache_get('other', 'id1'))
+        self.assertIsNone(self.storage.cache_get('failed_tracks', 'id1', ttl=-1))
+
+        # cache entries are saved with the objects
+        self.storage.save()
+        storage2 = FileStorage()
+        storage2.reload()
+        self.assertEqual(storage2.cache_get('failed_tracks', 'id1'), 'not found')
+
+        self.storage.cache_delete('failed_tracks', 'id1')
+        self.assertIsNone(self.storage.cache_get('failed_tracks', 'id1'))
+
 
 if __name__ == '__main__':
     unittest.main()
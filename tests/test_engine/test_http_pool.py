@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+"""Tests the http_pool module"""
+
+import unittest
+from threading import Lock, Thread
+from time import sleep
+from unittest.mock import patch, MagicMock
+from engine.http_pool import HttpPool
+from engine.rate_limiter import RateLimiter
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+
+class TestHttpPool(unittest.TestCase):
+
+    def setUp(self):
+        """Count the requests in flight to each host"""
+        self.pool = HttpPool(per_host=2)
+        self.in_flight = {}
+        self.most_in_flight = {}
+        self.lock = Lock()
+
+        def send(adapter, request, **kwargs):
+            host = request.url.split('/')[2]
+            with self.lock:
+                self.in_flight[host] = self.in_flight.get(host, 0) + 1
+                self.most_in_flight[host] = max(
+                    self.most_in_flight.get(host, 0), self.in_flight[host])
+            sleep(0.02)
+            with self.lock:
+                self.in_flight[host] -= 1
+            return MagicMock()
+
+        patcher = patch.object(HTTPAdapter, 'send', send)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_send_limits_requests_per_host(self):
+        """No more than per_host requests should be in flight to a host"""
+        requests = [
+            MagicMock(url=f'https://{host}/resource')
+            for host in ['api.spotify.com'] * 6 + ['api.genius.com'] * 2
+        ]
+        threads = [Thread(target=self.pool.send, args=(request,)) for request in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.most_in_flight['api.spotify.com'], 2)
+        self.assertEqual(self.most_in_flight['api.genius.com'], 2)
+
+    def test_session(self):
+        """Sessions should send their requests through the shared pool"""
+        session = Session()
+        self.assertIs(self.pool.session(session), session)
+
+        self.assertIs(session.get_adapter('https://api.spotify.com'), self.pool)
+        self.assertIs(self.pool.session().get_adapter('http://example.com'), self.pool)
+
+    @patch('engine.rate_limiter.sleep')
+    def test_send_retries_throttled_request(self, mock_sleep):
+        """Throttled requests should pause their service and be sent again"""
+        limiter = RateLimiter()
+        pool = HttpPool(limiter)
+        throttled = MagicMock(status_code=429, headers={'Retry-After': '2'})
+        ok = MagicMock(status_code=200)
+
+        with patch.object(HTTPAdapter, 'send', side_effect=[throttled, ok]) as mock_send:
+            response = pool.send(MagicMock(url='https://api.spotify.com/v1/tracks'))
+
+        self.assertIs(response, ok)
+        self.assertEqual(mock_send.call_count, 2)
+        throttled.close.assert_called_once()
+        self.assertAlmostEqual(mock_sleep.call_args_list[0][0][0], 2, delta=0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
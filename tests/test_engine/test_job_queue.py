@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+"""Tests the job_queue module"""
+
+import os
+import unittest
+from engine.job_queue import JobQueue
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        self.jobs_file = ".test_jobs.json"
+        self.queue = JobQueue(self.jobs_file)
+        self.queue.clear()
+
+    def tearDown(self):
+        """Tear down test methods"""
+        try:
+            os.remove(self.jobs_file)
+        except FileNotFoundError:
+            pass
+
+    def test_add(self):
+        """A key should only be queued once, as a pending job"""
+        job = self.queue.add('Artist - Title', 'search')
+        self.assertEqual(job['state'], 'pending')
+        self.assertEqual(job['kind'], 'search')
+
+        self.queue.update('Artist - Title', 'tagged')
+        self.assertEqual(self.queue.add('Artist - Title', 'search')['state'], 'tagged')
+
+    def test_update_and_fail(self):
+        """States should be recorded, and failed attempts counted"""
+        self.queue.add('mock_url', 'url')
+        self.queue.fail('mock_url', TimeoutError())
+        self.queue.fail('mock_url', TimeoutError())
+
+        job = self.queue.get('mock_url')
+        self.assertEqual(job['state'], 'failed')
+        self.assertEqual(job['attempts'], 2)
+        self.assertIn('TimeoutError', job['error'])
+
+        with self.assertRaises(ValueError):
+            self.queue.update('mock_url', 'unknown')
+
+    def test_reload(self):
+        """A new queue should resume from the last recorded state of each job"""
+        self.queue.add('mock_search', 'search')
+        self.queue.add('mock_playlist', 'url')
+        self.queue.add('mock_track', 'track', metadata={'title': 'Title'})
+        self.queue.update('mock_playlist', 'resolved', name='Playlist', tracks=['mock_track'])
+        self.queue.update('mock_track', 'encoded', path='Playlist/Title.mp3')
+        self.queue.update('mock_search', 'tagged')
+
+        queue = JobQueue(self.jobs_file)
+        queue.reload()
+
+        self.assertListEqual([job['key'] for job in queue.unfinished()], ['mock_playlist'])
+        track = queue.tracks('mock_playlist')[0]
+        self.assertEqual(track['state'], 'encoded')
+        self.assertEqual(track['path'], 'Playlist/Title.mp3')
+        self.assertEqual(track['metadata'], {'title': 'Title'})
+
+    def test_clear(self):
+        """Clearing should forget the jobs of the last run"""
+        self.queue.add('mock_url', 'url')
+        self.queue.clear()
+
+        self.assertIsNone(self.queue.get('mock_url'))
+        self.assertFalse(os.path.exists(self.jobs_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
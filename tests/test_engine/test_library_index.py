@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""Tests the library_index module"""
+
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from threading import Thread
+from engine.library_index import LibraryIndex
+
+
+class TestLibraryIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.library = self.temp_dir.name
+        self.index = LibraryIndex(os.path.join(self.library, '.spots_library.db'))
+        self.addCleanup(self.index.close)
+
+        self.audio_path = os.path.join(self.library, 'Playlist', 'Artist - Title.mp3')
+        os.mkdir(os.path.dirname(self.audio_path))
+        with open(self.audio_path, 'wb') as f:
+            f.write(b'\x00' * 128)
+        self.metadata = {
+            'title': 'Title',
+            'artist': 'Artist',
+            'album': 'Album',
+            'link': 'https://open.spotify.com/track/6rqhFgbbKwnb9MLmUQDhG6'
+        }
+
+    def test_add(self):
+        """A file should be found by path, link, youtube id and title"""
+        self.index.add(self.audio_path, self.metadata,
+                       'https://www.youtube.com/watch?v=4hCogXAzONk', duration=180.5)
+
+        row = self.index.get(self.audio_path)
+        self.assertEqual(row['size'], 128)
+        self.assertEqual(row['duration'], 180.5)
+        self.assertEqual(row['youtube_id'], '4hCogXAzONk')
+
+        self.assertEqual(self.index.by_link(self.metadata['link']), [row])
+        self.assertEqual(self.index.by_youtube_id('4hCogXAzONk'), [row])
+        self.assertEqual(self.index.by_title('artist -  TITLE'), [row])
+        self.assertEqual(self.index.by_title('Artist - Other'), [])
+
+    def test_add_updates_file(self):
+        """Adding a file again should replace its row"""
+        self.index.add(self.audio_path, self.metadata)
+        self.index.add(self.audio_path, {**self.metadata, 'title': 'New Title'})
+
+        self.assertEqual(self.index.get(self.audio_path)['title'], 'New Title')
+        self.assertEqual(self.index.by_title('Artist - Title'), [])
+
+    def test_under_and_remove(self):
+        """Files should be listed by folder, and removed"""
+        other = os.path.join(self.library, 'Playlist 2', 'Artist - Title.mp3')
+        self.index.add(self.audio_path, self.metadata)
+        self.index.add(other, self.metadata, size=1, mtime=1)
+
+        self.assertEqual(
+            [row['path'] for row in self.index.under(os.path.join(self.library, 'Playlist'))],
+            [self.audio_path])
+        self.assertEqual(len(self.index.under(self.library)), 2)
+
+        self.index.remove(other)
+        self.assertIsNone(self.index.get(other))
+        self.assertEqual(len(self.index.by_link(self.metadata['link'])), 1)
+
+    def test_reopen(self):
+        """The index should be kept on disk"""
+        self.index.add(self.audio_path, self.metadata)
+        self.index.close()
+
+        index = LibraryIndex(self.index.file_path)
+        self.addCleanup(index.close)
+        self.assertEqual(index.get(self.audio_path)['link'], self.metadata['link'])
+
+    def test_add_from_threads(self):
+        """Files added from several threads should all be indexed"""
+        threads = [
+            Thread(target=self.index.add, args=(f'{self.audio_path}.{number}', self.metadata),
+                   kwargs={'size': number, 'mtime': number})
+            for number in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.index.by_link(self.metadata['link'])), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+"""Tests the lyrics module"""
+
+import os
+import unittest
+from time import time
+from unittest.mock import patch, MagicMock, Mock
+from engine.lyrics import LyricsStage
+from mutagen.id3 import ID3
+
+
+class TestLyricsStage(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        self.audio_path = '.test_lyrics.mp3'
+        self.lyrics = 'Mock Lyrics\nVerse 1...'
+
+        # storage cache entries kept in a dictionary, with the time they were cached
+        self.entries = {}
+        self.storage = MagicMock()
+
+        def cache_get(namespace, key, ttl=None):
+            value, cached = self.entries.get((namespace, key), (None, 0))
+            if ttl is not None and time() - cached > ttl:
+                return None
+            return value
+
+        self.storage.cache_get.side_effect = cache_get
+        self.storage.cache_set.side_effect = \
+            lambda namespace, key, value: self.entries.__setitem__((namespace, key), (value, time()))
+
+        self.stage = LyricsStage(self.storage)
+        patcher = patch.object(LyricsStage, 'genius')
+        self.mock_genius = patcher.start()
+        self.mock_genius.search_song.return_value = Mock(
+            lyrics=self.lyrics, title='Mock Track')
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Remove test files"""
+        if os.path.exists(self.audio_path):
+            os.remove(self.audio_path)
+
+    def test_lookup(self):
+        """Lyrics should be searched for once, then read from the cache"""
+        self.assertEqual(self.stage.lookup('Mock Artist', 'Mock Track'), self.lyrics)
+        self.assertEqual(self.stage.lookup('mock artist ', 'Mock  Track'), self.lyrics)
+
+        self.mock_genius.search_song.assert_called_once_with('Mock Track', 'Mock Artist')
+
+    def test_lookup_not_found(self):
+        """Songs without lyrics should be cached until not_found_ttl passes"""
+        self.mock_genius.search_song.return_value = None
+
+        self.assertEqual(self.stage.lookup('Mock Artist', 'Mock Track'), '')
+        self.assertEqual(self.stage.lookup('Mock Artist', 'Mock Track'), '')
+        self.mock_genius.search_song.assert_called_once()
+
+        self.stage.not_found_ttl = -1
+        self.stage.lookup('Mock Artist', 'Mock Track')
+        self.assertEqual(self.mock_genius.search_song.call_count, 2)
+
+    def test_lookup_metrics(self):
+        """Cache hits and misses should be counted, and genius searches timed"""
+        self.stage.metrics = MagicMock()
+
+        self.stage.lookup('Mock Artist', 'Mock Track')
+        self.stage.lookup('Mock Artist', 'Mock Track')
+
+        self.stage.metrics.count.assert_any_call('cache', cache='lyrics', result='miss')
+        self.stage.metrics.count.assert_called_with('cache', cache='lyrics', result='hit')
+        self.stage.metrics.timer.assert_called_once_with(
+            'genius_search', track='Mock Artist - Mock Track')
+
+    def test_lookup_error(self):
+        """Failed searches should not be cached"""
+        self.mock_genius.search_song.side_effect = TimeoutError
+
+        self.assertEqual(self.stage.lookup('Mock Artist', 'Mock Track'), '')
+        self.storage.cache_set.assert_not_called()
+
+    def test_submit(self):
+        """Lyrics should be added to the finished file, timed as its tagging"""
+        self.stage.metrics = MagicMock()
+        with open(self.audio_path, 'wb') as f:
+            f.write(b'\x00' * 128)
+        ID3().save(self.audio_path)
+
+        future = self.stage.submit(self.audio_path, 'Mock Artist', 'Mock Track')
+        self.stage.wait()
+
+        self.assertTrue(future.result())
+        self.assertEqual(ID3(self.audio_path).getall('USLT')[0].text, self.lyrics)
+        self.stage.metrics.timer.assert_called_with(
+            'tagging', track='Mock Artist - Mock Track')
+
+    def test_submit_disabled(self):
+        """Nothing should be searched for when the stage is disabled"""
+        self.stage.enabled = False
+
+        self.assertIsNone(self.stage.submit(self.audio_path, 'Mock Artist', 'Mock Track'))
+        self.mock_genius.search_song.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
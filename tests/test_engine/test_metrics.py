@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+"""Tests the metrics module"""
+
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from threading import Thread
+from tenacity import retry, stop_after_attempt
+from engine.metrics import Metrics, NULL_TIMER
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.directory = os.path.join(self.temp_dir.name, '.spots_metrics')
+        self.metrics = Metrics()
+        self.addCleanup(self.metrics.stop)
+
+    def trace(self) -> list:
+        """reads the events of the trace"""
+        with open(self.metrics.trace_path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_disabled(self):
+        """Nothing should be timed, counted or written until metrics are started"""
+        @self.metrics.timed('stage')
+        def double(value):
+            return value * 2
+
+        self.assertIs(self.metrics.timer('stage'), NULL_TIMER)
+        with self.metrics.timer('stage'):
+            self.metrics.count('cache', cache='youtube_search', result='hit')
+        self.assertEqual(double(2), 4)
+
+        self.assertEqual(self.metrics.summary(), {})
+        self.assertEqual(self.metrics.counters(), {})
+        self.metrics.stop()
+        self.assertFalse(os.path.exists(self.directory))
+
+    def test_timer_and_count(self):
+        """Stages and counters should be traced as they happen"""
+        trace_path = self.metrics.start(self.directory, 'run')
+
+        with self.metrics.timer('youtube_search', query='Title - Artist Audio'):
+            self.metrics.count('cache', cache='youtube_search', result='miss')
+        with self.assertRaises(ValueError):
+            with self.metrics.timer('youtube_search'):
+                raise ValueError
+        self.metrics.count('bytes_downloaded', 2048, service='youtube')
+
+        self.assertEqual(trace_path, os.path.join(self.directory, 'spots-run.jsonl'))
+        events = self.trace()
+        self.assertListEqual([event['type'] for event in events],
+                             ['run_start', 'count', 'span', 'span', 'count'])
+        self.assertEqual(events[2]['stage'], 'youtube_search')
+        self.assertEqual(events[2]['query'], 'Title - Artist Audio')
+        self.assertTrue(events[2]['ok'])
+        self.assertFalse(events[3]['ok'])
+
+        summary = self.metrics.summary()['youtube_search']
+        self.assertEqual(summary['count'], 2)
+        self.assertEqual(summary['failures'], 1)
+
+    def test_timed_and_retried(self):
+        """Decorated functions should be timed, and tenacity retries counted"""
+        self.metrics.start(self.directory, 'run')
+        attempts = []
+
+        @self.metrics.timed('spotify_track')
+        @retry(stop=stop_after_attempt(3), before_sleep=self.metrics.retried('spotify_track'))
+        def get_track():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise ConnectionError
+            return 'track'
+
+        self.assertEqual(get_track(), 'track')
+        self.assertEqual(self.metrics.summary()['spotify_track']['count'], 1)
+        self.assertEqual(self.metrics.counters()[('retries', (('stage', 'spotify_track'),))], 2)
+
+    def test_write_textfile(self):
+        """Totals should be written in the Prometheus text format when stopped"""
+        self.metrics.start(self.directory, 'run')
+        for seconds in (0.1, 0.2, 0.3, 0.4):
+            self.metrics.record('encode', seconds)
+        self.metrics.count('cache', cache='deezer_metadata', result='hit')
+        self.metrics.count('cache', cache='deezer_metadata', result='hit')
+        self.metrics.count('throttled', service='spo"tify')
+
+        self.metrics.stop()
+
+        with open(os.path.join(self.directory, 'spots.prom')) as f:
+            lines = f.read().splitlines()
+        self.assertIn('# TYPE spots_stage_seconds summary', lines)
+        self.assertIn('spots_stage_seconds{stage="encode",quantile="0.5"} 0.200000', lines)
+        self.assertIn('spots_stage_seconds{stage="encode",quantile="0.95"} 0.400000', lines)
+        self.assertIn('spots_stage_seconds_count{stage="encode"} 4', lines)
+        self.assertIn('spots_stage_failures_total{stage="encode"} 0', lines)
+        self.assertIn('# TYPE spots_cache_total counter', lines)
+        self.assertIn('spots_cache_total{cache="deezer_metadata",result="hit"} 2', lines)
+        self.assertIn('spots_throttled_total{service="spo\\"tify"} 1', lines)
+        self.assertEqual(self.trace()[-1]['type'], 'run_end')
+
+    def test_count_from_threads(self):
+        """Counts from several threads at once should all be kept"""
+        self.metrics.start(self.directory, 'run')
+
+        def count():
+            for _ in range(100):
+                self.metrics.count('tracks', status='downloaded')
+
+        threads = [Thread(target=count) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.metrics.counters()[('tracks', (('status', 'downloaded'),))], 800)
+        self.assertEqual(len(self.trace()), 801)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+"""Tests the rate_limiter module"""
+
+import unittest
+from email.utils import formatdate
+from time import monotonic, time
+from unittest.mock import patch, MagicMock
+from deezer.exceptions import DeezerErrorResponse
+from engine.rate_limiter import RateLimiter
+from spotipy.exceptions import SpotifyException
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        self.limiter = RateLimiter(rates={'spotify': 50}, burst=2)
+
+    def test_acquire(self):
+        """Calls beyond the burst should be paced at the rate of the service"""
+        start = monotonic()
+        for _ in range(7):
+            self.limiter.acquire('spotify')
+
+        # 2 calls in the burst, then 5 calls at 50 per second
+        self.assertGreaterEqual(monotonic() - start, 0.09)
+
+    def test_service(self):
+        """Api hosts should be grouped by service"""
+        self.assertEqual(self.limiter.service('api.spotify.com'), 'spotify')
+        self.assertEqual(self.limiter.service('accounts.spotify.com'), 'spotify')
+        self.assertEqual(self.limiter.service('i.scdn.co'), 'covers')
+        self.assertEqual(self.limiter.service('example.com'), 'example.com')
+
+    @patch('engine.rate_limiter.sleep')
+    def test_call_retries_throttled_call(self, mock_sleep):
+        """A throttled call should pause the service for its Retry-After and be retried"""
+        function = MagicMock(side_effect=[
+            SpotifyException(429, -1, 'rate limited', headers={'Retry-After': '3'}),
+            'Mock Result'
+        ])
+
+        self.assertEqual(self.limiter.call('spotify', function, 'Mock Id'), 'Mock Result')
+        self.assertEqual(function.call_count, 2)
+        function.assert_called_with('Mock Id')
+        self.assertAlmostEqual(mock_sleep.call_args_list[0][0][0], 3, delta=0.1)
+
+    @patch('engine.rate_limiter.sleep')
+    def test_call_raises_other_errors(self, mock_sleep):
+        """Errors that are not throttling should not be retried"""
+        function = MagicMock(side_effect=SpotifyException(404, -1, 'not found'))
+
+        with self.assertRaises(SpotifyException):
+            self.limiter.call('spotify', function)
+        function.assert_called_once()
+
+    @patch('engine.rate_limiter.sleep')
+    def test_call_gives_up(self, mock_sleep):
+        """A call throttled on every attempt should raise after retries"""
+        self.limiter.retries = 2
+        function = MagicMock(side_effect=DeezerErrorResponse(
+            {'error': {'type': 'Exception', 'message': 'Quota limit exceeded', 'code': 4}}))
+
+        with self.assertRaises(DeezerErrorResponse):
+            self.limiter.call('deezer', function)
+        self.assertEqual(function.call_count, 3)
+
+    def test_throttle_backs_off(self):
+        """Without Retry-After, pauses should grow exponentially up to max_backoff"""
+        self.limiter.max_backoff = 4
+        pauses = [self.limiter.throttle('deezer') for _ in range(4)]
+
+        self.assertTrue(1 <= pauses[0] <= 2)
+        self.assertTrue(2 <= pauses[1] <= 4)
+        self.assertTrue(2 <= pauses[3] <= 4)
+
+        self.limiter.succeed('deezer')
+        self.assertTrue(1 <= self.limiter.throttle('deezer') <= 2)
+
+    def test_parse_retry_after(self):
+        """Retry-After should be read in seconds or as an http date"""
+        self.assertEqual(self.limiter.parse_retry_after('5'), 5)
+        self.assertEqual(self.limiter.parse_retry_after(None), 0)
+        self.assertEqual(self.limiter.parse_retry_after('soon'), 0)
+        self.assertAlmostEqual(self.limiter.parse_retry_after(
+            formatdate(time() + 30, usegmt=True)), 30, delta=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
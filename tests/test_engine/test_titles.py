@@ -0,0 +1,18 @@
+#!/usr/bin/python3
+"""Tests the titles module"""
+
+import unittest
+from engine.titles import title_key
+
+
+class TestTitles(unittest.TestCase):
+
+    def test_title_key(self):
+        """Titles differing in case, spacing or '/' should share a key"""
+        self.assertEqual(title_key('AC/DC  -  Back In Black '), 'ac|dc - back in black')
+        self.assertEqual(title_key('Straße - Title'), title_key('STRASSE - title'))
+        self.assertNotEqual(title_key('Artist - Title'), title_key('Artist - Title 2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
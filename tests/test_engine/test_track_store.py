@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""Tests the track_store module"""
+
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from mutagen.id3 import ID3, TIT2
+from engine.track_store import TrackStore
+from engine.transcoder import Transcoder
+
+
+class TestTrackStore(unittest.TestCase):
+
+    def setUp(self):
+        """Set up test methods"""
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.library = self.temp_dir.name
+        self.store = TrackStore(os.path.join(self.library, '.spots_store'))
+
+    def write(self, *names: str, content: bytes = b'audio') -> str:
+        """writes a file in the library"""
+        file_path = os.path.join(self.library, *names)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as f:
+            f.write(content)
+        return file_path
+
+    def test_put(self):
+        """A file should be moved into the store by content and linked back"""
+        file_path = self.write('Playlist 1', 'Artist - Title.mp3')
+
+        stored = self.store.put(file_path)
+
+        self.assertEqual(stored, os.path.realpath(self.store.object_path(
+            self.store.digest(file_path), '.mp3')))
+        self.assertTrue(os.path.samefile(stored, file_path))
+        self.assertEqual(os.stat(file_path).st_nlink, 2)
+
+    def test_put_same_content_stored_once(self):
+        """Files with the same content should share one file in the store"""
+        first = self.store.put(self.write('Playlist 1', 'Artist - Title.mp3'))
+        second_path = self.write('Playlist 2', 'Artist - Title.mp3')
+
+        self.assertEqual(self.store.put(second_path), first)
+        self.assertTrue(os.path.samefile(second_path, first))
+        self.assertEqual(os.stat(first).st_nlink, 3)
+
+        other = self.store.put(self.write('Playlist 2', 'Other.mp3', content=b'other'))
+        self.assertNotEqual(other, first)
+
+    def test_digest_skips_lyrics(self):
+        """Lyrics written to a stored mp3 should not change its name"""
+        file_path = self.write('Playlist 1', 'Artist - Title.mp3', content=b'\xff\xfb' * 512)
+        tags = ID3()
+        tags.add(TIT2(encoding=3, text='Title'))
+        tags.save(file_path)
+        stored = self.store.put(file_path)
+
+        Transcoder.add_lyrics(file_path, 'Verse 1...')
+
+        self.assertEqual(os.path.realpath(
+            self.store.object_path(self.store.digest(file_path), '.mp3')), stored)
+        self.assertEqual(ID3(stored).getall('USLT')[0].text, 'Verse 1...')
+
+    def test_put_same_audio_other_tags(self):
+        """Mp3s with the same audio but other tags should each keep their tags"""
+        stored = []
+        for title in ('Title', 'Title (Remastered)'):
+            file_path = self.write(title, f'Artist - {title}.mp3', content=b'\xff\xfb' * 512)
+            tags = ID3()
+            tags.add(TIT2(encoding=3, text=title))
+            tags.save(file_path)
+            stored.append(self.store.put(file_path))
+
+            self.assertEqual(str(ID3(file_path)['TIT2']), title)
+
+        self.assertNotEqual(stored[0], stored[1])
+
+    def test_link(self):
+        """A file should be linked into a new folder, once"""
+        stored = self.store.put(self.write('Playlist 1', 'Artist - Title.mp3'))
+        destination = os.path.join(self.library, 'Playlist 2', 'Artist - Title.mp3')
+
+        self.store.link(stored, destination)
+        self.store.link(destination, destination)
+
+        self.assertTrue(os.path.samefile(destination, stored))
+        self.assertEqual(os.listdir(os.path.dirname(destination)), ['Artist - Title.mp3'])
+
+    @patch('engine.track_store.link')
+    def test_link_falls_back(self, mock_link):
+        """A file should be linked symbolically, or copied, without hard links"""
+        mock_link.side_effect = OSError
+        stored = self.store.put(self.write('Playlist 1', 'Artist - Title.mp3'))
+        destination = os.path.join(self.library, 'Playlist 2', 'Artist - Title.mp3')
+
+        self.store.link(stored, destination)
+        self.assertTrue(os.path.islink(destination))
+        self.assertTrue(os.path.samefile(destination, stored))
+
+        copied = os.path.join(self.library, 'Playlist 3', 'Artist - Title.mp3')
+        with patch('engine.track_store.symlink', side_effect=OSError):
+            self.store.link(stored, copied)
+        self.assertFalse(os.path.islink(copied))
+        with open(copied, 'rb') as f:
+            self.assertEqual(f.read(), b'audio')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+"""Tests the transcoder module"""
+
+import os
+import unittest
+from subprocess import run
+from concurrent.futures import Future
+from time import perf_counter, sleep
+from unittest.mock import patch
+from engine.transcoder import Transcoder, TranscodePool, ffmpeg_binary
+from models.errors import TranscodeError
+from mutagen.id3 import ID3
+from mutagen.mp4 import MP4
+
+try:
+    FFMPEG = ffmpeg_binary()
+except TranscodeError:
+    FFMPEG = ''
+
+
+@unittest.skipUnless(FFMPEG, 'ffmpeg not installed')
+class TestTranscoder(unittest.TestCase):
+
+    def setUp(self):
+        """Create a short m4a file to convert"""
+        self.source = '.test_source.mp4'
+        self.output = '.test_output.mp3'
+        self.metadata = {
+            'title': 'Mock Track',
+            'artist': 'Mock Artist',
+            'tracknumber': '1/10',
+            'album': 'Mock Album',
+            'lyrics': 'Mock Lyrics\nVerse 1...',
+            'release_date': '2023',
+            'genre': 'Rap'
+        }
+        run([FFMPEG, '-loglevel', 'error', '-y', '-f', 'lavfi',
+             '-i', 'sine=duration=1', '-c:a', 'aac', '-f', 'mp4', self.source],
+            check=True)
+
+    def tearDown(self):
+        """Remove converted files"""
+        for file in [self.source, self.output, '.test_output.m4a']:
+            if os.path.exists(file):
+                os.remove(file)
+
+    def test_transcode(self):
+        """Method should convert to mp3 and tag the result"""
+        output = Transcoder().transcode(self.source, self.output, self.metadata)
+
+        self.assertEqual(output, self.output)
+        self.assertFalse(os.path.exists(f'{self.output}.part'))
+        tags = ID3(output)
+        self.assertEqual(str(tags['TIT2']), 'Mock Track')
+        self.assertEqual(str(tags['TPE1']), 'Mock Artist')
+        self.assertEqual(str(tags['TRCK']), '1/10')
+        self.assertEqual(tags.getall('USLT')[0].text, self.metadata['lyrics'])
+
+    def test_transcode_stream(self):
+        """Method should convert chunks of bytes piped to ffmpeg"""
+        with open(self.source, 'rb') as f:
+            data = f.read()
+        chunks = (data[i:i + 1024] for i in range(0, len(data), 1024))
+
+        Transcoder(bitrate='128k').transcode(chunks, self.output, self.metadata)
+
+        self.assertEqual(str(ID3(self.output)['TALB']), 'Mock Album')
+
+    def test_transcode_keep_native(self):
+        """Method should keep m4a audio without transcoding"""
+        output = Transcoder(keep_native=True).transcode(
+            self.source, self.output, self.metadata)
+
+        self.assertEqual(output, '.test_output.m4a')
+        self.assertEqual(MP4(output)['\xa9nam'], ['Mock Track'])
+
+    def test_transcode_error(self):
+        """Method should raise TranscodeError, leaving no partial file"""
+        with open(self.source, 'wb') as f:
+            f.write(b'not audio')
+
+        with self.assertRaises(TranscodeError):
+            Transcoder().transcode(self.source, self.output)
+        self.assertFalse(os.path.exists(f'{self.output}.part'))
+
+    @patch('engine.transcoder.Popen')
+    def test_presets(self, mock_popen):
+        """Quality presets and bitrates should select the encoder arguments"""
+        mock_popen.return_value.returncode = 1
+
+        for transcoder, arguments in [
+            (Transcoder('high'), ['-q:a', '0']),
+            (Transcoder('low'), ['-q:a', '5']),
+            (Transcoder(bitrate='320k'), ['-b:a', '320k']),
+        ]:
+            with self.assertRaises(TranscodeError):
+                transcoder.transcode(self.source, self.output)
+            command = mock_popen.call_args[0][0]
+            index = command.index('libmp3lame')
+            self.assertListEqual(command[index + 1:index + 3], arguments)
+
+
+@unittest.skipUnless(FFMPEG, 'ffmpeg not installed')
+class TestTranscodePool(unittest.TestCase):
+
+    def setUp(self):
+        """Create two short m4a files to convert"""
+        self.sources = ['.test_source_1.mp4', '.test_source_2.mp4']
+        self.outputs = ['.test_output_1.mp3', '.test_output_2.mp3']
+        for source in self.sources:
+            run([FFMPEG, '-loglevel', 'error', '-y', '-f', 'lavfi',
+                 '-i', 'sine=duration=1', '-c:a', 'aac', '-f', 'mp4', source],
+                check=True)
+
+    def tearDown(self):
+        """Remove converted files"""
+        for file in self.sources + self.outputs + [f'{self.outputs[0]}.part']:
+            if os.path.exists(file):
+                os.remove(file)
+
+    def test_submit(self):
+        """Files should be converted on the worker processes"""
+        pool = TranscodePool(Transcoder(), workers=2)
+        try:
+            conversions = [
+                pool.submit(source, output, {'title': 'Mock Track'})
+                for source, output in zip(self.sources, self.outputs)
+            ]
+            self.assertListEqual(
+                [conversion.result() for conversion in conversions], self.outputs)
+        finally:
+            pool.shutdown()
+
+        for output in self.outputs:
+            self.assertEqual(str(ID3(output)['TIT2']), 'Mock Track')
+
+    def test_transcode_error(self):
+        """Errors of the worker processes should be raised by transcode"""
+        with open(self.sources[0], 'wb') as f:
+            f.write(b'not audio')
+
+        pool = TranscodePool(Transcoder(), workers=1)
+        try:
+            with self.assertRaises(TranscodeError):
+                pool.transcode(self.sources[0], self.outputs[0])
+        finally:
+            pool.shutdown()
+
+    @patch('engine.transcoder.ProcessPoolExecutor')
+    def test_shutdown_cancel(self, mock_executor):
+        """Cancelling should remove the partial files of conversions in flight"""
+        mock_executor.return_value.submit.return_value = Future()
+        pool = TranscodePool(Transcoder(), workers=1)
+
+        pool.submit(self.sources[0], self.outputs[0])
+        with open(f'{self.outputs[0]}.part', 'wb') as f:
+            f.write(b'partial')
+        pool.shutdown(cancel=True)
+
+        mock_executor.return_value.shutdown.assert_called_once_with(
+            wait=True, cancel_futures=True)
+        self.assertFalse(os.path.exists(f'{self.outputs[0]}.part'))
+
+    @unittest.skipUnless(hasattr(os, 'mkfifo'), 'named pipes not supported')
+    def test_shutdown_cancel_in_flight(self):
+        """Cancelling should kill the conversions in flight instead of waiting for them"""
+        # ffmpeg waits on the pipe until it is killed, as nothing writes to it
+        os.remove(self.sources[0])
+        os.mkfifo(self.sources[0])
+        pool = TranscodePool(Transcoder(), workers=1)
+        conversion = pool.submit(self.sources[0], self.outputs[0])
+        sleep(0.5)
+
+        start = perf_counter()
+        pool.shutdown(cancel=True)
+
+        self.assertLess(perf_counter() - start, 5)
+        with self.assertRaises(TranscodeError):
+            conversion.result()
+        self.assertFalse(os.path.exists(self.outputs[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+"""Tests the download_pipeline module"""
+
+from threading import Event
+from time import perf_counter
+from unittest import TestCase, main
+from unittest.mock import call, patch, MagicMock
+from engine import transcode_pool
+from models.download_pipeline import DownloadPipeline
+from models.spotify_to_youtube import ProcessSpotifyLink
+from models.errors import InvalidURL
+
+
+class TestDownloadPipeline(TestCase):
+    """Test the DownloadPipeline class"""
+
+    def setUp(self):
+        self.tracks = [
+            {'title': f'Title {number}', 'artist': 'Artist'}
+            for number in range(5)
+        ]
+        self.pipeline = DownloadPipeline(jobs=2, encoders=2)
+
+    @patch('models.download_pipeline.ProcessSpotifyLink')
+    def test_run(self, mock_link):
+        """method should download and encode every track"""
+        mock_link.track_title = ProcessSpotifyLink.track_title
+        link = mock_link.return_value
+        link.download_audio.return_value = ('a.mp4', 'a.mp3', 'Artist - a')
+        link.encode_audio.return_value = True
+
+        results = self.pipeline.run(self.tracks, 'Playlist')
+
+        self.assertEqual(len(results), 5)
+        self.assertListEqual(
+            [result['title'] for result in results],
+            [f'Artist - Title {number}' for number in range(5)]
+        )
+        self.assertTrue(all(
+            result['status'] == 'downloaded' for result in results))
+        link.download_audio.assert_called_with('Playlist')
+        self.assertEqual(link.encode_audio.call_count, 5)
+        self.assertEqual(link.get_cover.call_count, 5)
+
+    @patch('models.download_pipeline.ProcessSpotifyLink')
+    def test_run_skipped_track(self, mock_link):
+        """tracks that are not downloaded should not be encoded"""
+        link = mock_link.return_value
+        link.download_audio.return_value = None
+
+        results = self.pipeline.run(self.tracks[:1])
+
+        self.assertEqual(results[0]['status'], 'skipped')
+        link.encode_audio.assert_not_called()
+
+    @patch('models.download_pipeline.ProcessSpotifyLink')
+    def test_run_streams_tracks(self, mock_link):
+        """the first track should download before the rest of the tracks are listed"""
+        started = Event()
+        waited = []
+        mock_link.return_value.download_audio.side_effect = lambda _: started.set()
+
+        def playlist():
+            yield self.tracks[0]
+            waited.append(started.wait(5))
+            yield self.tracks[1]
+
+        results = self.pipeline.run(playlist())
+
+        self.assertListEqual(waited, [True])
+        self.assertEqual(len(results), 2)
+        self.assertListEqual(self.pipeline.tracks, self.tracks[:2])
+
+    @patch('models.download_pipeline.transcode_pool')
+    @patch('models.download_pipeline.ProcessSpotifyLink')
+    def test_run_interrupted(self, mock_link, mock_pool):
+        """an interrupt should cancel the conversions without waiting for the tracks in flight"""
+        started, release = Event(), Event()
+        self.addCleanup(release.set)
+        mock_link.return_value.download_audio.side_effect = \
+            lambda _: started.set() or release.wait(10)
+
+        def playlist():
+            yield self.tracks[0]
+            started.wait(5)
+            raise KeyboardInterrupt
+
+        start = perf_counter()
+        with self.assertRaises(KeyboardInterrupt):
+            self.pipeline.run(playlist())
+
+        self.assertLess(perf_counter() - start, 5)
+        mock_pool.shutdown.assert_called_once_with(cancel=True)
+
+    @patch('models.download_pipeline.ProcessSpotifyLink')
+    def test_run_failed_track(self, mock_link):
+        """a failing track should be reported without stopping the others"""
+        first, second = MagicMock(), MagicMock()
+        first.download_audio.side_effect = InvalidURL
+        second.download_audio.return_value = ('b.mp4', 'b.mp3', 'Artist - b')
+        second.encode_audio.return_value = True
+        mock_link.side_effect = [first, second]
+
+        pipeline = DownloadPipeline(jobs=1, encoders=1)
+        results = pipeline.run(self.tracks[:2])
+
+        self.assertEqual(results[0]['status'], 'failed')
+        self.assertIn('InvalidURL', results[0]['error'])
+        self.assertEqual(results[1]['status'], 'downloaded')
+
+    @patch('models.download_pipeline.history')
+    @patch('models.download_pipeline.ProcessSpotifyLink')
+    def test_run_cover_failed(self, mock_link, mock_history):
+        """a track whose cover fails should release its reservation, so a retry downloads it"""
+        link = mock_link.return_value
+        link.download_audio.return_value = ('a.mp4', 'a.mp3', 'Artist - a')
+        link.get_cover.side_effect = OSError
+
+        results = self.pipeline.run(self.tracks[:1])
+
+        self.assertEqual(results[0]['status'], 'failed')
+        mock_history.release.assert_called_once_with('Artist - a')
+        link.encode_audio.assert_not_called()
+
+    @patch('models.download_pipeline.ProcessSpotifyLink')
+    def test_run_records_stages(self, mock_link):
+        """the stage each track reaches should be recorded in the job queue"""
+        mock_link.track_title = ProcessSpotifyLink.track_title
+        first, second = MagicMock(), MagicMock()
+        first.download_audio.return_value = ('a.mp4', 'a.mp3', 'Artist - a')
+        first.encode_audio.return_value = True
+        first.output_path = 'a.mp3'
+        first.lyrics_search = None
+        second.download_audio.side_effect = InvalidURL
+        mock_link.side_effect = [first, second]
+        queue = MagicMock()
+        tracks = [dict(track, link=f'mock_link_{number}')
+                  for number, track in enumerate(self.tracks[:2])]
+
+        DownloadPipeline(jobs=1, encoders=1, queue=queue).run(tracks)
+
+        queue.update.assert_any_call('mock_link_0', 'downloaded')
+        queue.update.assert_any_call('mock_link_0', 'encoded', path='a.mp3')
+        queue.update.assert_any_call('mock_link_0', 'tagged')
+        self.assertEqual(queue.fail.call_args[0][0], 'mock_link_1')
+
+    @patch('models.download_pipeline.history', {'Artist - Title 1', 'Artist - Title 3'})
+    @patch('models.download_pipeline.ProcessSpotifyLink.link_from_library')
+    @patch('models.download_pipeline.ProcessSpotifyLink.__init__')
+    def test_set_aside(self, mock_init, mock_link_from_library):
+        """tracks in the library or the download history should be set aside without a
+        youtube search, linking those in the library into the folder"""
+        mock_link_from_library.side_effect = \
+            lambda track, _: 'a.mp3' if track['title'] == 'Title 4' else ''
+        tracks = [dict(track, link=f'mock_link_{number}')
+                  for number, track in enumerate(self.tracks)]
+        queue = MagicMock()
+        skipped = []
+
+        to_download = list(self.pipeline.set_aside(iter(tracks), skipped, 'Playlist', queue))
+
+        self.assertListEqual(
+            [track['title'] for track in to_download], ['Title 0', 'Title 2'])
+        self.assertListEqual(
+            [result['title'] for result in skipped],
+            ['Artist - Title 1', 'Artist - Title 3', 'Artist - Title 4'])
+        self.assertTrue(all(result['status'] == 'skipped' for result in skipped))
+        mock_link_from_library.assert_called_with(tracks[4], 'Playlist')
+        mock_init.assert_not_called()
+        self.assertListEqual(queue.update.call_args_list, [
+            call(f'mock_link_{number}', 'tagged') for number in (1, 3, 4)])
+
+    def test_pool_sizes(self):
+        """jobs should be at least one and encoders default to the transcoding processes"""
+        pipeline = DownloadPipeline(jobs=0)
+        self.assertEqual(pipeline.jobs, 1)
+        self.assertEqual(pipeline.encoders, transcode_pool.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,8 @@
 """Tests the get_spotify_track module"""
 
 from unittest import main, TestCase
-from unittest.mock import patch, Mock
+from unittest.mock import patch
+from tenacity import stop_after_attempt
 from models.errors import InvalidURL
 from models.get_spotify_track import GetSpotifyTrack
 
@@ -25,14 +26,17 @@ class TestGetSpotifyTrack(TestCase):
             'track_number': 1,
             'external_urls': {'spotify': self.track_url}
         }
-        self.mock_lyrics = 'Mock Lyrics\nVerse 1:...'
+
+        # start every test with an empty metadata cache
+        patcher = patch('models.get_spotify_track.storage')
+        self.mock_storage = patcher.start()
+        self.mock_storage.get_by_id.return_value = None
+        self.mock_storage.cache_get.return_value = None
+        self.addCleanup(patcher.stop)
 
     @patch('models.get_spotify_track.GetSpotifyTrack.spotify.track')
-    @patch('models.get_spotify_track.GetSpotifyTrack.genius.search_song')
-    def test_get_track(self, mock_search_song, mock_track):
+    def test_get_track(self, mock_track):
         mock_track.return_value = self.mock_track_data
-        mock_search_song.return_value = Mock(
-            lyrics=self.mock_lyrics, title='Mock Track')
 
         result = self.track.get_track('6rqhFgbbKwnb9MLmUQDhG6')
 
@@ -41,10 +45,67 @@ class TestGetSpotifyTrack(TestCase):
         self.assertEqual(result['artist'], 'Mock Artist')
         self.assertEqual(result['tracknumber'], '1/10')
         self.assertEqual(result['album'], 'Mock Album')
-        self.assertEqual(result['lyrics'], self.mock_lyrics)
+        self.assertEqual(result['lyrics'], '')
         self.assertEqual(result['release_date'], '2023')
         self.assertEqual(result['link'], self.track_url)
 
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.track')
+    def test_get_track_from_storage(self, mock_track):
+        """cached metadata should be looked up by track id, without api calls"""
+        metadata = {'title': 'Mock Track', 'link': self.track_url}
+        self.mock_storage.get_by_id.return_value = metadata
+
+        self.track.track_url = 'https://open.spotify.com/playlist/4a9gZUsMoQoLoZGB1JeExu'
+        result = self.track.get_track('6rqhFgbbKwnb9MLmUQDhG6')
+
+        self.assertEqual(result, metadata)
+        self.mock_storage.get_by_id.assert_called_once_with('6rqhFgbbKwnb9MLmUQDhG6')
+        mock_track.assert_not_called()
+
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.track')
+    def test_get_track_failed_before(self, mock_track):
+        """ids that recently failed should not be requested again"""
+        self.mock_storage.cache_get.return_value = 'not found'
+
+        with self.assertRaises(InvalidURL):
+            self.track.get_track.retry_with(stop=stop_after_attempt(1), reraise=True)(
+                self.track, 'invalidId')
+
+        mock_track.assert_not_called()
+
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.tracks')
+    def test_get_tracks_skips_cached_and_failed_tracks(self, mock_tracks):
+        """only tracks missing from the caches should be resolved"""
+        cached = {'title': 'Cached Track', 'link': self.track_url}
+        self.mock_storage.get_by_id.side_effect = \
+            lambda track_id: cached if track_id == 'cached' else None
+        self.mock_storage.cache_get.side_effect = \
+            lambda namespace, track_id, ttl=None: 'not found' if track_id == 'failed' else None
+        mock_tracks.return_value = {
+            'tracks': [{'id': 'new', **self.mock_track_data}]
+        }
+
+        result = self.track.get_tracks(
+            [{'id': 'cached'}, {'id': 'failed'}, {'id': 'new'}])
+
+        mock_tracks.assert_called_once_with(['new'])
+        self.assertListEqual(
+            [metadata['title'] for metadata in result],
+            ['Cached Track', 'Mock Track']
+        )
+        self.mock_storage.new.assert_called_once_with(result[1])
+
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.tracks')
+    def test_get_tracks_caches_missing_tracks(self, mock_tracks):
+        """ids spotify does not find should be added to the negative cache"""
+        mock_tracks.return_value = {'tracks': [None]}
+
+        result = self.track.get_tracks([{'id': 'missing'}])
+
+        self.assertListEqual(result, [])
+        self.mock_storage.cache_set.assert_called_once_with(
+            'failed_tracks', 'missing', 'not found')
+
     @patch('models.get_spotify_track.GetSpotifyTrack.get_track')
     def test_process_url_with_invalid_url(self, mock_get_track):
         mock_get_track.side_effect = InvalidURL
@@ -53,80 +114,191 @@ class TestGetSpotifyTrack(TestCase):
 
     @patch('models.get_spotify_track.GetSpotifyTrack.spotify.track')
     @patch('models.get_spotify_track.GetSpotifyTrack.spotify.playlist')
-    @patch('models.get_spotify_track.GetSpotifyTrack.genius.search_song')
-    def test_process_url_with_playlist(self, mock_search_song, mock_playlist, mock_track):
+    def test_process_url_with_playlist(self, mock_playlist, mock_track):
         mock_track_data = {
             'tracks': {
                 'items': [
                     {
-                        'track': { 'id': '6rqhFgbbKwnb9MLmUQDhG6'}
+                        'track': {
+                            'id': '6rqhFgbbKwnb9MLmUQDhG6',
+                            **self.mock_track_data
+                        }
                     }
                 ]
             },
             'name': 'Mock Album',
         }
 
-        mock_track.return_value = self.mock_track_data
         mock_playlist.return_value = mock_track_data
-        mock_search_song.return_value = Mock(
-            lyrics=self.mock_lyrics, title='Mock Track')
 
         self.track.track_url = 'https://open.spotify.com/playlist/4a9gZUsMoQoLoZGB1JeExu?si=08a6190d929847ac'
         result = self.track.process_url()
 
         self.assertIsInstance(result, tuple)
+        result = (list(result[0]), result[1])
 
         self.assertEqual(result[0][0]['title'], 'Mock Track')
         self.assertEqual(result[0][0]['cover'], 'http://example.com')
         self.assertEqual(result[0][0]['artist'], 'Mock Artist')
         self.assertEqual(result[0][0]['tracknumber'], '1/10')
         self.assertEqual(result[0][0]['album'], 'Mock Album')
-        self.assertEqual(result[0][0]['lyrics'], self.mock_lyrics)
+        self.assertEqual(result[0][0]['lyrics'], '')
         self.assertEqual(result[0][0]['release_date'], '2023')
         self.assertEqual(result[0][0]['link'], self.track_url)
 
         self.assertEqual(result[1], 'Mock Album')
 
+        # metadata should be built from the playlist payload
+        mock_track.assert_not_called()
+
     @patch('models.get_spotify_track.GetSpotifyTrack.spotify.track')
     @patch('models.get_spotify_track.GetSpotifyTrack.spotify.album')
-    @patch('models.get_spotify_track.GetSpotifyTrack.genius.search_song')
-    def test_process_url_with_album(self, mock_search_song, mock_album, mock_track):
+    def test_process_url_with_album(self, mock_album, mock_track):
+        album_track = dict(self.mock_track_data)
+        album_data = album_track.pop('album')
         mock_track_data = {
             'tracks': {
                 'items': [
-                    { 'id': '6rqhFgbbKwnb9MLmUQDhG6'}
+                    {'id': '6rqhFgbbKwnb9MLmUQDhG6', **album_track}
                 ]
             },
-            'name': 'Mock Album',
+            **album_data
         }
 
-        mock_track.return_value = self.mock_track_data
         mock_album.return_value = mock_track_data
-        mock_search_song.return_value = Mock(
-            lyrics=self.mock_lyrics, title='Mock Track')
 
         self.track.track_url = 'https://open.spotify.com/album/4jJCOc3LIu8xUUhrXYs86E?si=axqLH0wzTlSSvULIQxz81g'
         result = self.track.process_url()
 
         self.assertIsInstance(result, tuple)
+        result = (list(result[0]), result[1])
 
         self.assertEqual(result[0][0]['title'], 'Mock Track')
         self.assertEqual(result[0][0]['cover'], 'http://example.com')
         self.assertEqual(result[0][0]['artist'], 'Mock Artist')
         self.assertEqual(result[0][0]['tracknumber'], '1/10')
         self.assertEqual(result[0][0]['album'], 'Mock Album')
-        self.assertEqual(result[0][0]['lyrics'], self.mock_lyrics)
+        self.assertEqual(result[0][0]['lyrics'], '')
         self.assertEqual(result[0][0]['release_date'], '2023')
         self.assertEqual(result[0][0]['link'], self.track_url)
 
         self.assertEqual(result[1], 'Mock Album')
 
+        # album data should be shared by its tracks
+        mock_track.assert_not_called()
+
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.next')
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.playlist')
+    def test_process_url_follows_playlist_pages(self, mock_playlist, mock_next):
+        """every page of a playlist should be yielded, fetching pages lazily"""
+        def page(number, next_page):
+            track = dict(self.mock_track_data, id=f'id{number}', name=f'Track {number}')
+            return {'items': [{'track': track}], 'next': next_page}
+
+        mock_playlist.return_value = {
+            'tracks': page(1, 'https://api.spotify.com/page2'),
+            'name': 'Mock Playlist'
+        }
+        mock_next.return_value = page(2, None)
+
+        self.track.track_url = 'https://open.spotify.com/playlist/4a9gZUsMoQoLoZGB1JeExu'
+        tracks, playlist_name = self.track.process_url()
+
+        self.assertEqual(next(tracks)['title'], 'Track 1')
+        mock_next.assert_not_called()
+
+        self.assertEqual(next(tracks)['title'], 'Track 2')
+        mock_next.assert_called_once()
+        self.assertListEqual(list(tracks), [])
+        self.assertEqual(playlist_name, 'Mock Playlist')
+
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.playlist_items')
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.playlist')
+    def test_sync_playlist_unchanged(self, mock_playlist, mock_playlist_items):
+        """a playlist with the snapshot of its last sync should not be processed"""
+        mock_playlist.return_value = {'name': 'Mock Playlist', 'snapshot_id': 'snapshot1'}
+        self.mock_storage.cache_get.return_value = {'snapshot_id': 'snapshot1', 'items': {}}
+
+        track = GetSpotifyTrack('https://open.spotify.com/playlist/4a9gZUsMoQoLoZGB1JeExu', sync=True)
+        tracks, playlist_name = track.process_url()
+
+        self.assertListEqual(list(tracks), [])
+        self.assertEqual(playlist_name, 'Mock Playlist')
+        mock_playlist.assert_called_once_with('4a9gZUsMoQoLoZGB1JeExu', fields='name,snapshot_id')
+        mock_playlist_items.assert_not_called()
+
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.playlist_items')
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.playlist')
+    def test_sync_playlist_delta(self, mock_playlist, mock_playlist_items):
+        """only items added since the last sync should be processed, and the snapshot
+        recorded once committed, without the tracks that failed to resolve"""
+        mock_playlist.return_value = {'name': 'Mock Playlist', 'snapshot_id': 'snapshot2'}
+        self.mock_storage.cache_get.side_effect = lambda namespace, key, ttl=None: {
+            'playlists': {'snapshot_id': 'snapshot1', 'items': {'id1': '2023-01-01T00:00:00Z'}},
+            'failed_tracks': 'not found' if key == 'id3' else None,
+        }.get(namespace)
+        mock_playlist_items.return_value = {
+            'items': [
+                {'added_at': '2023-01-01T00:00:00Z',
+                 'track': dict(self.mock_track_data, id='id1', name='Old Track')},
+                {'added_at': '2023-02-01T00:00:00Z',
+                 'track': dict(self.mock_track_data, id='id2', name='New Track')},
+                {'added_at': '2023-02-01T00:00:00Z',
+                 'track': dict(self.mock_track_data, id='id3', name='Failed Track')},
+            ],
+            'next': None
+        }
+
+        track = GetSpotifyTrack('https://open.spotify.com/playlist/4a9gZUsMoQoLoZGB1JeExu', sync=True)
+        tracks, _ = track.process_url()
+
+        self.assertListEqual([metadata['title'] for metadata in tracks], ['New Track'])
+        # nothing is recorded until the tracks are downloaded
+        self.mock_storage.cache_set.assert_not_called()
+
+        self.assertTrue(track.commit_sync())
+        self.assertFalse(track.commit_sync())
+        self.mock_storage.cache_set.assert_called_once_with('playlists', '4a9gZUsMoQoLoZGB1JeExu', {
+            'snapshot_id': 'snapshot2',
+            'items': {'id1': '2023-01-01T00:00:00Z', 'id2': '2023-02-01T00:00:00Z'}
+        })
+
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.tracks')
+    def test_get_tracks_fetches_incomplete_tracks_in_batches(self, mock_tracks):
+        """incomplete track objects should be fetched 50 ids at a time"""
+        ids = [f'id{number}' for number in range(60)]
+        mock_tracks.side_effect = lambda batch: {
+            'tracks': [
+                {'id': track_id, **self.mock_track_data} for track_id in batch
+            ]
+        }
+
+        result = self.track.get_tracks([{'id': track_id} for track_id in ids])
+
+        self.assertEqual(len(result), 60)
+        self.assertEqual(mock_tracks.call_count, 2)
+        self.assertEqual(len(mock_tracks.call_args_list[0][0][0]), 50)
+        self.assertEqual(result[0]['tracknumber'], '1/10')
+
+    @patch('models.get_spotify_track.GetSpotifyTrack.spotify.albums')
+    def test_get_tracks_fetches_each_album_once(self, mock_albums):
+        """incomplete albums should be fetched once for all their tracks"""
+        track = dict(self.mock_track_data, album={'id': 'album1'})
+        mock_albums.return_value = {
+            'albums': [{'id': 'album1', **self.mock_track_data['album']}]
+        }
+
+        result = self.track.get_tracks([
+            dict(track, id='track1'), dict(track, id='track2')
+        ])
+
+        mock_albums.assert_called_once_with(['album1'])
+        self.assertEqual(result[1]['album'], 'Mock Album')
+        self.assertEqual(result[1]['cover'], 'http://example.com')
+
     @patch('models.get_spotify_track.GetSpotifyTrack.spotify.track')
-    @patch('models.get_spotify_track.GetSpotifyTrack.genius.search_song')
-    def test_process_url_with_single(self, mock_search_song, mock_track):
+    def test_process_url_with_single(self, mock_track):
         mock_track.return_value = self.mock_track_data
-        mock_search_song.return_value = Mock(
-            lyrics=self.mock_lyrics, title='Mock Track')
 
         result = self.track.process_url()
 
@@ -135,7 +307,7 @@ class TestGetSpotifyTrack(TestCase):
         self.assertEqual(result['artist'], 'Mock Artist')
         self.assertEqual(result['tracknumber'], '1/10')
         self.assertEqual(result['album'], 'Mock Album')
-        self.assertEqual(result['lyrics'], self.mock_lyrics)
+        self.assertEqual(result['lyrics'], '')
         self.assertEqual(result['release_date'], '2023')
         self.assertEqual(result['link'], self.track_url)
 
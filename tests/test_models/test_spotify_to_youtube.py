@@ -1,11 +1,15 @@
 #!/usr/bin/python3
 """Tests the spotify_to_youtube module"""
 
-from os import path, remove
+from os import makedirs, path, remove
+from tempfile import TemporaryDirectory
 from unittest import TestCase, main
-from unittest.mock import patch, MagicMock, Mock, mock_open
-from models.errors import TitleExistsError, InvalidURL
-from mutagen.id3 import ID3
+from unittest.mock import patch, MagicMock, PropertyMock
+from engine import history
+from engine.audio_stream import AudioStream
+from engine.library_index import LibraryIndex
+from engine.track_store import TrackStore
+from models.errors import TitleExistsError, InvalidURL, TranscodeError
 from models.spotify_to_youtube import ProcessSpotifyLink
 
 
@@ -26,65 +30,90 @@ class TestProcessSpotifyLink(TestCase):
         }
         self.history_file = '.spots_download_history.txt'
         self.youtube_url = 'https://youtu.be/4hCogXAzONk'
+
+        # an empty library, so no track is linked instead of downloaded
+        library = TemporaryDirectory()
+        self.addCleanup(library.cleanup)
+        self.library = library.name
+        self.library_index = LibraryIndex(path.join(self.library, '.spots_library.db'))
+        self.addCleanup(self.library_index.close)
+        for name, value in (('library_index', self.library_index),
+                            ('track_store', TrackStore(path.join(self.library, '.spots_store')))):
+            patcher = patch(f'models.spotify_to_youtube.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
         self.process_spotify_link = ProcessSpotifyLink(
             self.spotify_track, self.youtube_url)
 
     def tearDown(self):
         """Remove any test files"""
+        history.reload()
         history_file = ".spots_download_history.txt"
         if path.exists(history_file):
             remove(history_file)
 
-    @patch("models.spotify_to_youtube.open", new_callable=mock_open)
-    def test_add_to_download_history(self, mock_file):
+    def test_add_to_download_history(self):
         """Tests adding titles to download history"""
-        # Setup the mock file to have some content (existing titles)
-        mock_file.return_value.read.return_value = "Title 1\nTitle 2\nTitle 3\n"
-
         # Test adding a new title to the history
         new_title = "New Title"
         self.process_spotify_link.add_to_download_history(new_title, True)
 
-        # Ensure the file was opened in append mode and the new title was written
-        mock_file.assert_called_with(
-            ".spots_download_history.txt", "a", newline="")
+        # Ensure the new title is written to the history file
+        history.flush()
+        with open(self.history_file) as file:
+            self.assertIn(new_title, file.read().split('\n'))
 
         # Test adding an existing title, should raise TitleExistsError
-        existing_title = "Title 2"
         with self.assertRaises(TitleExistsError):
-            self.process_spotify_link.add_to_download_history(
-                existing_title, True)
-
-        # Ensure the file was not opened in append mode (since we're not adding a new title)
-        mock_file.assert_called_with(".spots_download_history.txt", "r")
-
-    @patch("models.spotify_to_youtube.get")
-    @patch("models.spotify_to_youtube.MP3")
-    def test_update_metadata(self, mock_mp3, mock_get):
-        """tests that method updates metadata tags on mp3 file"""
-        test_path = 'test_file.mp3'
-
-        # Create a mock ID3 and image objects
-        audio_mock = Mock(spec=ID3)
-        cover_mock = b""
-
-        # set return values
-        mock_get.return_value.content = cover_mock
-        mock_mp3.return_value = audio_mock
-
-        self.process_spotify_link.update_metadata(test_path)
-
-        audio_mock.save.assert_called_once_with(test_path)
+            self.process_spotify_link.add_to_download_history(new_title, True)
 
-    @patch("models.spotify_to_youtube.VideosSearch")
-    def test_get_youtube_video(self, mock_video_search):
+    @patch("models.spotify_to_youtube.storage")
+    @patch("youtubesearchpython.VideosSearch")
+    def test_get_youtube_video(self, mock_video_search, mock_storage):
         """method should return the first url for a title search on youtube"""
+        mock_storage.cache_get.return_value = None
         mock_result = MagicMock()
         url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
         mock_result.result.return_value = {'result': [{'link': url}]}
         mock_video_search.return_value = mock_result
         result = self.process_spotify_link.get_youtube_video("Test Title")
         self.assertEqual(result, url)
+        mock_storage.cache_set.assert_called_once_with(
+            'youtube_search', 'test title audio', url)
+
+    @patch("models.spotify_to_youtube.storage")
+    @patch("youtubesearchpython.VideosSearch")
+    def test_get_youtube_video_cached(self, mock_video_search, mock_storage):
+        """a query searched for before should not be searched for again"""
+        url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+        mock_storage.cache_get.return_value = url
+
+        result = self.process_spotify_link.get_youtube_video(" test  TITLE")
+
+        self.assertEqual(result, url)
+        mock_storage.cache_get.assert_called_once_with(
+            'youtube_search', 'test title audio', ProcessSpotifyLink.search_ttl)
+        mock_video_search.assert_not_called()
+
+    @patch('models.spotify_to_youtube.storage')
+    @patch('models.spotify_to_youtube.YouTube')
+    @patch('models.spotify_to_youtube.ProcessSpotifyLink.get_youtube_video')
+    def test_download_audio_unavailable_cached_video(
+            self, mock_get_youtube_video, mock_youtube, mock_storage):
+        """a cached search result that was taken down should be searched for again"""
+        unavailable = MagicMock()
+        unavailable.check_availability.side_effect = Exception
+        mock_youtube.side_effect = [unavailable, MagicMock()]
+        mock_get_youtube_video.return_value = 'https://youtu.be/newId'
+        self.process_spotify_link.search_key = 'cached query audio'
+
+        self.process_spotify_link.download_audio()
+
+        mock_storage.cache_delete.assert_called_once_with(
+            'youtube_search', 'cached query audio')
+        self.assertEqual(self.process_spotify_link.youtube_url, 'https://youtu.be/newId')
+        self.assertEqual(mock_youtube.call_count, 2)
 
     @patch('models.spotify_to_youtube.getenv')
     @patch('models.spotify_to_youtube.YouTube')
@@ -114,16 +143,79 @@ class TestProcessSpotifyLink(TestCase):
         audio = mock_youtube_instance.streams.get_audio_only
         audio.assert_called_once_with()
 
-        # should download to a file name based on title
-        audio.return_value.download.assert_called_once_with(
-            output_path='', filename=f'{self.title}.mp4'
-        )
-        # and convert it to mp3
-        mock_convert_to_mp3.assert_called_once_with(
-            f'{self.title}.mp4',
-            f'{self.title}.mp3',
-            self.title
-        )
+        # should stream to the encoder without downloading a file
+        audio.return_value.download.assert_not_called()
+        stream, new_file, title = mock_convert_to_mp3.call_args[0]
+        self.assertIsInstance(stream, AudioStream)
+        self.assertEqual(stream.url, mock_audio_stream.url)
+        # named after the title, and converted to mp3
+        self.assertEqual(stream.file_path, f'{self.title}.mp4')
+        self.assertEqual(new_file, f'{self.title}.mp3')
+        self.assertEqual(title, self.title)
+
+    @patch('models.spotify_to_youtube.YouTube')
+    @patch('models.spotify_to_youtube.ProcessSpotifyLink.convert_to_mp3')
+    def test_download_youtube_video_to_directory(self, mock_convert_to_mp3, mock_youtube):
+        """tests that the track is saved to the directory given, created if missing"""
+        mock_youtube.return_value.streams.get_audio_only.return_value.mime_type = 'audio/webm'
+
+        with TemporaryDirectory() as library:
+            directory = path.join(library, 'Mock Playlist')
+            self.process_spotify_link.download_youtube_video(directory)
+
+            self.assertTrue(path.isdir(directory))
+            stream, new_file, _ = mock_convert_to_mp3.call_args[0]
+            self.assertEqual(stream.file_path, path.join(directory, f'{self.title}.webm'))
+            self.assertEqual(new_file, path.join(directory, f'{self.title}.mp3'))
+
+    @patch('models.spotify_to_youtube.rate_limiter')
+    @patch('models.spotify_to_youtube.YouTube')
+    def test_download_audio_stream_lookup_rate_limited(self, mock_youtube, mock_rate_limiter):
+        """tests that the streams of the video are looked up through the rate limiter"""
+        streams = PropertyMock()
+        type(mock_youtube.return_value).streams = streams
+        looked_up_before = []
+
+        def call(service, function):
+            looked_up_before.append(streams.called)
+            return function()
+
+        mock_rate_limiter.call.side_effect = call
+
+        with TemporaryDirectory() as library:
+            self.process_spotify_link.download_audio(library)
+
+        self.assertEqual(mock_rate_limiter.call.call_args[0][0], 'youtube')
+        self.assertFalse(any(looked_up_before))
+        streams.return_value.get_audio_only.assert_called_once_with()
+
+    @patch('models.spotify_to_youtube.YouTube')
+    def test_download_youtube_video_linked_from_library(self, mock_youtube):
+        """tests that a track downloaded to another folder is linked instead of downloaded"""
+        downloaded = path.join(self.library, 'Playlist 1', f'{self.title}.mp3')
+        makedirs(path.dirname(downloaded))
+        with open(downloaded, 'wb') as f:
+            f.write(b'\x00' * 128)
+        self.library_index.add(downloaded, self.spotify_track, self.youtube_url)
+        directory = path.join(self.library, 'Playlist 2')
+
+        self.assertIsNone(self.process_spotify_link.download_audio(directory))
+
+        linked = path.join(directory, f'{self.title}.mp3')
+        self.assertTrue(path.samefile(linked, downloaded))
+        self.assertEqual(self.library_index.get(linked)['youtube_id'], '4hCogXAzONk')
+        mock_youtube.return_value.streams.get_audio_only.assert_not_called()
+        self.assertNotIn(self.title, history)
+
+    def test_link_from_library_not_found(self):
+        """tests that tracks not in the library, or removed from disk, are not linked"""
+        directory = path.join(self.library, 'Playlist')
+        self.assertEqual(ProcessSpotifyLink.link_from_library(self.spotify_track, directory), '')
+
+        self.library_index.add(path.join(self.library, 'gone.mp3'), self.spotify_track,
+                               size=1, mtime=1)
+        self.assertEqual(ProcessSpotifyLink.link_from_library(self.spotify_track, directory), '')
+        self.assertFalse(path.exists(directory))
 
     @patch('models.spotify_to_youtube.getenv')
     @patch('models.spotify_to_youtube.md5')
@@ -164,16 +256,11 @@ class TestProcessSpotifyLink(TestCase):
         audio = mock_youtube_instance.streams.get_audio_only
         audio.assert_called_once_with()
 
-        # should download to a file name based on title
-        audio.return_value.download.assert_called_once_with(
-            output_path='', filename=f'{hex_digest[:25]}.mp4'
-        )
-        # and convert it to mp3
-        mock_convert_to_mp3.assert_called_once_with(
-            f'{hex_digest[:25]}.mp4',
-            f'{hex_digest[:25]}.mp3',
-            f'Lakeyah - {long_title}'
-        )
+        # should name the stream after the hash, and convert it to mp3
+        stream, new_file, title = mock_convert_to_mp3.call_args[0]
+        self.assertEqual(stream.file_path, f'{hex_digest[:25]}.mp4')
+        self.assertEqual(new_file, f'{hex_digest[:25]}.mp3')
+        self.assertEqual(title, f'Lakeyah - {long_title}')
 
     @patch('models.spotify_to_youtube.YouTube')
     @patch('models.spotify_to_youtube.ProcessSpotifyLink.convert_to_mp3')
@@ -181,7 +268,7 @@ class TestProcessSpotifyLink(TestCase):
         """tests that method does nothing when no youtube url is provided"""
         self.process_spotify_link.youtube_url = None
 
-        self.process_spotify_link.download_youtube_video()
+        self.assertFalse(self.process_spotify_link.download_youtube_video())
 
         mock_youtube.assert_not_called()
         mock_convert_to_mp3.assert_not_called()
@@ -195,24 +282,95 @@ class TestProcessSpotifyLink(TestCase):
         with self.assertRaises(InvalidURL):
             self.process_spotify_link.download_youtube_video()
 
-    @patch('models.spotify_to_youtube.AudioFileClip')
-    @patch('models.spotify_to_youtube.ProcessSpotifyLink.update_metadata')
-    def test_convert_to_mp3(self, mock_update_metadata, mock_audio_clip):
-        """tests that method converts audio file to mp3"""
-        mock_audio = MagicMock()
-        mock_audio_clip.return_value = mock_audio
-        old_file = 'file.wav'
+    @patch('models.spotify_to_youtube.track_store')
+    @patch('models.spotify_to_youtube.library_index')
+    @patch('models.spotify_to_youtube.lyrics')
+    @patch('models.spotify_to_youtube.remove')
+    @patch('models.spotify_to_youtube.path.isfile')
+    @patch('models.spotify_to_youtube.transcode_pool')
+    @patch('models.spotify_to_youtube.ProcessSpotifyLink.get_cover')
+    def test_convert_to_mp3(self, mock_get_cover, mock_transcode_pool, mock_isfile,
+                            mock_remove, mock_lyrics, mock_library_index, mock_track_store):
+        """tests that method converts audio file to mp3, tagging it in the same pass"""
+        mock_get_cover.return_value = b'cover'
+        mock_isfile.return_value = True
+        mock_transcode_pool.transcode.return_value = 'file.mp3'
+        old_file = 'file.mp4'
         new_file = 'file.mp3'
         song_title = 'Mock Song Title'
 
-        mock_update_metadata.side_effect = lambda *args, **kwargs: None
-
         self.process_spotify_link.convert_to_mp3(
             old_file, new_file, song_title)
 
-        mock_audio.write_audiofile.assert_called_once_with(
-            new_file, codec='mp3')
+        mock_transcode_pool.transcode.assert_called_once_with(
+            old_file, new_file, self.spotify_track, b'cover', 'mp4')
+        mock_remove.assert_called_once_with(old_file)
+        self.assertIn(song_title, history)
+        # the track has no lyrics, so they are searched for afterwards
+        mock_lyrics.submit.assert_called_once_with(
+            'file.mp3', 'Lakeyah', 'Mind Yo Business (feat. Latto)')
+        # the file is kept once in the store, and indexed with its links
+        mock_track_store.put.assert_called_once_with('file.mp3')
+        mock_library_index.add.assert_called_once_with(
+            'file.mp3', self.spotify_track, self.process_spotify_link.youtube_url,
+            duration=None)
+
+        # stored before the lyrics thread writes to the file
+        calls = MagicMock()
+        calls.attach_mock(mock_track_store.put, 'put')
+        calls.attach_mock(mock_library_index.add, 'add')
+        calls.attach_mock(mock_lyrics.submit, 'submit')
+        calls.reset_mock()
+        self.process_spotify_link.convert_to_mp3(old_file, 'other.mp3', 'Other Title')
+        self.assertListEqual([call[0] for call in calls.mock_calls], ['put', 'add', 'submit'])
+
+    @patch('models.spotify_to_youtube.track_store')
+    @patch('models.spotify_to_youtube.library_index')
+    @patch('models.spotify_to_youtube.lyrics')
+    @patch('models.spotify_to_youtube.transcode_pool')
+    @patch('models.spotify_to_youtube.ProcessSpotifyLink.get_cover')
+    def test_convert_stream_to_mp3(self, mock_get_cover, mock_transcode_pool, mock_lyrics,
+                                   mock_library_index, mock_track_store):
+        """tests that method converts an audio stream, removing its partial file"""
+        mock_get_cover.return_value = b''
+        stream = MagicMock(spec=AudioStream)
+        stream.file_path = 'file.webm'
 
+        self.process_spotify_link.convert_to_mp3(
+            stream, 'file.mp3', 'Mock Stream Title')
+
+        mock_transcode_pool.transcode.assert_called_once_with(
+            stream, 'file.mp3', self.spotify_track, b'', 'webm')
+        stream.remove.assert_called_once_with()
+        self.assertIn('Mock Stream Title', history)
+
+    @patch('models.spotify_to_youtube.cover_cache')
+    @patch('models.spotify_to_youtube.lyrics')
+    @patch('models.spotify_to_youtube.transcode_pool')
+    @patch('models.spotify_to_youtube.YouTube')
+    def test_encode_failure_retried(self, mock_youtube, mock_transcode_pool, mock_lyrics,
+                                    mock_cover_cache):
+        """A track that failed to convert should be downloaded again when retried"""
+        mock_youtube.return_value.streams.get_audio_only.return_value.mime_type = 'audio/webm'
+        output = path.join(self.library, f'{self.title}.mp3')
+
+        def transcode(*args):
+            with open(output, 'wb') as f:
+                f.write(b'audio')
+            return output
+
+        mock_transcode_pool.transcode.side_effect = TranscodeError('failed')
+
+        downloaded = self.process_spotify_link.download_audio(self.library)
+        self.assertFalse(self.process_spotify_link.encode_audio(*downloaded))
+        self.assertNotIn(self.title, history)
+
+        mock_transcode_pool.transcode.side_effect = transcode
+        downloaded = self.process_spotify_link.download_audio(self.library)
+        self.assertIsNotNone(downloaded)
+        self.assertTrue(self.process_spotify_link.encode_audio(*downloaded))
+        self.assertIn(self.title, history)
+        self.assertEqual(mock_transcode_pool.transcode.call_count, 2)
 
 if __name__ == '__main__':
     main()
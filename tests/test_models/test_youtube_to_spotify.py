@@ -3,8 +3,8 @@
 
 from datetime import datetime
 import unittest
-from unittest.mock import patch, MagicMock, Mock
-from models.errors import InvalidURL
+from unittest.mock import patch, MagicMock, PropertyMock
+from models.errors import InvalidURL, MetadataNotFound
 from models.youtube_to_spotify import ProcessYoutubeLink
 
 
@@ -15,6 +15,29 @@ class TestProcessYoutubeLink(unittest.TestCase):
         self.youtube_url = 'https://youtu.be/4wKFIBmefiY'
         self.title = "BIA - CAN'T TOUCH THIS"
 
+        # storage cache entries kept in a dictionary
+        self.entries = {}
+        patcher = patch('models.youtube_to_spotify.storage')
+        self.mock_storage = patcher.start()
+        self.mock_storage.cache_get.side_effect = \
+            lambda namespace, key, ttl=None: self.entries.get((namespace, key))
+        self.mock_storage.cache_set.side_effect = \
+            lambda namespace, key, value: self.entries.__setitem__((namespace, key), value)
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def deezer_track() -> MagicMock:
+        """a deezer search result"""
+        deezer_response = MagicMock()
+        deezer_response.title = "CAN'T TOUCH THIS"
+        deezer_response.album.cover = "https://example.mock"
+        deezer_response.artist.name = "BIA"
+        deezer_response.track_position = 1
+        deezer_response.album.nb_tracks = 12
+        deezer_response.album.title = "CAN'T TOUCH THIS"
+        deezer_response.album.release_date = datetime.strptime("2023", "%Y")
+        return deezer_response
+
     @patch('models.youtube_to_spotify.YouTube')
     def test_get_title(self, mock_youtube):
         """Tests that the get_title method returns a title to be searched for"""
@@ -26,6 +49,30 @@ class TestProcessYoutubeLink(unittest.TestCase):
         self.assertEqual(search_title, self.title)
         self.assertEqual(youtube_video_title, "CAN'T TOUCH THIS")
 
+    @patch('models.youtube_to_spotify.rate_limiter')
+    @patch('models.youtube_to_spotify.YouTube')
+    def test_get_title_rate_limited(self, mock_youtube, mock_rate_limiter):
+        """Tests that the title and author of the video are read through the rate limiter"""
+        title = PropertyMock(return_value="CAN'T TOUCH THIS")
+        author = PropertyMock(return_value='BIA')
+        type(mock_youtube.return_value).title = title
+        type(mock_youtube.return_value).author = author
+        read_before = []
+
+        def call(service, function):
+            read_before.append((title.call_count, author.call_count))
+            return function()
+
+        mock_rate_limiter.call.side_effect = call
+
+        search_title, _ = ProcessYoutubeLink(self.youtube_url).get_title()
+
+        self.assertEqual(search_title, self.title)
+        # availability, then title, then author, each read inside its call
+        self.assertListEqual(read_before, [(0, 0), (0, 0), (1, 0)])
+        self.assertEqual(author.call_count, 1)
+        self.assertTrue(all(args[0][0] == 'youtube' for args in mock_rate_limiter.call.call_args_list))
+
     @patch('models.youtube_to_spotify.YouTube')
     def test_get_title_raises_error(self, mock_youtube):
         """Tests that the get_title method raises an InvalidURL exception with an url"""
@@ -67,14 +114,11 @@ class TestProcessYoutubeLink(unittest.TestCase):
         self.assertEqual(search_title, self.title)
         self.assertListEqual(condition, [True, True])
 
-    @patch('models.get_spotify_track.GetSpotifyTrack.genius.search_song')
     @patch('models.youtube_to_spotify.ProcessYoutubeLink.deezer_client.search')
-    def test_get_metadata(self, mock_deezer, mock_genius):
+    def test_get_metadata(self, mock_deezer):
         """Tests that the get_metadata method returns a dict with metadata"""
         # create mock instances
         deezer_response = MagicMock()
-        mock_genius.return_value = Mock(
-            lyrics="Mock Lyrics\nVerse 1...", title="CAN'T TOUCH THIS")
 
         # set required properties
         deezer_response.title = "CAN'T TOUCH THIS"
@@ -97,11 +141,53 @@ class TestProcessYoutubeLink(unittest.TestCase):
         self.assertEqual(metadata['artist'], 'BIA')
         self.assertEqual(metadata['tracknumber'], '1/12')
         self.assertEqual(metadata['album'], "CAN'T TOUCH THIS")
-        self.assertEqual(metadata['lyrics'], 'Mock Lyrics\nVerse 1...')
+        # lyrics are added after the download
+        self.assertEqual(metadata['lyrics'], '')
         self.assertEqual(metadata['release_date'], '2023')
         self.assertEqual(metadata['link'], self.youtube_url)
         self.assertEqual(metadata['genre'], '')
 
+    @patch('models.youtube_to_spotify.ProcessYoutubeLink.deezer_client.search')
+    def test_get_metadata_cached(self, mock_deezer):
+        """A title should be searched for on deezer once"""
+        mock_deezer.return_value = [self.deezer_track()]
+
+        proc_yt_link = ProcessYoutubeLink(self.youtube_url)
+        first = proc_yt_link.get_metadata(self.title, self.youtube_url)
+        second = proc_yt_link.get_metadata(f' {self.title.lower()}', 'https://youtu.be/other')
+
+        self.assertEqual(first['title'], second['title'])
+        self.assertEqual(second['link'], 'https://youtu.be/other')
+        mock_deezer.assert_called_once_with(self.title)
+
+    @patch('models.youtube_to_spotify.ProcessYoutubeLink.deezer_client.search')
+    def test_get_metadata_not_found_cached(self, mock_deezer):
+        """A title not found on deezer should not be searched for again"""
+        mock_deezer.return_value = []
+
+        proc_yt_link = ProcessYoutubeLink(self.youtube_url)
+        for _ in range(2):
+            with self.assertRaises(MetadataNotFound):
+                proc_yt_link.get_metadata(self.title, self.youtube_url)
+
+        mock_deezer.assert_called_once()
+
+    @patch('models.youtube_to_spotify.ProcessYoutubeLink.download_youtube_video')
+    @patch('models.youtube_to_spotify.ProcessYoutubeLink.get_title')
+    @patch('models.youtube_to_spotify.ProcessYoutubeLink.deezer_client.search')
+    def test_process_youtube_url(self, mock_deezer, mock_get_title, mock_download):
+        """The metadata found by search_title should be downloaded with"""
+        mock_deezer.return_value = [self.deezer_track()]
+        mock_get_title.return_value = (self.title, "CAN'T TOUCH THIS")
+
+        proc_yt_link = ProcessYoutubeLink(self.youtube_url)
+        proc_yt_link.process_youtube_url('Music')
+
+        mock_deezer.assert_called_once()
+        mock_download.assert_called_once_with('Music')
+        self.assertEqual(proc_yt_link.spotify_track['title'], "CAN'T TOUCH THIS")
+        self.assertEqual(proc_yt_link.spotify_track['link'], self.youtube_url)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+"""Tests that starting the cli stays fast, and rejects invalid options"""
+
+import sys
+import unittest
+from os import path
+from subprocess import run
+
+# the root of the repository, where main.py is
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+# modules of the api clients, only imported once they are used
+CLIENT_MODULES = ('spotipy', 'deezer', 'lyricsgenius', 'youtubesearchpython')
+
+
+def run_python(code: str):
+    """runs python code in a new interpreter from the repository root"""
+    return run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_help_imports_no_clients(self):
+        """main.py --help should not import the api clients"""
+        result = run_python(
+            "import atexit, sys\n"
+            f"atexit.register(lambda: print([m for m in {CLIENT_MODULES!r} if m in sys.modules]))\n"
+            "sys.argv = ['main.py', '--help']\n"
+            "import main\n"
+        )
+
+        self.assertIn('usage:', result.stdout)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], '[]')
+
+    def test_import_creates_no_clients(self):
+        """Importing the models should not import or create the api clients"""
+        result = run_python(
+            "import sys\n"
+            "import download_urls, models.youtube_to_spotify\n"
+            f"print([m for m in {CLIENT_MODULES!r} if m in sys.modules])\n"
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '[]')
+
+    def test_invalid_rate(self):
+        """main.py should reject rates of unknown services and rates of 0 or below"""
+        for rate in ('spotfy=2', 'spotify=0', 'youtube=-1', 'deezer=fast'):
+            result = run([sys.executable, 'main.py', '--rate', rate], cwd=ROOT,
+                         capture_output=True, text=True)
+
+            self.assertEqual(result.returncode, 2, rate)
+            self.assertIn(f'invalid rate: {rate}', result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()